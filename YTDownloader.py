@@ -8,122 +8,4207 @@ __author__: Final[str] = "realshouzy"
 __license__: Final[str] = "MIT"
 __copyright__: Final[str] = "Copyright (c) 2022-present realshouzy"
 
+import concurrent.futures
+import http
+import importlib.util
+import json
+import os
+import queue
 import re
-import webbrowser
-from concurrent.futures import ThreadPoolExecutor
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import urllib
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager, nullcontext, suppress
+from functools import partial
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, Final, NamedTuple, Protocol
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    BinaryIO,
+    ContextManager,
+    Final,
+    Hashable,
+    NamedTuple,
+    Protocol,
+    TextIO,
+    TypeVar,
+    cast,
+)
+from urllib.parse import parse_qs, unquote, urlsplit
+
+if TYPE_CHECKING:
+    import argparse
+    import asyncio
+    import http.client  # noqa: TCH004
+    import multiprocessing
+    import subprocess
+    import urllib.request  # noqa: TCH004
+    import webbrowser
+    from collections.abc import (
+        AsyncIterable,
+        AsyncIterator,
+        Callable,
+        Coroutine,
+        Generator,
+        Iterable,
+        Iterator,
+        Sequence,
+    )
+    from concurrent.futures import Future
+    from types import ModuleType
+
+    import PySimpleGUI as sg
+    import pytube
+    import pytube.exceptions
+    import pytube.request
+    from pytube import Stream
+    from typing_extensions import Self
+
+
+def _lazy_import(name: str) -> ModuleType:
+    """Return the module, which is only executed once one of its attributes is used."""
+    if (module := sys.modules.get(name)) is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None or spec.loader is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader: importlib.util.LazyLoader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+if sys.platform.startswith("linux"):
+    import fcntl
+
+# the heavy dependencies are only loaded on the code paths using them:
+# the gui toolkit once a window is created, so the command line interface
+# runs without a display, and pytube and the http stack once a url is resolved
+if not TYPE_CHECKING:
+    argparse = _lazy_import("argparse")
+    asyncio = _lazy_import("asyncio")
+    multiprocessing = _lazy_import("multiprocessing")
+    subprocess = _lazy_import("subprocess")
+    _lazy_import("http.client")
+    _lazy_import("urllib.request")
+    webbrowser = _lazy_import("webbrowser")
+    sg = _lazy_import("PySimpleGUI")
+    pytube = _lazy_import("pytube")
+
+
+_T = TypeVar("_T")
+
+
+class DownloadOptions(NamedTuple):
+    """Tuple-like class holding the download options.
+
+    Adaptive options download the video and the audio as separate streams
+    and mux them, without a resolution or bitrate the best ones are chosen.
+    """
+
+    resolution: str | None
+    type: str
+    progressive: bool
+    abr: str | None
+    adaptive: bool = False
+
+
+# defining download options
+LD: Final[DownloadOptions] = DownloadOptions(
+    resolution="360p",
+    type="video",
+    progressive=True,
+    abr=None,
+)
+HD: Final[DownloadOptions] = DownloadOptions(
+    resolution="720p",
+    type="video",
+    progressive=True,
+    abr=None,
+)
+AUDIO: Final[DownloadOptions] = DownloadOptions(
+    resolution=None,
+    type="audio",
+    progressive=False,
+    abr="128kbps",
+)
+BEST: Final[DownloadOptions] = DownloadOptions(
+    resolution=None,
+    type="video",
+    progressive=False,
+    abr=None,
+    adaptive=True,
+)
+DOWNLOAD_OPTIONS: Final[tuple[DownloadOptions, ...]] = (HD, LD, AUDIO)
+_PROFILES: Final[dict[str, DownloadOptions]] = {
+    "HD": HD,
+    "LD": LD,
+    "AUDIO": AUDIO,
+    "BEST": BEST,
+}
+
+# a handful of parallel transfers saturates a typical home connection,
+# since YouTube throttles each single connection well below that
+_DEFAULT_MAX_DOWNLOAD_WORKERS: Final[int] = 4
+_MAX_DOWNLOAD_WORKERS: Final[int] = 16
+# the download manager of the start window runs this many jobs at once,
+# the videos of a playlist are downloaded by the workers of its job
+_DEFAULT_MAX_JOBS: Final[int] = 3
+# a large stream can be split into segments downloaded over separate connections
+_DEFAULT_SEGMENTS: Final[int] = 1
+_MAX_SEGMENTS: Final[int] = 16
+_DEFAULT_MIN_SEGMENT_SIZE: Final[int] = 4 * 1024 * 1024
+# progress is published at most ten times per second, however many transfers run
+_PROGRESS_INTERVAL: Final[float] = 0.1
+_SPEED_SMOOTHING: Final[float] = 0.3
+# a limited transfer may exceed its rate by the bytes of a tenth of a second at once
+_BANDWIDTH_BURST: Final[float] = 0.1
+_RATE_UNITS: Final[dict[str, int]] = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+# the limit file of the command line is checked for changes every second
+_LIMIT_FILE_INTERVAL: Final[float] = 1.0
+_RATE_PATTERN: Final[re.Pattern[str]] = re.compile(
+    r"(\d+(?:\.\d*)?)\s*([KMG]?)(?:I?B)?(?:/S)?",
+    re.IGNORECASE,
+)
+
+
+class StreamInfo(NamedTuple):
+    """Tuple-like class holding the information about a stream of a video.
+
+    Unlike ``pytube.Stream`` it can be stored and loaded again
+    without fetching anything from YouTube. An adaptive video stream holds
+    the audio stream it is muxed with, its file size includes the audio.
+    The file size is ``0`` while it is unknown, the estimated file size is
+    computed from the bitrate and the length of the video without any request.
+    """
+
+    video_id: str
+    title: str
+    itag: int
+    url: str
+    mime_type: str
+    type: str
+    resolution: str | None
+    abr: str | None
+    is_progressive: bool
+    filesize: int
+    estimated_filesize: int = 0
+    audio: StreamInfo | None = None
+
+    def download(  # noqa: PLR0913
+        self,
+        output_path: str,
+        filename: str,
+        on_progress: Callable[[int, int], None] | None = None,
+        segments: int = 1,
+        min_segment_size: int = _DEFAULT_MIN_SEGMENT_SIZE,
+        archive: DownloadArchive | None = None,
+        limiter: BandwidthLimiter | None = None,
+        muxer: Callable[[Path, Path, Path], object] | None = None,
+    ) -> str:
+        """Download the stream, resuming a previously interrupted download.
+
+        The stream is fetched again from YouTube if its url has expired.
+        With more than one segment, parts of the stream are downloaded in parallel.
+        A stream already stored in the archive is linked instead of downloaded.
+        The download is one transfer of the bandwidth limiter, if one is given.
+        The video and the audio of an adaptive stream are downloaded at the same
+        time and combined by the muxer, which is ffmpeg by default.
+        """
+        file_path: Path = Path(output_path) / filename
+        with _measure("download", self.video_id):
+            try:
+                return self._download(
+                    file_path,
+                    on_progress,
+                    segments,
+                    min_segment_size,
+                    archive,
+                    limiter,
+                    muxer,
+                )
+            except BaseException:
+                # a failed download does not keep the empty file reserving its name
+                _remove_reservation(file_path)
+                raise
+
+    def _download(  # noqa: PLR0913
+        self,
+        file_path: Path,
+        on_progress: Callable[[int, int], None] | None,
+        segments: int,
+        min_segment_size: int,
+        archive: DownloadArchive | None,
+        limiter: BandwidthLimiter | None,
+        muxer: Callable[[Path, Path, Path], object] | None,
+    ) -> str:
+        if (
+            archive is not None
+            and not (file_path.is_file() and file_path.stat().st_size)
+            and (stored_path := archive.find(self.video_id, self.itag)) is not None
+        ):
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            # the empty file only reserved the name
+            _remove_reservation(file_path)
+            _clone_file(stored_path, file_path)
+            if on_progress is not None:
+                on_progress(self.filesize, self.filesize)
+        elif self.audio is not None:
+            _download_adaptive(
+                self,
+                file_path,
+                on_progress,
+                segments,
+                min_segment_size,
+                limiter,
+                muxer or _mux_with_ffmpeg,
+            )
+        else:
+            self.fetch(file_path, on_progress, segments, min_segment_size, limiter)
+
+        if archive is not None:
+            archive.add(self.video_id, self.itag, file_path)
+        return str(file_path)
+
+    def fetch(  # noqa: PLR0913
+        self,
+        file_path: Path,
+        on_progress: Callable[[int, int], None] | None = None,
+        segments: int = 1,
+        min_segment_size: int = _DEFAULT_MIN_SEGMENT_SIZE,
+        limiter: BandwidthLimiter | None = None,
+    ) -> None:
+        """Download only this stream into the file, without its audio stream.
+
+        An unknown file size, e.g. of a stream whose size was only estimated,
+        is probed first, since resuming and verifying the download need it.
+        """
+        url: str = self.url
+        if _is_stream_url_expired(url):
+            url = _get_live_stream(
+                pytube.YouTube(_watch_url(self.video_id)),
+                self.itag,
+            ).url
+        filesize: int = self.filesize - (
+            self.audio.filesize if self.audio is not None else 0
+        )
+        _download_segmented(
+            url,
+            file_path,
+            filesize if filesize > 0 else _probe_filesize(self._replace(url=url)),
+            on_progress,
+            segments,
+            min_segment_size,
+            throttle=limiter.transfer() if limiter is not None else _ignore_chunk,
+        )
+
+
+class VideoInfo(NamedTuple):
+    """Tuple-like class holding the information about a video and its streams."""
+
+    video_id: str
+    title: str
+    length: int
+    views: int
+    author: str
+    channel_url: str
+    thumbnail_url: str
+    description: str
+    streams: tuple[StreamInfo, ...]
+
+
+class PlaylistInfo(NamedTuple):
+    """Tuple-like class holding the information about a playlist and its videos."""
+
+    playlist_id: str
+    title: str
+    length: int
+    views: int
+    owner: str
+    owner_url: str
+    last_updated: str
+    video_ids: tuple[str, ...]
+
+
+class PlaylistItem(NamedTuple):
+    """Tuple-like class holding what is kept of a stream selected for a playlist.
+
+    Unlike ``StreamInfo`` it holds nothing but what is needed to show and download
+    the stream, so a window can keep one for every video of a huge playlist.
+    The file size includes the audio of an adaptive stream and is ``0``
+    while it is unknown. The url expires at the unix time ``expires``,
+    which is ``0`` if the url does not tell.
+    """
+
+    video_id: str
+    title: str
+    itag: int
+    url: str
+    filesize: int
+    estimated_filesize: int
+    expires: int
+
+
+class YouTubeUrl(NamedTuple):
+    """Tuple-like class holding what a YouTube url links to.
+
+    A url of a video in a playlist holds the ids of both, it links to the video.
+    """
+
+    url: str
+    video_id: str | None
+    playlist_id: str | None
+    start: int | None
+
+    @property
+    def is_playlist(self) -> bool:
+        """Return whether the url links to a playlist rather than to a video."""
+        return self.video_id is None
+
+    @property
+    def canonical_url(self) -> str:
+        """Return the url of the watch page of the video or of the playlist."""
+        if self.video_id is None:
+            return f"https://www.youtube.com/playlist?list={self.playlist_id}"
+        return _watch_url(self.video_id)
+
+
+class UrlClassification(NamedTuple):
+    """Tuple-like class holding urls classified by what they link to."""
+
+    unique: list[YouTubeUrl]
+    duplicates: list[YouTubeUrl]
+    invalid: list[str]
+
+
+class ProgressSnapshot(NamedTuple):
+    """Tuple-like class holding the aggregated progress of concurrent transfers."""
+
+    bytes_done: int
+    total_bytes: int
+    items_done: int
+    total_items: int
+    bytes_per_second: float
+    eta: float | None
+
+    @property
+    def percent(self) -> int:
+        """Return the share of the bytes done in percent."""
+        if self.total_bytes <= 0:
+            return 100 if self.items_done >= self.total_items else 0
+        return min(self.bytes_done * 100 // self.total_bytes, 100)
+
+
+class _DuplicateGroup(NamedTuple):
+    """Tuple-like class holding the separate copies of a stream in the archive."""
+
+    video_id: str
+    itag: int
+    size: int
+    paths: tuple[Path, ...]
+
+
+class _DownloadResult(NamedTuple):
+    """Tuple-like class holding a finished download and the error it failed with."""
+
+    stream: StreamInfo
+    error: BaseException | None
+
+
+class _ProcessingResult(NamedTuple):
+    """Tuple-like class holding a post-processed file, how long it took and its error."""
+
+    path: Path
+    seconds: float
+    error: str | None
+
+
+class Job(NamedTuple):
+    """Tuple-like class holding a requested download of the job queue.
+
+    The target is the directory of a playlist or the file of a video,
+    it is assigned once the job is started and kept when it is resumed.
+    A synced playlist only downloads the videos missing in its directory
+    and prunes the ones removed from the playlist.
+    """
+
+    job_id: int
+    url: str
+    profile: str
+    output_dir: Path
+    priority: int
+    sync: bool
+    prune: bool
+    state: str
+    attempts: int
+    target: Path | None
+    error: str | None
+
+
+class JobItem(NamedTuple):
+    """Tuple-like class holding a video downloaded by a job."""
+
+    video_id: str
+    path: Path
+    state: str
+    bytes_done: int
+    filesize: int
+    attempts: int
+
+
+class DownloadStatus(NamedTuple):
+    """Tuple-like class holding the state of a job run by the download manager.
+
+    The title is ``None`` until the video or playlist has been resolved,
+    the ETA while the speed is unknown.
+    """
+
+    job_id: int
+    url: str
+    title: str | None
+    state: str
+    percent: int
+    bytes_per_second: float
+    eta: float | None
+    error: str | None
+
+
+# events written by the background resolution into the download windows
+_INFO_RESOLVED_EVENT: Final[str] = "-INFORESOLVED-"
+_STREAMS_RESOLVED_EVENT: Final[str] = "-STREAMSRESOLVED-"
+_RESOLUTION_FAILED_EVENT: Final[str] = "-RESOLUTIONFAILED-"
+_PROGRESS_EVENT: Final[str] = "-PROGRESS-"
+_DOWNLOAD_FINISHED_EVENT: Final[str] = "-DOWNLOADFINISHED-"
+# the start window lists the jobs of the download manager this often
+_QUEUE_REFRESH_INTERVAL: Final[int] = 500
+
+_LOADING_PLACEHOLDER: Final[str] = "Loading..."
+_SIZE_KEYS: Final[dict[DownloadOptions, str]] = {
+    HD: "-HDSIZE-",
+    LD: "-LDSIZE-",
+    AUDIO: "-AUDIOSIZE-",
+}
+
+# urls are split into their parts instead of being matched against one pattern,
+# the patterns only match single parts and can not backtrack much
+_YOUTUBE_HOSTS: Final[frozenset[str]] = frozenset(
+    {"youtube.com", "youtube-nocookie.com", "youtu.be"},
+)
+_YOUTUBE_HOST_PREFIXES: Final[tuple[str, ...]] = ("www.", "m.")
+_YOUTUBE_VIDEO_PATHS: Final[frozenset[str]] = frozenset(
+    {"embed", "v", "watch", "shorts", "live", "e"},
+)
+_YOUTUBE_VIDEO_ID_PATTERN: Final[re.Pattern[str]] = re.compile(r"[\w\-]{11}")
+_YOUTUBE_PLAYLIST_ID_PATTERN: Final[re.Pattern[str]] = re.compile(r"[\w\-]{34}")
+_YOUTUBE_START_PATTERN: Final[re.Pattern[str]] = re.compile(
+    r"(?:(\d{1,6})h)?(?:(\d{1,6})m)?(?:(\d{1,9})s?)?",
+)
+
+
+# the media is requested in ranges like pytube does, since YouTube throttles
+# requests for the whole file, and the progress is saved after every range
+_RANGE_SIZE: Final[int] = 9 * 1024 * 1024
+_CHUNK_SIZE: Final[int] = 64 * 1024
+_DEFAULT_MAX_RETRIES: Final[int] = 3
+_PART_SUFFIX: Final[str] = ".part"
+_SIDECAR_SUFFIX: Final[str] = ".part.json"
+# the videos downloaded into the directory of a playlist, which is synced with it
+_MANIFEST_NAME: Final[str] = ".ytdownloader.json"
+_HTTP_HEADERS: Final[dict[str, str]] = {
+    "User-Agent": "Mozilla/5.0",
+    "accept-language": "en-US,en",
+}
+# connections are kept alive and shared by all requests,
+# a host gets at most as many connections as a stream has segments
+_DEFAULT_MAX_CONNECTIONS_PER_HOST: Final[int] = _MAX_SEGMENTS
+# the download engine bounds how many videos are resolved and how many sizes are
+# probed at once, more would only wait for a connection of the pool,
+# while any number of videos wait for their turn as lightweight tasks
+_DEFAULT_MAX_RESOLUTIONS: Final[int] = _DEFAULT_MAX_CONNECTIONS_PER_HOST
+_DEFAULT_MAX_PROBES: Final[int] = _DEFAULT_MAX_CONNECTIONS_PER_HOST
+# the probed sizes are remembered for the streams of a few large playlists
+_MAX_PROBED_FILESIZES: Final[int] = 4096
+# the allocators of the directories downloaded into most recently are kept
+_MAX_FILE_NAME_ALLOCATORS: Final[int] = 64
+
+# a watch page is fetched at most once per hour, the size of the cache is bounded
+_DEFAULT_CACHE_TTL: Final[float] = 60 * 60
+_DEFAULT_CACHE_MAX_SIZE: Final[int] = 32 * 1024 * 1024
+# the processes running jobs send a heartbeat, the jobs of a process which crashed
+# or was killed are taken over once their heartbeat is older than a few intervals
+_JOB_HEARTBEAT_INTERVAL: Final[float] = 2.0
+_JOB_STALE_AFTER: Final[float] = 10.0
+# the jobs queued in the start window are kept apart from the command line ones
+_GUI_JOB_QUEUE_NAME: Final[str] = "gui-jobs.sqlite3"
+# a failed job is retried by the next runs until it was attempted this often
+_MAX_JOB_ATTEMPTS: Final[int] = 3
+_INCOMPLETE_JOB_ERROR: Final[str] = "not every video was downloaded"
+_PENDING: Final[str] = "pending"
+_RUNNING: Final[str] = "running"
+_COMPLETED: Final[str] = "completed"
+_FAILED: Final[str] = "failed"
+# downloaded files are post-processed in separate processes next to the downloads,
+# every ``{}`` in the arguments of a command is replaced by the path of the file
+_DEFAULT_MAX_PROCESSES: Final[int] = 2
+_MAX_PROCESSES: Final[int] = 16
+_PATH_PLACEHOLDER: Final[str] = "{}"
+# the phases of the program whose durations, bytes, requests and retries are measured
+_METRICS_PHASES: Final[tuple[str, ...]] = (
+    "classify",
+    "fetch",
+    "resolve",
+    "probe",
+    "download",
+)
+# the ioctl cloning a file on copy-on-write file systems like btrfs and xfs on linux
+_FICLONE: Final[int] = 0x40049409
+# the characters Windows forbids in file names, which are removed from titles
+_FORBIDDEN_FILE_NAME_CHARACTERS: Final[dict[int, int | None]] = str.maketrans(
+    "",
+    "",
+    r'"\/:*?<>|',
+)
+
+
+# defining helper functions
+def _create_playlist_dir(root: Path | str, sub: Path | str) -> Path:
+    """Create the directory of the playlist and return it.
+
+    The directory is incremented if the user downloads a playlist more than once.
+    """
+    return _get_file_name_allocator(root).create_dir(str(sub))
+
+
+def _find_interrupted_playlist_dir(root: Path | str, sub: Path | str) -> Path | None:
+    """Return the directory of an interrupted download of the playlist, if there is any.
+
+    A download was interrupted if the directory still contains partial files.
+    """
+    path: Path = Path(f"{root}/{sub}")
+    i: int = 1
+    while path.exists():
+        if any(path.glob(f"*{_SIDECAR_SUFFIX}")):
+            return path
+        path = Path(f"{root}/{sub} ({i})")
+        i += 1
+    return None
+
+
+def _find_synced_playlist_dir(
+    root: Path | str,
+    sub: Path | str,
+    playlist_id: str,
+) -> Path:
+    """Return the directory the playlist is synced with.
+
+    It is the directory whose manifest belongs to the playlist,
+    or a new one, so the downloads of other playlists are never touched.
+    """
+    path: Path = Path(f"{root}/{sub}")
+    i: int = 1
+    while path.exists():
+        if (_read_manifest(path) or {}).get("playlist_id") == playlist_id:
+            return path
+        path = Path(f"{root}/{sub} ({i})")
+        i += 1
+    return path
+
+
+def _increment_video_file_name(root: Path | str, file_name: str) -> str:
+    """Increment the file if the user downloads a video more than once.
+
+    The file name stays reserved by an empty file until it is released.
+    """
+    return _get_file_name_allocator(root, ".mp4").reserve(file_name)
+
+
+def _remove_forbidden_characters_from_file_name(name: str) -> str:
+    r"""Remove '"' '\', '/', ':', '*', '?', '<', '>', '|' from a a file name.
+
+    This avoids an OSError while saving or moving a file on Windows.
+    """
+    return name.translate(_FORBIDDEN_FILE_NAME_CHARACTERS)
+
+
+class FileNameAllocator:
+    """Allocator of names in a directory, which are not taken by another file.
+
+    The directory is listed only once, the names taken by its entries
+    and the ones reserved since are kept in memory together with the next number
+    to try for every name, so the n-th copy of a name is found without testing
+    the copies before it again. Only the name found is tested on disk by creating
+    its entry exclusively, in case it was taken since the directory was listed.
+    Names are found under a lock, so concurrent downloads never get the same name.
+    All names get the suffix.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        suffix: str = "",
+        taken: Iterable[str] = (),
+    ) -> None:
+        self.directory: Path = directory
+        self.suffix: str = suffix
+        self._lock: threading.Lock = threading.Lock()
+        self._taken: set[str] = {f"{name}{suffix}" for name in taken}
+        self._listed: bool = False
+        self._next_numbers: dict[str, int] = {}
+
+    def reserve(self, name: str) -> str:
+        """Return the name or its first copy ``name (n)``, which is not taken yet.
+
+        The name is reserved by creating an empty file, which fails if the file
+        exists, so not even another process can reserve it at the same time.
+        The name returned is taken until it is released.
+        """
+        return self._claim(name, _create_empty_file)
+
+    def take(self, name: str) -> None:
+        """Take the name without reserving it, e.g. for a file being resumed."""
+        with self._lock:
+            self._taken.add(f"{name}{self.suffix}")
+
+    def release(self, name: str) -> None:
+        """Allow the reserved name to be reserved again, unless a file took it.
+
+        The empty file reserving the name is removed.
+        """
+        _remove_reservation(self.directory / f"{name}{self.suffix}")
+        with self._lock:
+            self._taken.discard(f"{name}{self.suffix}")
+
+    def create_dir(self, name: str) -> Path:
+        """Create a directory with the name or its first copy, which is not taken yet.
+
+        Creating the directory fails if it exists, so not even another process
+        can create it at the same time.
+        """
+        return self.directory / (
+            f"{self._claim(name, partial(Path.mkdir, parents=True))}{self.suffix}"
+        )
+
+    def _claim(self, name: str, create: Callable[[Path], object]) -> str:
+        """Return the first name not taken yet, whose entry the function created.
+
+        The function fails with :class:`FileExistsError`, if the entry exists.
+        """
+        while True:
+            candidate: str = self._next_name(name)
+            try:
+                create(self.directory / f"{candidate}{self.suffix}")
+            except FileExistsError:
+                continue
+            return candidate
+
+    def _next_name(self, name: str) -> str:
+        """Take the name or its first copy, which is not taken yet, and return it."""
+        with self._lock:
+            if not self._listed:
+                with suppress(FileNotFoundError, NotADirectoryError):
+                    self._taken.update(os.listdir(self.directory))
+                self._listed = True
+            candidate: str = name
+            number: int = self._next_numbers.get(name, 1)
+            while f"{candidate}{self.suffix}" in self._taken:
+                candidate = f"{name} ({number})"
+                number += 1
+            self._next_numbers[name] = number
+            self._taken.add(f"{candidate}{self.suffix}")
+            return candidate
+
+
+def _create_empty_file(path: Path) -> None:
+    """Create the empty file, fail with :class:`FileExistsError` if it exists."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+
+
+def _remove_reservation(path: Path) -> None:
+    """Remove the file, if it is still empty and so only reserves its name."""
+    with suppress(OSError):
+        if path.is_file() and not path.stat().st_size:
+            path.unlink()
+
+
+# the allocators of the directories downloaded into, shared by all downloads,
+# in the order they were used
+_file_name_allocators: dict[tuple[Path, str], FileNameAllocator] = {}
+_file_name_allocators_lock: threading.Lock = threading.Lock()
+
+
+def _get_file_name_allocator(
+    directory: Path | str,
+    suffix: str = "",
+) -> FileNameAllocator:
+    """Return the allocator of the names with the suffix in the directory.
+
+    Only the allocators used most recently are kept. Every name an allocator
+    claimed exists on disk, so an allocator replacing an evicted one finds it
+    taken when listing the directory.
+    """
+    key: tuple[Path, str] = (Path(directory).absolute(), suffix)
+    with _file_name_allocators_lock:
+        if (allocator := _file_name_allocators.pop(key, None)) is None:
+            allocator = FileNameAllocator(*key)
+            if len(_file_name_allocators) >= _MAX_FILE_NAME_ALLOCATORS:
+                del _file_name_allocators[next(iter(_file_name_allocators))]
+        _file_name_allocators[key] = allocator
+        return allocator
+
+
+def _watch_url(video_id: str) -> str:
+    """Return the url of the watch page of the video."""
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def _user_cache_dir() -> Path:
+    """Return the platform specific directory for the cache of the program."""
+    if (cache_dir := os.environ.get("YTDOWNLOADER_CACHE_DIR")) is not None:
+        return Path(cache_dir)
+    if sys.platform == "win32":
+        return (
+            Path(os.environ.get("LOCALAPPDATA", Path.home() / "AppData" / "Local"))
+            / __title__
+            / "Cache"
+        )
+    if sys.platform == "darwin":
+        return Path.home() / "Library" / "Caches" / __title__
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / __title__
+
+
+class MetadataCache:
+    """Persistent cache for the information about videos and playlists.
+
+    The information is stored in a SQLite database keyed by the video or playlist id.
+    Entries expire after ``ttl`` seconds and the least recently used entries are
+    evicted once the total size of the stored entries exceeds ``max_size`` bytes.
+    The cache is safe to be used from multiple threads.
+    """
+
+    def __init__(
+        self,
+        path: Path | str | None = None,
+        ttl: float = _DEFAULT_CACHE_TTL,
+        max_size: int = _DEFAULT_CACHE_MAX_SIZE,
+    ) -> None:
+        if path is None:
+            path = _user_cache_dir() / "metadata.sqlite3"
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.ttl: float = ttl
+        self.max_size: int = max_size
+        self.hits: int = 0
+        self.misses: int = 0
+
+        self._lock: threading.Lock = threading.Lock()
+        self._connection: sqlite3.Connection = sqlite3.connect(
+            path,
+            check_same_thread=False,
+        )
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                "key TEXT PRIMARY KEY, "
+                "value TEXT NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, "
+                "last_access REAL NOT NULL)",
+            )
+
+    def get_video(self, video_id: str) -> VideoInfo | None:
+        """Return the cached information about the video, if there is any."""
+        if (value := self._get(f"video:{video_id}")) is None:
+            return None
+        value["streams"] = tuple(StreamInfo(**stream) for stream in value["streams"])
+        return VideoInfo(**value)
+
+    def put_video(self, video_info: VideoInfo) -> None:
+        """Store the information about the video."""
+        value: dict[str, Any] = video_info._asdict()
+        value["streams"] = [stream._asdict() for stream in video_info.streams]
+        self._put(f"video:{video_info.video_id}", value)
+
+    def get_playlist(self, playlist_id: str) -> PlaylistInfo | None:
+        """Return the cached information about the playlist, if there is any."""
+        if (value := self._get(f"playlist:{playlist_id}")) is None:
+            return None
+        value["video_ids"] = tuple(value["video_ids"])
+        return PlaylistInfo(**value)
+
+    def put_playlist(self, playlist_info: PlaylistInfo) -> None:
+        """Store the information about the playlist."""
+        self._put(f"playlist:{playlist_info.playlist_id}", playlist_info._asdict())
+
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM metadata")
+
+    def close(self) -> None:
+        """Close the underlying database."""
+        with self._lock:
+            self._connection.close()
+
+    def _get(self, key: str) -> dict[str, Any] | None:
+        """Return the value of the entry and mark it as used, if it has not expired."""
+        now: float = time.time()
+        with self._lock, self._connection:
+            row: tuple[str, float] | None = self._connection.execute(
+                "SELECT value, expires_at FROM metadata WHERE key = ?",
+                (key,),
+            ).fetchone()
+
+            if row is None or row[1] <= now:
+                self._connection.execute("DELETE FROM metadata WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+
+            self._connection.execute(
+                "UPDATE metadata SET last_access = ? WHERE key = ?",
+                (now, key),
+            )
+            self.hits += 1
+        value: dict[str, Any] = json.loads(row[0])
+        return value
+
+    def _put(self, key: str, value: dict[str, Any]) -> None:
+        """Store the value and evict the least recently used entries if necessary."""
+        now: float = time.time()
+        serialized_value: str = json.dumps(value)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?)",
+                (key, serialized_value, len(serialized_value), now + self.ttl, now),
+            )
+
+            total_size: int = self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM metadata",
+            ).fetchone()[0]
+            if total_size <= self.max_size:
+                return
+
+            for evicted_key, size in self._connection.execute(
+                "SELECT key, size FROM metadata ORDER BY last_access",
+            ).fetchall():
+                self._connection.execute(
+                    "DELETE FROM metadata WHERE key = ?",
+                    (evicted_key,),
+                )
+                total_size -= size
+                if total_size <= self.max_size:
+                    break
+
+
+class DownloadArchive:
+    """Persistent archive of the downloaded streams keyed by the video id and itag.
+
+    Every file a stream was downloaded or linked to is recorded in a SQLite database,
+    so downloading the same stream again creates a hardlink, a reflink or as a last
+    resort a copy of a stored file instead of transferring it again.
+    Separate copies of the same stream can be found and replaced by hardlinks.
+    The archive is safe to be used from multiple threads.
+    """
+
+    def __init__(self, path: Path | str | None = None) -> None:
+        if path is None:
+            path = _user_cache_dir() / "archive.sqlite3"
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock: threading.Lock = threading.Lock()
+        self._connection: sqlite3.Connection = sqlite3.connect(
+            path,
+            check_same_thread=False,
+        )
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, "
+                "video_id TEXT NOT NULL, "
+                "itag INTEGER NOT NULL, "
+                "size INTEGER NOT NULL)",
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS files_stream ON files (video_id, itag)",
+            )
+
+    def find(self, video_id: str, itag: int) -> Path | None:
+        """Return a stored file of the stream, if there is any.
+
+        Files which were removed or changed since are forgotten.
+        """
+        for path, size in self._files(video_id, itag):
+            if (stat := _stat_file(path)) is not None and stat.st_size == size:
+                return path
+            self._forget(path)
+        return None
+
+    def add(self, video_id: str, itag: int, path: Path) -> None:
+        """Record the file of the stream."""
+        size: int = path.stat().st_size
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (str(path.resolve()), video_id, itag, size),
+            )
+
+    def duplicates(self) -> list[_DuplicateGroup]:
+        """Return the streams stored in more than one separate file.
+
+        Files that are hardlinks of each other count as one, files which were
+        removed or changed since are forgotten.
+        """
+        with self._lock:
+            rows: list[tuple[str, int, str, int]] = self._connection.execute(
+                "SELECT video_id, itag, path, size FROM files ORDER BY video_id, itag",
+            ).fetchall()
+
+        # the separate copies of every stream, keyed by their inode
+        streams: dict[tuple[str, int, int], dict[tuple[int, int], Path]] = {}
+        for video_id, itag, path_name, size in rows:
+            path: Path = Path(path_name)
+            if (stat := _stat_file(path)) is None or stat.st_size != size:
+                self._forget(path)
+                continue
+            streams.setdefault((video_id, itag, size), {}).setdefault(
+                (stat.st_dev, stat.st_ino),
+                path,
+            )
+        return [
+            _DuplicateGroup(video_id, itag, size, tuple(copies.values()))
+            for (video_id, itag, size), copies in streams.items()
+            if len(copies) > 1
+        ]
+
+    def reclaim(self) -> int:
+        """Replace the separate copies of every stream by hardlinks of one of them.
+
+        Copies on another file system than the first one are kept.
+        Return the number of bytes freed.
+        """
+        freed: int = 0
+        for group in self.duplicates():
+            stored_path: Path = group.paths[0]
+            for path in group.paths[1:]:
+                temporary_path: Path = path.with_name(f"{path.name}{_PART_SUFFIX}")
+                try:
+                    os.link(stored_path, temporary_path)
+                except OSError:
+                    continue
+                temporary_path.replace(path)
+                freed += group.size
+        return freed
+
+    def close(self) -> None:
+        """Close the underlying database."""
+        with self._lock:
+            self._connection.close()
+
+    def _files(self, video_id: str, itag: int) -> list[tuple[Path, int]]:
+        """Return the recorded files of the stream with their sizes."""
+        with self._lock:
+            rows: list[tuple[str, int]] = self._connection.execute(
+                "SELECT path, size FROM files WHERE video_id = ? AND itag = ?",
+                (video_id, itag),
+            ).fetchall()
+        return [(Path(path), size) for path, size in rows]
+
+    def _forget(self, path: Path) -> None:
+        """Remove the record of the file."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM files WHERE path = ?", (str(path),))
+
+
+class PlaylistManifest:
+    """Record of the videos downloaded into the directory of a playlist.
+
+    The manifest maps the id of every downloaded video to its file name and is
+    stored as JSON in the directory, so syncing the playlist again only
+    downloads the videos added since and removes the ones no longer in it.
+    A manifest of another playlist is ignored.
+    """
+
+    def __init__(self, download_path: Path, playlist_id: str) -> None:
+        self.download_path: Path = download_path
+        self.playlist_id: str = playlist_id
+        self.videos: dict[str, str] = {}
+        manifest: dict[str, Any] = _read_manifest(download_path) or {}
+        if manifest.get("playlist_id") == playlist_id:
+            self.videos = manifest.get("videos", {})
+
+    def has(self, video_id: str) -> bool:
+        """Return whether the video was downloaded and its file still exists."""
+        return (
+            video_id in self.videos
+            and (self.download_path / self.videos[video_id]).exists()
+        )
+
+    def missing(self, video_ids: Iterable[str]) -> list[str]:
+        """Return the videos not downloaded yet, also the ones whose file was deleted."""
+        return [
+            video_id for video_id in dict.fromkeys(video_ids) if not self.has(video_id)
+        ]
+
+    def removed(self, video_ids: Iterable[str]) -> list[str]:
+        """Return the downloaded videos, which are not in the playlist anymore."""
+        kept_video_ids: set[str] = set(video_ids)
+        return [video_id for video_id in self.videos if video_id not in kept_video_ids]
+
+    def add(self, video_id: str, file_name: str) -> None:
+        """Record that the video was downloaded into the file."""
+        self.videos[video_id] = file_name
+        self.save()
+
+    def remove(self, video_id: str) -> Path:
+        """Delete the file of the video and forget it, return the path of the file."""
+        path: Path = self.download_path / self.videos.pop(video_id)
+        path.unlink(missing_ok=True)
+        self.save()
+        return path
+
+    def save(self) -> None:
+        """Write the manifest into the directory, replacing the previous one at once."""
+        self.download_path.mkdir(parents=True, exist_ok=True)
+        path: Path = self.download_path / _MANIFEST_NAME
+        temporary_path: Path = path.with_name(f"{path.name}{_PART_SUFFIX}")
+        temporary_path.write_text(
+            json.dumps({"playlist_id": self.playlist_id, "videos": self.videos}),
+            encoding="utf-8",
+        )
+        temporary_path.replace(path)
+
+
+class JobQueue:
+    """Persistent queue of the requested downloads and of the videos they consist of.
+
+    Every job records its url, profile, output directory, priority, state and
+    attempts, every video of a job its target path, state and bytes done in a
+    SQLite database, so the work left unfinished by a crash is resumed by the
+    next run. Pending jobs are claimed in priority order, also while other
+    processes add new ones. Jobs of a process, whose heartbeat is older than
+    ``stale_after`` seconds, are considered interrupted and claimed again.
+    The queue is safe to be used from multiple threads and processes.
+    """
+
+    def __init__(
+        self,
+        path: Path | str | None = None,
+        stale_after: float = _JOB_STALE_AFTER,
+    ) -> None:
+        if path is None:
+            path = _user_cache_dir() / "jobs.sqlite3"
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        self.stale_after: float = stale_after
+        # identifies the jobs run by this queue among the ones of other processes
+        self._owner: str = f"{os.getpid()}-{os.urandom(8).hex()}"
+        # the bytes done of the running videos are written with the next heartbeat
+        self._progress: dict[tuple[int, str], int] = {}
+
+        self._lock: threading.Lock = threading.Lock()
+        self._connection: sqlite3.Connection = sqlite3.connect(
+            path,
+            timeout=30,
+            check_same_thread=False,
+        )
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "url TEXT NOT NULL, "
+                "profile TEXT NOT NULL, "
+                "output_dir TEXT NOT NULL, "
+                "priority INTEGER NOT NULL, "
+                "sync INTEGER NOT NULL DEFAULT 0, "
+                "prune INTEGER NOT NULL DEFAULT 0, "
+                "state TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "target TEXT, "
+                "error TEXT, "
+                "owner TEXT, "
+                "heartbeat REAL)",
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_order ON jobs (state, priority, id)",
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                "job_id INTEGER NOT NULL, "
+                "video_id TEXT NOT NULL, "
+                "path TEXT NOT NULL, "
+                "state TEXT NOT NULL, "
+                "bytes_done INTEGER NOT NULL DEFAULT 0, "
+                "filesize INTEGER NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (job_id, video_id))",
+            )
+
+    def add(  # noqa: PLR0913
+        self,
+        url: str,
+        profile: str,
+        output_dir: Path,
+        priority: int = 0,
+        *,
+        sync: bool = False,
+        prune: bool = False,
+    ) -> int:
+        """Add a pending job and return its id, higher priorities are claimed first."""
+        with self._lock, self._connection:
+            cursor: sqlite3.Cursor = self._connection.execute(
+                "INSERT INTO jobs (url, profile, output_dir, priority, sync, prune, "
+                "state) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, profile, str(output_dir), priority, sync, prune, _PENDING),
+            )
+        return cast("int", cursor.lastrowid)
+
+    def start(  # noqa: PLR0913
+        self,
+        url: str,
+        profile: str,
+        output_dir: Path,
+        priority: int = 0,
+        *,
+        sync: bool = False,
+        prune: bool = False,
+    ) -> Job:
+        """Add a job, which is run right away instead of waiting for its turn."""
+        with self._lock, self._connection:
+            cursor: sqlite3.Cursor = self._connection.execute(
+                "INSERT INTO jobs (url, profile, output_dir, priority, sync, prune, "
+                "state, attempts, owner, heartbeat) VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?, ?)",
+                (
+                    url,
+                    profile,
+                    str(output_dir),
+                    priority,
+                    sync,
+                    prune,
+                    _RUNNING,
+                    self._owner,
+                    time.time(),
+                ),
+            )
+        return cast("Job", self.get(cast("int", cursor.lastrowid)))
+
+    def claim(self) -> Job | None:
+        """Start the pending job with the highest priority, if there is any.
+
+        Running jobs of other processes, whose heartbeat is stale, are pending again.
+        """
+        now: float = time.time()
+        with self._lock:
+            # the transaction is exclusive, so no other process claims the same job
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    "UPDATE jobs SET state = ?, owner = NULL "
+                    "WHERE state = ? AND owner != ? AND heartbeat < ?",
+                    (_PENDING, _RUNNING, self._owner, now - self.stale_after),
+                )
+                row: tuple[int] | None = self._connection.execute(
+                    "SELECT id FROM jobs WHERE state = ? "
+                    "ORDER BY priority DESC, id LIMIT 1",
+                    (_PENDING,),
+                ).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        "UPDATE jobs SET state = ?, attempts = attempts + 1, "
+                        "owner = ?, heartbeat = ? WHERE id = ?",
+                        (_RUNNING, self._owner, now, row[0]),
+                    )
+                self._connection.commit()
+            except BaseException:
+                self._connection.rollback()
+                raise
+        return self.get(row[0]) if row is not None else None
+
+    def retry_failed(self) -> int:
+        """Make the failed jobs pending again, unless they were attempted too often.
+
+        Return the number of jobs to be retried.
+        """
+        with self._lock, self._connection:
+            return self._connection.execute(
+                "UPDATE jobs SET state = ? WHERE state = ? AND attempts < ?",
+                (_PENDING, _FAILED, _MAX_JOB_ATTEMPTS),
+            ).rowcount
+
+    def running_elsewhere(self) -> bool:
+        """Return whether other processes are running jobs, which may be taken over."""
+        with self._lock:
+            return (
+                self._connection.execute(
+                    "SELECT 1 FROM jobs WHERE state = ? AND owner != ? LIMIT 1",
+                    (_RUNNING, self._owner),
+                ).fetchone()
+                is not None
+            )
+
+    def get(self, job_id: int) -> Job | None:
+        """Return the job with the id, if there is any."""
+        with self._lock:
+            row: tuple[Any, ...] | None = self._connection.execute(
+                "SELECT id, url, profile, output_dir, priority, sync, prune, state, "
+                "attempts, target, error FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        return _create_job(row) if row is not None else None
+
+    def jobs(self, state: str | None = None) -> list[Job]:
+        """Return all jobs or the jobs in the state in the order they are claimed."""
+        with self._lock:
+            rows: list[tuple[Any, ...]] = self._connection.execute(
+                "SELECT id, url, profile, output_dir, priority, sync, prune, state, "
+                "attempts, target, error FROM jobs WHERE ? IS NULL OR state = ? "
+                "ORDER BY priority DESC, id",
+                (state, state),
+            ).fetchall()
+        return [_create_job(row) for row in rows]
+
+    def set_target(self, job_id: int, target: Path) -> None:
+        """Record the directory of the playlist or the file of the video of the job."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET target = ? WHERE id = ?",
+                (str(target), job_id),
+            )
+
+    def add_items(
+        self,
+        job_id: int,
+        items: Iterable[tuple[str, Path, int]],
+    ) -> None:
+        """Record the videos of the job with their target path and file size.
+
+        Videos which were already recorded keep their path and state.
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO items (job_id, video_id, path, state, filesize) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    (job_id, video_id, str(path), _PENDING, filesize)
+                    for video_id, path, filesize in items
+                ),
+            )
+
+    def items(self, job_id: int) -> list[JobItem]:
+        """Return the recorded videos of the job."""
+        with self._lock:
+            rows: list[tuple[str, str, str, int, int, int]] = self._connection.execute(
+                "SELECT video_id, path, state, bytes_done, filesize, attempts "
+                "FROM items WHERE job_id = ? ORDER BY rowid",
+                (job_id,),
+            ).fetchall()
+        return [
+            JobItem(video_id, Path(path), state, bytes_done, filesize, attempts)
+            for video_id, path, state, bytes_done, filesize, attempts in rows
+        ]
+
+    def record_progress(self, job_id: int, video_id: str, bytes_done: int) -> None:
+        """Record the bytes done of a video, which are written with the next heartbeat."""
+        self._progress[job_id, video_id] = bytes_done
+
+    def finish_item(
+        self,
+        job_id: int,
+        video_id: str,
+        error: str | None = None,
+    ) -> None:
+        """Record that the video of the job was downloaded or failed with the error."""
+        self._progress.pop((job_id, video_id), None)
+        with self._lock, self._connection:
+            if error is None:
+                self._connection.execute(
+                    "UPDATE items SET state = ?, bytes_done = filesize "
+                    "WHERE job_id = ? AND video_id = ?",
+                    (_COMPLETED, job_id, video_id),
+                )
+            else:
+                self._connection.execute(
+                    "UPDATE items SET state = ?, attempts = attempts + 1 "
+                    "WHERE job_id = ? AND video_id = ?",
+                    (_FAILED, job_id, video_id),
+                )
+
+    def finish(self, job_id: int, error: str | None = None) -> None:
+        """Record that the job completed or failed with the error."""
+        self.heartbeat()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET state = ?, error = ?, owner = NULL WHERE id = ?",
+                (_COMPLETED if error is None else _FAILED, error, job_id),
+            )
+
+    def interrupt(self, job_id: int) -> None:
+        """Make the running job pending again, its interrupted attempt is not counted."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts - 1, owner = NULL "
+                "WHERE id = ? AND state = ?",
+                (_PENDING, job_id, _RUNNING),
+            )
+
+    def heartbeat(self) -> None:
+        """Mark the running jobs of this queue as alive and write their progress."""
+        progress: list[tuple[int, int, str]] = [
+            (bytes_done, job_id, video_id)
+            for (job_id, video_id), bytes_done in list(self._progress.items())
+        ]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "UPDATE items SET bytes_done = ? WHERE job_id = ? AND video_id = ?",
+                progress,
+            )
+            self._connection.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE state = ? AND owner = ?",
+                (time.time(), _RUNNING, self._owner),
+            )
+
+    def keep_alive(self, stop: threading.Event) -> None:
+        """Send a heartbeat every few seconds until the event is set."""
+        while not stop.wait(_JOB_HEARTBEAT_INTERVAL):
+            self.heartbeat()
+
+    def close(self) -> None:
+        """Close the underlying database."""
+        with self._lock:
+            self._connection.close()
+
+
+def _create_job(row: tuple[Any, ...]) -> Job:
+    """Create a job from a row of the job queue."""
+    (
+        job_id,
+        url,
+        profile,
+        output_dir,
+        priority,
+        sync,
+        prune,
+        state,
+        attempts,
+        target,
+        error,
+    ) = row
+    return Job(
+        job_id=job_id,
+        url=url,
+        profile=profile,
+        output_dir=Path(output_dir),
+        priority=priority,
+        sync=bool(sync),
+        prune=bool(prune),
+        state=state,
+        attempts=attempts,
+        target=Path(target) if target is not None else None,
+        error=error,
+    )
+
+
+class ProgressBus:
+    """Collects the progress of any number of concurrent transfers.
+
+    Transfers report the bytes they have done so far under a key of their own,
+    which is cheap enough to be done for every chunk. Aggregated snapshots are
+    published to the subscribers at most once per ``interval`` seconds,
+    from the thread whose report made the interval elapse.
+    The bus is safe to be used from multiple threads.
+    """
+
+    def __init__(
+        self,
+        total_bytes: int,
+        total_items: int = 1,
+        interval: float = _PROGRESS_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._total_bytes: int = total_bytes
+        self._total_items: int = total_items
+        self._interval: float = interval
+        self._clock: Callable[[], float] = clock
+        self._subscribers: list[Callable[[ProgressSnapshot], None]] = []
+        self._lock: threading.Lock = threading.Lock()
+
+        self._transfers: dict[Hashable, int] = {}
+        self._bytes_done: int = 0
+        self._items_done: int = 0
+        self._bytes_per_second: float = 0.0
+        self._last_publish: float = clock()
+        self._last_published_bytes: int = 0
+
+    def subscribe(self, subscriber: Callable[[ProgressSnapshot], None]) -> None:
+        """Call the subscriber with every published snapshot."""
+        with self._lock:
+            self._subscribers.append(subscriber)
+
+    def update(self, key: Hashable, bytes_done: int, filesize: int = 0) -> None:
+        """Record the bytes the transfer has done so far.
+
+        The size of the file is accepted for being used as progress callback,
+        the total is known up front.
+        """
+        with self._lock:
+            self._bytes_done += bytes_done - self._transfers.get(key, 0)
+            self._transfers[key] = bytes_done
+            snapshot: ProgressSnapshot | None = (
+                self._take_snapshot() if self._is_due() else None
+            )
+        if snapshot is not None:
+            self._notify(snapshot)
+
+    def add_item(self, filesize: int) -> None:
+        """Add an item, which became known after the bus was created, to the totals."""
+        with self._lock:
+            self._total_bytes += filesize
+            self._total_items += 1
+
+    def complete_item(self) -> None:
+        """Record that one more item has been finished."""
+        with self._lock:
+            self._items_done += 1
+            snapshot: ProgressSnapshot | None = (
+                self._take_snapshot() if self._is_due() else None
+            )
+        if snapshot is not None:
+            self._notify(snapshot)
+
+    def publish(self) -> ProgressSnapshot:
+        """Publish a snapshot right away, regardless of the interval, and return it."""
+        with self._lock:
+            snapshot: ProgressSnapshot = self._take_snapshot()
+        self._notify(snapshot)
+        return snapshot
+
+    def _is_due(self) -> bool:
+        """Return whether the interval since the last snapshot has elapsed."""
+        return self._clock() - self._last_publish >= self._interval
+
+    def _take_snapshot(self) -> ProgressSnapshot:
+        """Return a snapshot of the progress, the lock has to be held."""
+        now: float = self._clock()
+        elapsed: float = now - self._last_publish
+        if elapsed > 0:
+            speed: float = (self._bytes_done - self._last_published_bytes) / elapsed
+            self._bytes_per_second = (
+                _SPEED_SMOOTHING * speed
+                + (1 - _SPEED_SMOOTHING) * self._bytes_per_second
+                if self._bytes_per_second
+                else speed
+            )
+        self._last_publish = now
+        self._last_published_bytes = self._bytes_done
+
+        remaining_bytes: int = max(self._total_bytes - self._bytes_done, 0)
+        return ProgressSnapshot(
+            bytes_done=self._bytes_done,
+            total_bytes=self._total_bytes,
+            items_done=self._items_done,
+            total_items=self._total_items,
+            bytes_per_second=self._bytes_per_second,
+            eta=(
+                remaining_bytes / self._bytes_per_second
+                if self._bytes_per_second > 0
+                else None
+            ),
+        )
+
+    def _notify(self, snapshot: ProgressSnapshot) -> None:
+        """Call the subscribers with the snapshot."""
+        for subscriber in tuple(self._subscribers):
+            subscriber(snapshot)
+
+
+class _TokenBucket:
+    """Token bucket refilled with ``rate`` bytes per second, unlimited if it is ``None``.
+
+    Bytes are taken from the bucket even if it does not hold enough, the caller
+    is held back until the bucket has been refilled up to its bytes. Concurrent
+    callers therefore queue up behind each other and together get exactly the rate.
+    Waiting callers check the rate regularly, so a changed rate applies right away.
+    """
+
+    def __init__(
+        self,
+        rate: float | None,
+        clock: Callable[[], float],
+        sleep: Callable[[float], None],
+    ) -> None:
+        self._rate: float | None = rate
+        self._clock: Callable[[], float] = clock
+        self._sleep: Callable[[float], None] = sleep
+        self._lock: threading.Lock = threading.Lock()
+        # the bytes taken and the bytes refilled in total, starting with a full bucket
+        self._taken: float = 0.0
+        self._refilled: float = self._capacity
+        self._last_refill: float = clock()
+
+    @property
+    def rate(self) -> float | None:
+        """Return the bytes per second."""
+        return self._rate
+
+    @property
+    def _capacity(self) -> float:
+        return 0.0 if self._rate is None else self._rate * _BANDWIDTH_BURST
+
+    def set_rate(self, rate: float | None) -> None:
+        """Change the bytes per second, also for the callers waiting right now."""
+        with self._lock:
+            self._refill()
+            self._rate = rate
+
+    def consume(self, amount: int) -> None:
+        """Take the bytes from the bucket and wait until the rate allows them."""
+        with self._lock:
+            if self._rate is None:
+                return
+            self._refill()
+            self._taken += amount
+            mark: float = self._taken
+        while True:
+            with self._lock:
+                self._refill()
+                if self._rate is None or self._refilled >= mark:
+                    return
+                delay: float = (mark - self._refilled) / self._rate
+            self._sleep(min(delay, _BANDWIDTH_BURST))
+
+    def _refill(self) -> None:
+        """Add the bytes accrued since the last refill, the lock has to be held."""
+        now: float = self._clock()
+        if self._rate is None:
+            self._refilled = self._taken
+        else:
+            self._refilled = min(
+                self._refilled + (now - self._last_refill) * self._rate,
+                self._taken + self._capacity,
+            )
+        self._last_refill = now
+
+
+class DownloadCancelledError(Exception):
+    """Raised in a transfer or in work of the engine, which was cancelled."""
+
+
+class BandwidthLimiter:
+    """Limits the bandwidth of all transfers together and of every single transfer.
+
+    The limits are in bytes per second, ``None`` means unlimited, and can be
+    changed at any time, also while transfers are running. Every transfer
+    reports the bytes it receives and is held back until both limits allow them.
+    Once cancelled, every transfer fails the next time it reports its bytes.
+    The limiter is safe to be used from multiple threads.
+    """
+
+    def __init__(
+        self,
+        rate: float | None = None,
+        transfer_rate: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self._clock: Callable[[], float] = clock
+        self._sleep: Callable[[float], None] = sleep
+        self._bucket: _TokenBucket = _TokenBucket(rate, clock, sleep)
+        self._transfer_rate: float | None = transfer_rate
+        self._transfer_buckets: weakref.WeakSet[_TokenBucket] = weakref.WeakSet()
+        self._lock: threading.Lock = threading.Lock()
+        self._cancelled: threading.Event = threading.Event()
+
+    @property
+    def rate(self) -> float | None:
+        """Return the bytes per second of all transfers together."""
+        return self._bucket.rate
+
+    @property
+    def transfer_rate(self) -> float | None:
+        """Return the bytes per second of every single transfer."""
+        return self._transfer_rate
+
+    def set_rate(self, rate: float | None) -> None:
+        """Limit all transfers together to the bytes per second."""
+        self._bucket.set_rate(rate)
+
+    def set_transfer_rate(self, rate: float | None) -> None:
+        """Limit every transfer, including the running ones, to the bytes per second."""
+        with self._lock:
+            self._transfer_rate = rate
+            transfer_buckets: list[_TokenBucket] = list(self._transfer_buckets)
+        for transfer_bucket in transfer_buckets:
+            transfer_bucket.set_rate(rate)
+
+    def transfer(self) -> Callable[[int], None]:
+        """Return the function a new transfer reports the bytes it receives to."""
+        with self._lock:
+            transfer_bucket: _TokenBucket = _TokenBucket(
+                self._transfer_rate,
+                self._clock,
+                self._sleep,
+            )
+            self._transfer_buckets.add(transfer_bucket)
+        return partial(self._consume, transfer_bucket)
+
+    def cancel(self) -> None:
+        """Make the running transfers and all later ones fail."""
+        self._cancelled.set()
+
+    def _consume(self, transfer_bucket: _TokenBucket, amount: int) -> None:
+        if self._cancelled.is_set():
+            raise DownloadCancelledError("the transfer was cancelled")
+        transfer_bucket.consume(amount)
+        self._bucket.consume(amount)
+
+
+def _parse_rate(text: str) -> float | None:
+    """Return the bytes per second of a rate like ``500K`` or ``2M``.
+
+    An empty rate or a rate of zero means unlimited.
+    """
+    if not text.strip():
+        return None
+    if (match := _RATE_PATTERN.fullmatch(text.strip())) is None:
+        raise ValueError(f"invalid rate: {text!r}")
+    return float(match[1]) * _RATE_UNITS[match[2].upper()] or None
+
+
+def _format_rate(rate: float | None) -> str:
+    """Return the rate in the format accepted by ``_parse_rate``."""
+    if rate is None:
+        return ""
+    for unit, factor in reversed(_RATE_UNITS.items()):
+        if rate >= factor and rate % factor == 0:
+            return f"{int(rate // factor)}{unit}"
+    return f"{rate:g}"
+
+
+class _Measurement:
+    """The bytes, requests and retries of an item measured in a phase.
+
+    It is shared by all threads working on the item.
+    """
+
+    def __init__(self, phase: str, item: str) -> None:
+        self.phase: str = phase
+        self.item: str = item
+        self.bytes: int = 0
+        self.requests: int = 0
+        self.retries: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def add_bytes(self, size: int) -> None:
+        """Count the bytes as transferred."""
+        with self._lock:
+            self.bytes += size
+
+    def add_request(self) -> None:
+        """Count a request as sent."""
+        with self._lock:
+            self.requests += 1
+
+    def add_retry(self) -> None:
+        """Count a failed attempt as retried."""
+        with self._lock:
+            self.retries += 1
+
+
+class Metrics:
+    """Durations, bytes, requests, retries and throughput of the phases.
+
+    Once installed, every item measured in one of the phases, e.g. a video
+    being downloaded, is appended as a JSON line to the file, if one is given,
+    and added to the totals of its phase. The totals of the run are written as
+    JSON lines and as a text file the Prometheus node exporter can scrape.
+    Without installed metrics every measurement point only checks a global,
+    so they cost next to nothing.
+    """
+
+    def __init__(self, path: Path | None = None) -> None:
+        self._file: TextIO | None = (
+            path.open("a", encoding="utf-8") if path is not None else None
+        )
+        self._start: float = time.perf_counter()
+        self._totals: dict[str, dict[str, float]] = {
+            phase: dict.fromkeys(
+                ("items", "seconds", "bytes", "requests", "retries", "errors"),
+                0,
+            )
+            for phase in _METRICS_PHASES
+        }
+        self._lock: threading.Lock = threading.Lock()
+
+    def install(self) -> None:
+        """Start recording the measurements of all threads."""
+        global _metrics  # noqa: PLW0603 # pylint: disable=W0603
+        _metrics = self
+
+    def uninstall(self) -> None:
+        """Stop recording the measurements."""
+        global _metrics  # noqa: PLW0603 # pylint: disable=W0603
+        if _metrics is self:
+            _metrics = None
+
+    @contextmanager
+    def measure(
+        self,
+        phase: str,
+        item: str,
+        *,
+        current: bool = True,
+    ) -> Generator[_Measurement, None, None]:
+        """Measure the duration of the item in the phase and record it.
+
+        As the current measurement of the thread the item is credited with the
+        bytes, requests and retries of the thread, which asynchronous code
+        running other tasks on the same thread must not use.
+        """
+        measurement: _Measurement = _Measurement(phase, item)
+        previous: _Measurement | None = getattr(_current, "measurement", None)
+        if current:
+            _current.measurement = measurement
+        start: float = time.perf_counter()
+        error: str | None = None
+        try:
+            yield measurement
+        except BaseException as err:
+            error = err.__class__.__name__
+            raise
+        finally:
+            if current:
+                _current.measurement = previous
+            self._record(measurement, time.perf_counter() - start, error)
+
+    def _record(
+        self,
+        measurement: _Measurement,
+        seconds: float,
+        error: str | None,
+    ) -> None:
+        with self._lock:
+            totals: dict[str, float] = self._totals[measurement.phase]
+            totals["items"] += 1
+            totals["seconds"] += seconds
+            totals["bytes"] += measurement.bytes
+            totals["requests"] += measurement.requests
+            totals["retries"] += measurement.retries
+            totals["errors"] += error is not None
+        self._write(
+            event="item",
+            phase=measurement.phase,
+            item=measurement.item,
+            seconds=seconds,
+            bytes=measurement.bytes,
+            requests=measurement.requests,
+            retries=measurement.retries,
+            throughput=measurement.bytes / seconds if seconds else 0.0,
+            error=error,
+        )
+
+    def _write(self, **fields: object) -> None:
+        if self._file is None:
+            return
+        line: str = json.dumps(fields)
+        with self._lock:
+            self._file.write(f"{line}\n")
+            self._file.flush()
+
+    def totals(self) -> dict[str, dict[str, float]]:
+        """Return the totals of every phase.
+
+        The throughput is the bytes of the phase per second of the run,
+        the items of a phase overlap, so their seconds add up to more.
+        """
+        run_seconds: float = time.perf_counter() - self._start
+        with self._lock:
+            return {
+                phase: {
+                    **totals,
+                    "throughput": totals["bytes"] / run_seconds if run_seconds else 0.0,
+                }
+                for phase, totals in self._totals.items()
+            }
+
+    def write_totals(self) -> None:
+        """Write the totals of every phase as JSON lines."""
+        for phase, totals in self.totals().items():
+            self._write(event="phase", phase=phase, **totals)
+
+    def write_prometheus(self, path: Path) -> None:
+        """Write the totals in the Prometheus text format.
+
+        The file is replaced at once, so it is never scraped half written.
+        """
+        totals: dict[str, dict[str, float]] = self.totals()
+        lines: list[str] = []
+        for name, kind, description in (
+            ("items", "counter", "Items measured in the phase."),
+            ("seconds", "counter", "Seconds spent on the items of the phase."),
+            ("bytes", "counter", "Bytes transferred in the phase."),
+            ("requests", "counter", "Requests sent in the phase."),
+            ("retries", "counter", "Failed attempts retried in the phase."),
+            ("errors", "counter", "Items of the phase which failed."),
+            ("throughput", "gauge", "Bytes per second of the run in the phase."),
+        ):
+            metric: str = (
+                f"ytdownloader_phase_{name}"
+                f"{'_total' if kind == 'counter' else '_bytes_per_second'}"
+            )
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.extend(
+                f'{metric}{{phase="{phase}"}} {phase_totals[name]}'
+                for phase, phase_totals in totals.items()
+            )
+        temp_path: Path = path.with_name(f"{path.name}.tmp")
+        temp_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        temp_path.replace(path)
+
+    def close(self) -> None:
+        """Uninstall the metrics and close the file."""
+        self.uninstall()
+        if self._file is not None:
+            self._file.close()
+
+
+# the installed metrics and the measurement the work of each thread is credited to
+_metrics: Metrics | None = None
+_current: threading.local = threading.local()
+
+
+def _measure(
+    phase: str,
+    item: str,
+    *,
+    current: bool = True,
+) -> ContextManager[_Measurement | None]:
+    """Measure the item in the phase, if metrics are installed."""
+    if _metrics is None:
+        return nullcontext()
+    return _metrics.measure(phase, item, current=current)
+
+
+def _current_measurement() -> _Measurement | None:
+    """Return the measurement the work of the thread is credited to."""
+    if _metrics is None:
+        return None
+    return cast("_Measurement | None", getattr(_current, "measurement", None))
+
+
+def _run_measured(
+    measurement: _Measurement | None,
+    func: Callable[..., _T],
+    *args: Any,
+) -> _T:
+    """Run the function crediting its work to the measurement of another thread."""
+    if measurement is None:
+        return func(*args)
+    previous: _Measurement | None = getattr(_current, "measurement", None)
+    _current.measurement = measurement
+    try:
+        return func(*args)
+    finally:
+        _current.measurement = previous
+
+
+def _count_retry() -> None:
+    """Credit a retried attempt to the measurement of the thread."""
+    if (measurement := _current_measurement()) is not None:
+        measurement.add_retry()
+
+
+class _PooledResponse:
+    """Response returning its connection to the pool once it is read or closed.
+
+    It offers the interface of the responses of ``urllib.request.urlopen``.
+    """
+
+    def __init__(
+        self,
+        response: http.client.HTTPResponse,
+        url: str,
+        release: Callable[[bool], None],
+    ) -> None:
+        self._response: http.client.HTTPResponse = response
+        self._release: Callable[[bool], None] | None = release
+        self.url: str = url
+        self.status: int = response.status
+        self.code: int = response.status
+        self.reason: str = response.reason
+        self.msg: str = response.reason
+        self.headers: http.client.HTTPMessage = response.headers
+        if response.length == 0 and not response.chunked:
+            # e.g. the response to a HEAD request, there is nothing to be read
+            self.close()
+
+    @property
+    def length(self) -> int | None:
+        """Return the number of bytes left to be read, if it is known."""
+        return self._response.length
+
+    def read(self, amt: int | None = None) -> bytes:
+        """Read and return up to ``amt`` bytes of the body, or all of it."""
+        data: bytes = self._response.read(amt)
+        if self._response.isclosed():
+            self.close()
+        return data
+
+    def info(self) -> http.client.HTTPMessage:
+        """Return the headers."""
+        return self.headers
+
+    def geturl(self) -> str:
+        """Return the url of the response."""
+        return self.url
+
+    def getcode(self) -> int:
+        """Return the status code."""
+        return self.status
+
+    def getheader(self, name: str, default: str | None = None) -> str | None:
+        """Return the value of the header."""
+        return self._response.getheader(name, default)
+
+    def close(self) -> None:
+        """Close the response and return the connection to the pool.
+
+        The connection is only kept if the whole body has been read.
+        """
+        if (release := self._release) is None:
+            return
+        self._release = None
+        complete: bool = self._response.isclosed() or (
+            self._response.length == 0 and not self._response.chunked
+        )
+        self._response.close()
+        release(complete and not self._response.will_close)
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        self.close()
+
+
+class ConnectionPool:
+    """Thread-safe pool of keep-alive connections shared by all requests.
+
+    Once installed, every request made with ``urllib.request.urlopen``,
+    including the requests of pytube resolving the metadata and the sizes,
+    reuses an idle connection to the host if there is one,
+    instead of connecting and negotiating TLS again.
+    At most ``max_connections_per_host`` connections are open to a host,
+    further requests wait until a connection is returned to the pool.
+    """
+
+    def __init__(
+        self,
+        max_connections_per_host: int = _DEFAULT_MAX_CONNECTIONS_PER_HOST,
+    ) -> None:
+        self.max_connections_per_host: int = max_connections_per_host
+        self.opened: int = 0
+        self.reused: int = 0
+        self._condition: threading.Condition = threading.Condition()
+        self._idle: dict[tuple[str, str], list[http.client.HTTPConnection]] = {}
+        self._connections: dict[tuple[str, str], int] = {}
+        self._installed: bool = False
+
+    @property
+    def reuse_ratio(self) -> float:
+        """Return the share of requests sent over a reused connection."""
+        requests: int = self.opened + self.reused
+        return self.reused / requests if requests else 0.0
+
+    def install(self, *handlers: urllib.request.BaseHandler) -> None:
+        """Send the requests of ``urllib.request.urlopen`` through the pool.
+
+        Further handlers, e.g. rewriting the requests, can be added to the opener.
+        """
+        handler: urllib.request.BaseHandler = cast(
+            "urllib.request.BaseHandler",
+            _PoolHandler(self),
+        )
+        urllib.request.install_opener(urllib.request.build_opener(handler, *handlers))
+        self._installed = True
+
+    def open(self, request: urllib.request.Request) -> _PooledResponse:
+        """Send the request over a pooled connection and return the response.
+
+        If the server has closed a reused connection in the meantime,
+        the request is sent again over another connection.
+        """
+        if (measurement := _current_measurement()) is not None:
+            measurement.add_request()
+        key: tuple[str, str] = (request.type, request.host)
+        headers: dict[str, str] = {
+            name.title(): value for name, value in request.header_items()
+        }
+        while True:
+            connection, reused = self._acquire(key, request.timeout)
+            try:
+                connection.request(
+                    request.get_method(),
+                    request.selector,
+                    request.data,
+                    headers,
+                    encode_chunked=request.has_header("Transfer-encoding"),
+                )
+                response: http.client.HTTPResponse = connection.getresponse()
+            except (ConnectionError, http.client.BadStatusLine):
+                self._release(key, connection, reuse=False)
+                # the server may have closed the idle connection in the meantime
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                self._release(key, connection, reuse=False)
+                raise
+            return _PooledResponse(
+                response,
+                request.full_url,
+                partial(self._release, key, connection),
+            )
+
+    def close(self) -> None:
+        """Close the idle connections and uninstall the pool."""
+        with self._condition:
+            idle: list[http.client.HTTPConnection] = [
+                connection
+                for connections in self._idle.values()
+                for connection in connections
+            ]
+            for key, connections in self._idle.items():
+                self._connections[key] -= len(connections)
+            self._idle.clear()
+        for connection in idle:
+            connection.close()
+        if self._installed:
+            urllib.request.install_opener(None)
+            self._installed = False
+
+    def _acquire(
+        self,
+        key: tuple[str, str],
+        timeout: float | None,
+    ) -> tuple[http.client.HTTPConnection, bool]:
+        """Return an idle or a new connection and whether it is reused."""
+        with self._condition:
+            while not self._idle.get(key):
+                if self._connections.get(key, 0) < self.max_connections_per_host:
+                    self._connections[key] = self._connections.get(key, 0) + 1
+                    self.opened += 1
+                    break
+                self._condition.wait()
+            else:
+                self.reused += 1
+                return self._idle[key].pop(), True
+
+        scheme, host = key
+        connection_class: type[http.client.HTTPConnection] = (
+            http.client.HTTPSConnection
+            if scheme == "https"
+            else http.client.HTTPConnection
+        )
+        return connection_class(host, timeout=timeout), False
+
+    def _release(
+        self,
+        key: tuple[str, str],
+        connection: http.client.HTTPConnection,
+        reuse: bool,  # noqa: FBT001
+    ) -> None:
+        """Return the connection to the pool, or close it."""
+        with self._condition:
+            if reuse:
+                self._idle.setdefault(key, []).append(connection)
+            else:
+                self._connections[key] -= 1
+            self._condition.notify()
+        if not reuse:
+            connection.close()
+
+
+class _PoolHandler:
+    """Handler of ``urllib.request`` opening http and https requests with the pool.
+
+    It is duck-typed, so ``urllib.request`` is not loaded to define it.
+    """
+
+    # before the default handlers, which open a new connection for every request
+    handler_order: int = 100
+
+    def __init__(self, pool: ConnectionPool) -> None:
+        self._pool: ConnectionPool = pool
+        self.parent: urllib.request.OpenerDirector | None = None
+
+    def add_parent(self, parent: urllib.request.OpenerDirector) -> None:
+        """Set the opener the handler belongs to."""
+        self.parent = parent
+
+    def close(self) -> None:
+        """Do nothing, the connections belong to the pool."""
+
+    def http_open(self, request: urllib.request.Request) -> _PooledResponse | None:
+        """Open the request, unless it is sent through a proxy."""
+        if request.host != urlsplit(request.full_url).netloc:
+            return None
+        return self._pool.open(request)
+
+    https_open = http_open
+
+    def __lt__(self, other: object) -> bool:
+        return self.handler_order < getattr(other, "handler_order", sys.maxsize)
+
+
+class AsyncDownloadEngine:
+    """Engine resolving, probing and downloading with asyncio tasks.
+
+    Every video and every stream is a lightweight task, so batches of tens of
+    thousands of videos are handled without a thread per video.
+    The blocking work of ``pytube`` and ``urllib`` runs on a pool of threads,
+    which lives as long as the engine. Semaphores bound how many videos are
+    resolved, how many sizes are probed and how many streams are downloaded
+    at once. The engine must only be used from a single event loop.
+    Adaptive streams are muxed by the muxer, which is ffmpeg by default.
+    """
+
+    def __init__(
+        self,
+        max_resolutions: int = _DEFAULT_MAX_RESOLUTIONS,
+        max_probes: int = _DEFAULT_MAX_PROBES,
+        max_downloads: int = _MAX_DOWNLOAD_WORKERS,
+        muxer: Callable[[Path, Path, Path], object] | None = None,
+    ) -> None:
+        self._muxer: Callable[[Path, Path, Path], object] | None = muxer
+        self._limits: dict[str, int] = {
+            "resolve": max_resolutions,
+            "probe": max_probes,
+            "download": max_downloads,
+        }
+        # the semaphores are created on first use within the event loop
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=max_resolutions + max_probes + max_downloads,
+            thread_name_prefix="engine",
+        )
+        # the blocking work still waiting for a thread is skipped once cancelled
+        self._cancelled: threading.Event = threading.Event()
+
+    def _semaphore(self, phase: str) -> asyncio.Semaphore:
+        if (semaphore := self._semaphores.get(phase)) is None:
+            semaphore = self._semaphores[phase] = asyncio.Semaphore(
+                self._limits[phase],
+            )
+        return semaphore
+
+    async def _run(self, func: Callable[..., _T], *args: Any) -> _T:
+        """Run the blocking function on the threads of the engine."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor,
+            partial(self._call, func, *args),
+        )
+
+    def _call(self, func: Callable[..., _T], *args: Any) -> _T:
+        if self._cancelled.is_set():
+            raise DownloadCancelledError("the engine was cancelled")
+        return func(*args)
+
+    async def resolve_playlist(
+        self,
+        playlist: pytube.Playlist,
+        metadata_cache: MetadataCache | None = None,
+    ) -> PlaylistInfo:
+        """Return the information about the playlist, fetching it only if it is not cached."""
+        async with self._semaphore("resolve"):
+            return await self._run(_resolve_playlist, playlist, metadata_cache)
+
+    async def resolve_video(
+        self,
+        video_id: str,
+        metadata_cache: MetadataCache | None = None,
+        *,
+        estimate_sizes: bool = False,
+    ) -> VideoInfo:
+        """Return the information about the video, fetching it only if it is not cached.
+
+        Unknown file sizes of the streams matching a download option are probed
+        concurrently once the video has been resolved, unless only estimated sizes
+        are needed.
+        """
+        with _measure("resolve", video_id, current=False):
+            return await self._resolve_video(video_id, metadata_cache, estimate_sizes)
+
+    async def _resolve_video(
+        self,
+        video_id: str,
+        metadata_cache: MetadataCache | None,
+        estimate_sizes: bool,  # noqa: FBT001
+    ) -> VideoInfo:
+        cached_video_info: VideoInfo | None = (
+            await self._run(metadata_cache.get_video, video_id)
+            if metadata_cache is not None
+            else None
+        )
+        video_info: VideoInfo
+        if cached_video_info is not None:
+            video_info = cached_video_info
+        else:
+            async with self._semaphore("resolve"):
+                video_info = await self._run(
+                    lambda: _read_video_info(pytube.YouTube(_watch_url(video_id))),
+                )
+        if not estimate_sizes:
+            unknown_size_streams: list[StreamInfo] = _get_unknown_size_streams(
+                video_info,
+            )
+            filesizes: list[int] = await asyncio.gather(
+                *(self.probe_size(stream) for stream in unknown_size_streams),
+            )
+            video_info = _replace_filesizes(
+                video_info,
+                {
+                    stream.itag: filesizes[index]
+                    for index, stream in enumerate(unknown_size_streams)
+                },
+            )
+        if metadata_cache is not None and video_info != cached_video_info:
+            await self._run(metadata_cache.put_video, video_info)
+        return video_info
+
+    async def probe_size(self, stream: StreamInfo) -> int:
+        """Return the size of the stream in bytes, requesting it only once."""
+        if (filesize := _probed_filesizes.get((stream.video_id, stream.itag))) is None:
+            async with self._semaphore("probe"):
+                filesize = await self._run(_probe_filesize, stream)
+        return filesize
+
+    async def get_playlist_streams(
+        self,
+        playlist_info: PlaylistInfo,
+        metadata_cache: MetadataCache | None = None,
+        download_options: Iterable[DownloadOptions] = DOWNLOAD_OPTIONS,
+        *,
+        estimate_sizes: bool = False,
+    ) -> dict[DownloadOptions, list[StreamInfo | None]]:
+        """Return the lists of the streams of the playlist to every download option.
+
+        Every video is resolved by its own task and only fetched once,
+        videos found in the metadata cache are not fetched at all.
+        """
+        download_options = tuple(download_options)
+        video_streams: list[dict[DownloadOptions, StreamInfo | None]] = (
+            await asyncio.gather(
+                *(
+                    self._select_streams(
+                        video_id,
+                        metadata_cache,
+                        download_options,
+                        estimate_sizes,
+                    )
+                    for video_id in playlist_info.video_ids
+                ),
+            )
+        )
+        return {
+            options: [streams[options] for streams in video_streams]
+            for options in download_options
+        }
+
+    async def _select_streams(
+        self,
+        video_id: str,
+        metadata_cache: MetadataCache | None,
+        download_options: tuple[DownloadOptions, ...],
+        estimate_sizes: bool,  # noqa: FBT001
+    ) -> dict[DownloadOptions, StreamInfo | None]:
+        # only the selected streams are kept, not all streams of every video
+        return _get_streams_from_video(
+            await self.resolve_video(
+                video_id,
+                metadata_cache,
+                estimate_sizes=estimate_sizes,
+            ),
+            download_options,
+        )
+
+    async def iterate(self, iterable: Iterable[_T]) -> AsyncIterator[_T]:
+        """Yield the items of a blocking iterable, which are taken on the threads.
+
+        E.g. the pages of a playlist are loaded lazily without blocking the loop.
+        """
+        iterator: Iterator[_T] = iter(iterable)
+        exhausted: Any = object()
+        while (item := await self._run(next, iterator, exhausted)) is not exhausted:
+            yield item
+
+    async def resolve_streams(
+        self,
+        video_ids: AsyncIterable[str],
+        download_options: DownloadOptions,
+        metadata_cache: MetadataCache | None = None,
+    ) -> AsyncIterator[tuple[str, StreamInfo | None]]:
+        """Resolve the videos as their ids arrive and yield their streams in order.
+
+        Only as many videos as the engine resolves at once are resolved ahead of
+        the consumer, so any number of videos takes constant memory.
+        The stream is ``None`` if the video is unavailable in the download option.
+        """
+        # a slot is taken for every video and given back once it was consumed
+        slots: asyncio.Semaphore = asyncio.Semaphore(self._limits["resolve"])
+        resolutions: asyncio.Queue[tuple[str, asyncio.Future[VideoInfo]] | None] = (
+            asyncio.Queue()
+        )
+
+        async def feed() -> None:
+            try:
+                async for video_id in video_ids:
+                    await slots.acquire()
+                    resolutions.put_nowait(
+                        (
+                            video_id,
+                            asyncio.ensure_future(
+                                self.resolve_video(video_id, metadata_cache),
+                            ),
+                        ),
+                    )
+            finally:
+                resolutions.put_nowait(None)
+
+        feeder: asyncio.Future[None] = asyncio.ensure_future(feed())
+        try:
+            while (resolution := await resolutions.get()) is not None:
+                video_id, video_info = resolution
+                yield video_id, _get_streams_from_video(
+                    await video_info,
+                    (download_options,),
+                )[download_options]
+                slots.release()
+            await feeder
+        finally:
+            feeder.cancel()
+            while not resolutions.empty():
+                if (resolution := resolutions.get_nowait()) is not None:
+                    resolution[1].cancel()
+
+    async def download_playlist(  # noqa: PLR0913
+        self,
+        video_ids: Iterable[str],
+        download_options: DownloadOptions,
+        download_path: Path,
+        name_stream: Callable[[str, StreamInfo | None], str | None],
+        metadata_cache: MetadataCache | None = None,
+        max_workers: int = _DEFAULT_MAX_DOWNLOAD_WORKERS,
+        on_progress: Callable[[StreamInfo, int, int], None] | None = None,
+        archive: DownloadArchive | None = None,
+        limiter: BandwidthLimiter | None = None,
+    ) -> AsyncIterator[_DownloadResult]:
+        """Download the videos in a pipeline, yielding the results as they complete.
+
+        The ids are taken from the blocking iterable, e.g. while the pages of a
+        playlist are loading, every video is resolved as soon as its id arrives
+        and its stream is downloaded as soon as it is resolved. The stages take
+        their next item only once there is room in the next one, so the first
+        download starts after a few requests and memory stays flat, however
+        long the playlist is.
+        ``name_stream`` is called one after another on the threads with every
+        video in order and returns the file name of its stream without extension
+        or ``None`` to skip it, e.g. if it is unavailable in the download option.
+        """
+
+        async def named_streams() -> AsyncIterator[tuple[StreamInfo, str]]:
+            async for video_id, stream in self.resolve_streams(
+                self.iterate(video_ids),
+                download_options,
+                metadata_cache,
+            ):
+                file_name: str | None = await self._run(name_stream, video_id, stream)
+                if stream is not None and file_name is not None:
+                    yield stream, file_name
+
+        async for result in self._download_named_streams(
+            named_streams(),
+            download_path,
+            max_workers,
+            on_progress,
+            archive,
+            limiter,
+        ):
+            yield result
+
+    async def _download_named_streams(  # noqa: PLR0913
+        self,
+        named_streams: AsyncIterator[tuple[StreamInfo, str]],
+        download_path: Path,
+        max_workers: int,
+        on_progress: Callable[[StreamInfo, int, int], None] | None,
+        archive: DownloadArchive | None,
+        limiter: BandwidthLimiter | None,
+    ) -> AsyncIterator[_DownloadResult]:
+        """Download the streams into their files as they arrive.
+
+        A stream is only taken once fewer than ``max_workers`` streams are
+        downloading or waiting for their result to be consumed.
+        """
+        # a slot is taken for every stream and given back once its result was consumed
+        slots: asyncio.Semaphore = asyncio.Semaphore(max_workers)
+        results: asyncio.Queue[_DownloadResult | None] = asyncio.Queue()
+        tasks: set[asyncio.Future[None]] = set()
+
+        async def download(stream: StreamInfo, file_name: str) -> None:
+            async with self._semaphore("download"):
+                try:
+                    await self._run(
+                        partial(
+                            stream.download,
+                            output_path=str(download_path),
+                            filename=f"{file_name}.mp4",
+                            on_progress=(
+                                partial(on_progress, stream)
+                                if on_progress is not None
+                                else None
+                            ),
+                            archive=archive,
+                            limiter=limiter,
+                            muxer=self._muxer,
+                        ),
+                    )
+                except Exception as err:  # pylint: disable=W0718
+                    results.put_nowait(_DownloadResult(stream, err))
+                    return
+            results.put_nowait(_DownloadResult(stream, None))
+
+        async def feed() -> None:
+            try:
+                async for stream, file_name in named_streams:
+                    await slots.acquire()
+                    task: asyncio.Future[None] = asyncio.ensure_future(
+                        download(stream, file_name),
+                    )
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                await asyncio.gather(*tasks)
+            finally:
+                results.put_nowait(None)
+
+        feeder: asyncio.Future[None] = asyncio.ensure_future(feed())
+        try:
+            while (result := await results.get()) is not None:
+                yield result
+                slots.release()
+            await feeder
+        finally:
+            feeder.cancel()
+            for task in tuple(tasks):
+                task.cancel()
+
+    def cancel(self) -> None:
+        """Skip the blocking work, which is still waiting for a thread."""
+        self._cancelled.set()
+
+    def close(self) -> None:
+        """Wait for the running blocking work and release the threads."""
+        self._executor.shutdown()
+
+
+class DownloadEngine:
+    """Synchronous wrapper of ``AsyncDownloadEngine`` for the windows.
+
+    The engine runs on an event loop in a background thread,
+    every method blocks until the work submitted to the loop is done.
+    """
+
+    def __init__(
+        self,
+        max_resolutions: int = _DEFAULT_MAX_RESOLUTIONS,
+        max_probes: int = _DEFAULT_MAX_PROBES,
+        max_downloads: int = _MAX_DOWNLOAD_WORKERS,
+        muxer: Callable[[Path, Path, Path], object] | None = None,
+    ) -> None:
+        self.muxer: Callable[[Path, Path, Path], object] | None = muxer
+        self.engine: AsyncDownloadEngine = AsyncDownloadEngine(
+            max_resolutions,
+            max_probes,
+            max_downloads,
+            muxer,
+        )
+        self._loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+        self._thread: threading.Thread = threading.Thread(
+            target=self._loop.run_forever,
+            name="engine-loop",
+            daemon=True,
+        )
+        self._thread.start()
+        # the loop is stopped once an engine, which was not closed, is collected
+        self._finalizer: weakref.finalize[..., DownloadEngine] = weakref.finalize(
+            self,
+            self._loop.call_soon_threadsafe,
+            self._loop.stop,
+        )
+
+    def _call(self, coroutine: Coroutine[Any, Any, _T]) -> _T:
+        """Run the coroutine on the loop of the engine and return its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def resolve_playlist(
+        self,
+        playlist: pytube.Playlist,
+        metadata_cache: MetadataCache | None = None,
+    ) -> PlaylistInfo:
+        """Return the information about the playlist, fetching it only if it is not cached."""
+        return self._call(self.engine.resolve_playlist(playlist, metadata_cache))
+
+    def resolve_video(
+        self,
+        video_id: str,
+        metadata_cache: MetadataCache | None = None,
+        *,
+        estimate_sizes: bool = False,
+    ) -> VideoInfo:
+        """Return the information about the video, fetching it only if it is not cached."""
+        return self._call(
+            self.engine.resolve_video(
+                video_id,
+                metadata_cache,
+                estimate_sizes=estimate_sizes,
+            ),
+        )
+
+    def get_playlist_streams(
+        self,
+        playlist_info: PlaylistInfo,
+        metadata_cache: MetadataCache | None = None,
+        download_options: Iterable[DownloadOptions] = DOWNLOAD_OPTIONS,
+        *,
+        estimate_sizes: bool = False,
+    ) -> dict[DownloadOptions, list[StreamInfo | None]]:
+        """Return the lists of the streams of the playlist to every download option."""
+        return self._call(
+            self.engine.get_playlist_streams(
+                playlist_info,
+                metadata_cache,
+                download_options,
+                estimate_sizes=estimate_sizes,
+            ),
+        )
+
+    def _iterate(self, items: AsyncIterator[_T]) -> Iterator[_T]:
+        """Yield the items of the asynchronous iterator running on the loop.
+
+        The iterator is closed if the items are not consumed until the end.
+        """
+        results: queue.Queue[tuple[_T] | None] = queue.Queue()
+
+        async def collect() -> None:
+            try:
+                async for item in items:
+                    results.put((item,))
+            finally:
+                results.put(None)
+
+        future: Future[None] = asyncio.run_coroutine_threadsafe(collect(), self._loop)
+        try:
+            while (result := results.get()) is not None:
+                yield result[0]
+            future.result()
+        finally:
+            future.cancel()
+
+    def download_playlist(  # noqa: PLR0913
+        self,
+        video_ids: Iterable[str],
+        download_options: DownloadOptions,
+        download_path: Path,
+        name_stream: Callable[[str, StreamInfo | None], str | None],
+        metadata_cache: MetadataCache | None = None,
+        max_workers: int = _DEFAULT_MAX_DOWNLOAD_WORKERS,
+        on_progress: Callable[[StreamInfo, int, int], None] | None = None,
+        archive: DownloadArchive | None = None,
+        limiter: BandwidthLimiter | None = None,
+    ) -> Iterator[_DownloadResult]:
+        """Download the videos in a pipeline and yield the results as they complete.
+
+        The downloads are cancelled if the results are not consumed until the end.
+        """
+        return self._iterate(
+            self.engine.download_playlist(
+                video_ids,
+                download_options,
+                download_path,
+                name_stream,
+                metadata_cache,
+                max_workers,
+                on_progress,
+                archive,
+                limiter,
+            ),
+        )
+
+    def cancel(self) -> None:
+        """Skip the blocking work of the engine, which is still waiting for a thread."""
+        self.engine.cancel()
+
+    def close(self) -> None:
+        """Stop the event loop and release the threads of the engine."""
+        self._finalizer()
+        self._thread.join()
+        self._loop.close()
+        self.engine.close()
+
+
+class CommandProcessor:
+    """External command post-processing a file.
+
+    Every ``{}`` in the arguments is replaced by the path of the file,
+    without one the path is passed as last argument.
+    """
+
+    def __init__(self, args: Iterable[str]) -> None:
+        self.args: tuple[str, ...] = tuple(args)
+
+    def __call__(self, path: Path) -> None:
+        """Run the command on the file, raise if it fails."""
+        args: list[str] = [
+            arg.replace(_PATH_PLACEHOLDER, str(path)) for arg in self.args
+        ]
+        if not any(_PATH_PLACEHOLDER in arg for arg in self.args):
+            args.append(str(path))
+        subprocess.run(args, check=True, capture_output=True)
+
+
+def _parse_command_processor(command: str) -> CommandProcessor:
+    """Return the processor running the command line."""
+    # shlex is only loaded once a command is given, not when the program is imported
+    args: list[str] = _lazy_import("shlex").split(command)
+    if not args:
+        raise ValueError("empty command")
+    return CommandProcessor(args)
+
+
+def _import_function(reference: str) -> Any:
+    """Return the function referenced as ``module:function``."""
+    module_name, _, qualname = reference.partition(":")
+    if not module_name or not qualname:
+        raise ValueError(f"invalid function: {reference!r}")
+    function: Any = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        function = getattr(function, name)
+    return function
+
+
+def _parse_function_processor(reference: str) -> Callable[[Path], object]:
+    """Return the function referenced as ``module:function``.
+
+    The function is called with the path of the file.
+    """
+    return cast("Callable[[Path], object]", _import_function(reference))
+
+
+def _parse_muxer(reference: str) -> Callable[[Path, Path, Path], object]:
+    """Return the muxer referenced as ``module:function``.
+
+    The function is called with the paths of the video, the audio and the file.
+    """
+    return cast("Callable[[Path, Path, Path], object]", _import_function(reference))
+
+
+def _process_file(
+    processors: tuple[Callable[[Path], object], ...],
+    path: Path,
+) -> _ProcessingResult:
+    """Run the processors one after another on the file in a process of the pool."""
+    start: float = time.perf_counter()
+    error: str | None = None
+    try:
+        for processor in processors:
+            processor(path)
+    except Exception as err:  # pylint: disable=W0718
+        error = f"{err.__class__.__name__}: {err}"
+    return _ProcessingResult(path, time.perf_counter() - start, error)
+
+
+class PostProcessor:
+    """Run downloaded files through processors in a pool of processes.
+
+    Processors are external commands or importable functions, which are called
+    with the path of the file and change it in place, e.g. to tag or normalize it.
+    Files are processed while the downloads continue, at most ``max_workers``
+    at a time, so the CPU-heavy work neither waits for all downloads
+    nor slows down the downloading threads.
+    """
+
+    def __init__(
+        self,
+        processors: Iterable[Callable[[Path], object]],
+        max_workers: int = _DEFAULT_MAX_PROCESSES,
+    ) -> None:
+        self._processors: tuple[Callable[[Path], object], ...] = tuple(processors)
+        # spawned processes do not inherit the threads and locks of the downloads
+        self._executor: concurrent.futures.ProcessPoolExecutor = (
+            concurrent.futures.ProcessPoolExecutor(
+                max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        )
+        # files submitted whose callback has not returned yet
+        self._pending: int = 0
+        self._processed: threading.Condition = threading.Condition()
+
+    def submit(
+        self,
+        path: Path,
+        on_processed: Callable[[_ProcessingResult], None],
+    ) -> None:
+        """Process the file once a process is free and pass its result to the callback.
+
+        The callback is called from a background thread.
+        """
+        with self._processed:
+            self._pending += 1
+        self._executor.submit(_process_file, self._processors, path).add_done_callback(
+            partial(self._finish, path, on_processed),
+        )
+
+    def _finish(
+        self,
+        path: Path,
+        on_processed: Callable[[_ProcessingResult], None],
+        future: Future[_ProcessingResult],
+    ) -> None:
+        try:
+            if (err := future.exception()) is not None:
+                error: str = f"{err.__class__.__name__}: {err}"
+                on_processed(_ProcessingResult(path, 0.0, error))
+            else:
+                on_processed(future.result())
+        finally:
+            with self._processed:
+                self._pending -= 1
+                self._processed.notify_all()
+
+    def join(self) -> None:
+        """Wait until every submitted file was processed and reported."""
+        with self._processed:
+            self._processed.wait_for(lambda: not self._pending)
+
+    def close(self) -> None:
+        """Wait for the submitted files and stop the processes."""
+        self._executor.shutdown()
+
+
+class DownloadManager:
+    """Run the jobs of the job queue in the background, a few of them at once.
+
+    Urls are added as jobs, which are claimed in priority order by ``max_jobs``
+    threads together with the jobs left unfinished by earlier runs, so any
+    number of videos and playlists can be queued while at most ``max_jobs``
+    of them are downloaded at the same time. The status of every job is updated
+    from the events its run writes to the printer and can be listed at any time.
+    Closing the manager waits for the running jobs, a job failing while the
+    manager is closed was interrupted, e.g. by cancelling its downloads, and is
+    resumed by the next run like the jobs interrupted by exiting.
+    """
+
+    def __init__(
+        self,
+        job_queue: JobQueue,
+        run_job: Callable[[Job], str | None],
+        printer: _ProgressPrinter,
+        max_jobs: int = _DEFAULT_MAX_JOBS,
+    ) -> None:
+        self._job_queue: JobQueue = job_queue
+        self._run_job: Callable[[Job], str | None] = run_job
+        self._statuses: dict[int, DownloadStatus] = {}
+        # the unfinished jobs by their urls, a url is not added again while its
+        # job is unfinished, though two jobs of a url may be left by earlier runs
+        self._job_ids: dict[str, int] = {}
+        # jobs waiting for a thread and jobs being run
+        self._waiting: int = 0
+        self._running: int = 0
+        self._closed: bool = False
+        self._changed: threading.Condition = threading.Condition()
+        printer.subscribe(self._record)
+        self._threads: list[threading.Thread] = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(max_jobs)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def add(  # noqa: PLR0913
+        self,
+        urls: Iterable[str],
+        profile: str = "HD",
+        output_dir: Path = Path(),
+        priority: int = 0,
+        *,
+        sync: bool = False,
+        prune: bool = False,
+    ) -> UrlClassification:
+        """Add a job for every valid url and return how the urls were classified.
+
+        A video or playlist linked by more than one url, also by the url of an
+        unfinished job, is only added once, the other urls are duplicates.
+        """
+        classification: UrlClassification = classify_urls(urls)
+        added: list[YouTubeUrl] = []
+        duplicates: list[YouTubeUrl] = list(classification.duplicates)
+        for youtube_url in classification.unique:
+            url: str = youtube_url.canonical_url
+            with self._changed:
+                if url in self._job_ids:
+                    duplicates.append(youtube_url)
+                    continue
+                job_id: int = self._job_queue.add(
+                    url,
+                    profile,
+                    output_dir.absolute(),
+                    priority,
+                    sync=sync or prune,
+                    prune=prune,
+                )
+                self._job_ids[url] = job_id
+                self._statuses[job_id] = _create_download_status(job_id, url)
+                self._waiting += 1
+                self._changed.notify()
+            added.append(youtube_url)
+        return UrlClassification(added, duplicates, classification.invalid)
+
+    def resume(self) -> int:
+        """Run the jobs left unfinished by earlier runs and return how many there are.
+
+        Failed jobs are retried, unless they were attempted too often. Running jobs
+        of other processes are only taken over once their heartbeat is stale.
+        """
+        self._job_queue.retry_failed()
+        pending_jobs: list[Job] = self._job_queue.jobs(_PENDING)
+        running_jobs: list[Job] = self._job_queue.jobs(_RUNNING)
+        with self._changed:
+            for job in pending_jobs:
+                self._job_ids[job.url] = job.job_id
+                self._statuses[job.job_id] = _create_download_status(
+                    job.job_id,
+                    job.url,
+                )
+            self._waiting += len(pending_jobs) + len(running_jobs)
+            self._changed.notify_all()
+        return len(pending_jobs) + len(running_jobs)
+
+    def statuses(self) -> list[DownloadStatus]:
+        """Return the statuses of the jobs added or resumed, in the order of their ids."""
+        with self._changed:
+            return sorted(self._statuses.values())
+
+    def join(self) -> None:
+        """Wait until every added and resumed job has been run."""
+        with self._changed:
+            self._changed.wait_for(lambda: not self._waiting and not self._running)
+
+    def close(self) -> None:
+        """Stop the threads and wait until their running jobs returned.
+
+        The waiting jobs stay queued.
+        """
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self) -> None:
+        """Run the next job whenever one is waiting, until the manager is closed."""
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._waiting or self._closed)
+                if self._closed:
+                    return
+                self._waiting -= 1
+                self._running += 1
+            try:
+                self._run_next()
+            finally:
+                with self._changed:
+                    self._running -= 1
+                    self._changed.notify_all()
+
+    def _run_next(self) -> None:
+        # the job with the highest priority is run, which is not necessarily the
+        # one the thread was woken for, and none if another process claimed it
+        if (job := self._job_queue.claim()) is None:
+            return
+        with self._changed:
+            self._job_ids[job.url] = job.job_id
+            self._statuses[job.job_id] = _create_download_status(
+                job.job_id,
+                job.url,
+                _RUNNING,
+            )
+        error: str | None = self._run_job(job)
+        with self._changed:
+            interrupted: bool = error is not None and self._closed
+        if interrupted:
+            self._job_queue.interrupt(job.job_id)
+        else:
+            self._job_queue.finish(job.job_id, error)
+        with self._changed:
+            if self._job_ids.get(job.url) == job.job_id:
+                del self._job_ids[job.url]
+            status: DownloadStatus = self._statuses[job.job_id]
+            self._statuses[job.job_id] = status._replace(
+                state=(
+                    _PENDING
+                    if interrupted
+                    else _FAILED if error is not None else _COMPLETED
+                ),
+                percent=status.percent if error is not None else 100,
+                bytes_per_second=0.0,
+                eta=None,
+                error=error,
+            )
+
+    def _record(self, record: dict[str, Any]) -> None:
+        """Update the status of the job, whose run wrote the event."""
+        with self._changed:
+            if (job_id := record.get("job")) not in self._statuses:
+                return
+            status: DownloadStatus = self._statuses[job_id]
+            if record["event"] == "resolved":
+                self._statuses[job_id] = status._replace(title=record["title"])
+            elif record["event"] == "progress":
+                self._statuses[job_id] = status._replace(
+                    percent=record["percent"],
+                    bytes_per_second=record["bytes_per_second"],
+                    eta=record["eta"],
+                )
+
+
+def _create_download_status(
+    job_id: int,
+    url: str,
+    state: str = _PENDING,
+) -> DownloadStatus:
+    """Create the status of a job, which has not been resolved yet."""
+    return DownloadStatus(
+        job_id=job_id,
+        url=url,
+        title=None,
+        state=state,
+        percent=0,
+        bytes_per_second=0.0,
+        eta=None,
+        error=None,
+    )
+
+
+def get_downloader(  # noqa: PLR0913
+    url: str,
+    metadata_cache: MetadataCache | None = None,
+    archive: DownloadArchive | None = None,
+    limiter: BandwidthLimiter | None = None,
+    engine: DownloadEngine | None = None,
+    job_queue: JobQueue | None = None,
+    *,
+    estimate_sizes: bool = False,
+) -> YouTubeDownloader:
+    """Return the appropriate YouTube downloader based on the given url.
+
+    Playlists are resolved and downloaded by the given download engine
+    and their downloads are recorded in the job queue.
+    With ``estimate_sizes`` the sizes are estimated instead of probed.
+    """
+    if _is_playlist_url(url):
+        return PlaylistDownloader(
+            url,
+            metadata_cache=metadata_cache,
+            archive=archive,
+            limiter=limiter,
+            engine=engine,
+            job_queue=job_queue,
+            estimate_sizes=estimate_sizes,
+        )
+    return VideoDownloader(
+        url,
+        metadata_cache=metadata_cache,
+        archive=archive,
+        limiter=limiter,
+        estimate_sizes=estimate_sizes,
+    )
+
+
+def _is_playlist_url(url: str) -> bool:
+    """Return whether the url links to a playlist rather than to a single video.
+
+    Raise ``RegexMatchError`` if the url links to neither.
+    """
+    return parse_youtube_url(url).is_playlist
+
+
+def parse_youtube_url(url: str) -> YouTubeUrl:
+    """Return the ids of the video and the playlist and the start the url links to.
+
+    The url is parsed in a single pass, which takes time linear in its length
+    even for adversarial urls. Raise ``RegexMatchError`` if the url links
+    to neither a video nor a playlist.
+    """
+    with _measure("classify", url):
+        if (youtube_url := _parse_youtube_url(url)) is not None:
+            return youtube_url
+    raise pytube.exceptions.RegexMatchError(
+        parse_youtube_url.__name__,
+        "a url of a YouTube video or playlist",
+    )
+
+
+def classify_urls(urls: Iterable[str]) -> UrlClassification:
+    """Classify the urls by the videos and playlists they link to.
+
+    Only the first url linking to a video or playlist is unique, the others are
+    duplicates, even if they differ e.g. in their host or start.
+    """
+    unique: dict[str, YouTubeUrl] = {}
+    duplicates: list[YouTubeUrl] = []
+    invalid: list[str] = []
+    for url in urls:
+        try:
+            youtube_url: YouTubeUrl = parse_youtube_url(url)
+        except pytube.exceptions.RegexMatchError:
+            invalid.append(url)
+            continue
+        if youtube_url.canonical_url in unique:
+            duplicates.append(youtube_url)
+        else:
+            unique[youtube_url.canonical_url] = youtube_url
+    return UrlClassification(list(unique.values()), duplicates, invalid)
+
+
+def _parse_youtube_url(url: str) -> YouTubeUrl | None:
+    """Return what the url links to or ``None`` if it is no YouTube url."""
+    if (parts := _split_youtube_url(url)) is None:
+        return None
+    host, path, query = parts
+    playlist_id: str | None = _match_first(
+        _YOUTUBE_PLAYLIST_ID_PATTERN,
+        query.get("list", ()),
+    )
+    if path == ["playlist"]:
+        return YouTubeUrl(url, None, playlist_id, None) if playlist_id else None
+
+    candidates: list[str] = list(query.get("v", ()))
+    if host == "youtu.be" and len(path) == 1:
+        candidates.append(path[0])
+    elif len(path) == 2 and path[0] in _YOUTUBE_VIDEO_PATHS:
+        candidates.append(path[1][2:] if path[1].startswith("v=") else path[1])
+    elif path == ["attribution_link"]:
+        # the link to the video is given relative to the host
+        for link in query.get("u", ()):
+            candidates.extend(
+                _parse_query(unquote(link).partition("?")[2]).get("v", ()),
+            )
+    if (video_id := _match_first(_YOUTUBE_VIDEO_ID_PATTERN, candidates)) is None:
+        return None
+    return YouTubeUrl(
+        url,
+        video_id,
+        playlist_id,
+        _parse_start((*query.get("t", ()), *query.get("start", ()))),
+    )
+
+
+def _split_youtube_url(
+    url: str,
+) -> tuple[str, list[str], dict[str, list[str]]] | None:
+    """Return the host, the path segments and the query of a YouTube url.
+
+    The host is returned without ``www.`` or ``m.``. Return ``None``
+    if the url has no YouTube host. Every part is split off by a single scan,
+    which is cheaper than ``urlsplit`` and validates nothing but the host.
+    """
+    scheme, separator, rest = url.partition("://")
+    if not separator:
+        scheme, rest = "https", url
+    if scheme.lower() not in {"http", "https"}:
+        return None
+    rest = rest.partition("#")[0]
+    rest, _, query = rest.partition("?")
+    netloc, _, path = rest.partition("/")
+    host: str = netloc.rpartition("@")[2].partition(":")[0].lower()
+    for prefix in _YOUTUBE_HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix) :]
+            break
+    if host not in _YOUTUBE_HOSTS:
+        return None
+    return (
+        host,
+        [segment for segment in path.split("/") if segment],
+        _parse_query(query),
+    )
+
+
+def _parse_query(query: str) -> dict[str, list[str]]:
+    """Return the values of the parameters of the query.
+
+    Unlike ``parse_qs`` the values are not unquoted, since neither ids
+    nor starts contain quoted characters.
+    """
+    parameters: dict[str, list[str]] = {}
+    for parameter in query.split("&"):
+        name, _, value = parameter.partition("=")
+        parameters.setdefault(name, []).append(value)
+    return parameters
+
+
+def _parse_start(values: Iterable[str]) -> int | None:
+    """Return the seconds of the first valid start, e.g. ``85``, ``85s`` or ``1m25s``."""
+    for value in values:
+        if value and (match := _YOUTUBE_START_PATTERN.fullmatch(value)) is not None:
+            hours, minutes, seconds = (int(group or 0) for group in match.groups())
+            return hours * 3600 + minutes * 60 + seconds
+    return None
+
+
+def _match_first(pattern: re.Pattern[str], values: Iterable[str]) -> str | None:
+    """Return the first of the values matching the whole pattern."""
+    return next((value for value in values if pattern.fullmatch(value)), None)
+
+
+def _format_size(streams: Iterable[StreamInfo | PlaylistItem]) -> str:
+    """Return the total size of the streams in megabytes.
+
+    Unknown file sizes are replaced by their estimates, marking the total with ``~``.
+    """
+    total: int = 0
+    estimated: bool = False
+    for stream in streams:
+        total += stream.filesize or stream.estimated_filesize
+        estimated = estimated or not stream.filesize
+    return f"{'~' if estimated else ''}{round(total / 1048576, 1)} MB"
+
 
-import PySimpleGUI as sg
-import pytube.exceptions
-from pytube import Playlist, YouTube
+def _get_stream_from_video(
+    video: VideoInfo,
+    download_options: DownloadOptions,
+) -> StreamInfo | None:
+    """Return a stream filtered according to the download options."""
+    return _get_streams_from_video(video, (download_options,))[download_options]
 
-if TYPE_CHECKING:
-    from collections.abc import Iterator
 
-    from pytube import Stream
+def _get_streams_from_video(
+    video: VideoInfo,
+    download_options: Iterable[DownloadOptions] = DOWNLOAD_OPTIONS,
+) -> dict[DownloadOptions, StreamInfo | None]:
+    """Return a stream for each of the download options.
 
+    The streams are filtered the same way as ``pytube.StreamQuery.filter`` does,
+    in particular ``progressive=False`` does not exclude progressive streams.
+    Adaptive options return the video stream holding the audio stream.
+    """
+    return {
+        options: (
+            _get_adaptive_stream_from_video(video, options)
+            if options.adaptive
+            else next(
+                (
+                    stream
+                    for stream in video.streams
+                    if (
+                        options.resolution is None
+                        or stream.resolution == options.resolution
+                    )
+                    and stream.type == options.type
+                    and (not options.progressive or stream.is_progressive)
+                    and (options.abr is None or stream.abr == options.abr)
+                ),
+                None,
+            )
+        )
+        for options in download_options
+    }
 
-class DownloadOptions(NamedTuple):
-    """Tuple-like class holding the download options."""
 
-    resolution: str | None
-    type: str
-    progressive: bool
-    abr: str | None
+def _get_adaptive_stream_from_video(
+    video: VideoInfo,
+    download_options: DownloadOptions,
+) -> StreamInfo | None:
+    """Return the adaptive video stream and the audio stream to mux it with.
 
+    Only mp4 streams are chosen, so they are muxed without re-encoding them.
+    Without a resolution or bitrate in the options, the best one is chosen.
+    """
+    videos: list[StreamInfo] = [
+        stream
+        for stream in video.streams
+        if stream.type == "video"
+        and not stream.is_progressive
+        and stream.mime_type == "video/mp4"
+        and stream.resolution is not None
+        and download_options.resolution in {None, stream.resolution}
+    ]
+    audios: list[StreamInfo] = [
+        stream
+        for stream in video.streams
+        if stream.type == "audio"
+        and stream.mime_type == "audio/mp4"
+        and stream.abr is not None
+        and download_options.abr in {None, stream.abr}
+    ]
+    if not videos or not audios:
+        return None
+    best_video: StreamInfo = max(
+        videos,
+        key=lambda stream: int(cast("str", stream.resolution).rstrip("p")),
+    )
+    best_audio: StreamInfo = max(
+        audios,
+        key=lambda stream: int(cast("str", stream.abr).rstrip("kbps")),
+    )
+    return best_video._replace(
+        filesize=(
+            best_video.filesize + best_audio.filesize
+            if best_video.filesize and best_audio.filesize
+            else 0
+        ),
+        estimated_filesize=(
+            best_video.estimated_filesize + best_audio.estimated_filesize
+        ),
+        audio=best_audio,
+    )
 
-# defining download options
-LD: Final[DownloadOptions] = DownloadOptions(
-    resolution="360p",
-    type="video",
-    progressive=True,
-    abr=None,
-)
-HD: Final[DownloadOptions] = DownloadOptions(
-    resolution="720p",
-    type="video",
-    progressive=True,
-    abr=None,
-)
-AUDIO: Final[DownloadOptions] = DownloadOptions(
-    resolution=None,
-    type="audio",
-    progressive=False,
-    abr="128kbps",
-)
 
-_YOUTUBE_PLAYLIST_URL_PATTERN: Final[re.Pattern[str]] = re.compile(
-    r"^(?:https?:\/\/)?(?:www\.|m\.)?"
-    r"(?:youtube(?:-nocookie)?\.com|youtu.be)"
-    r"\/playlist\?list=[\w\-_]{34}$",
-)
-_YOUTUBE_VIDEO_URL_PATTERN: Final[re.Pattern[str]] = re.compile(
-    r"^(?:https?:\/\/)?(?:www\.|m\.)?"
-    r"(?:youtube(?:-nocookie)?\.com|youtu.be)"
-    r"\/?.*(?:watch|embed)?(?:.*v=|v\/|\/)[\w\-\_]{11}"
-    r"(?:\S+)?(?:\?t=(?:\d+h)?(?:\d+m)?(?:\d+s)?(?:\d+))?$",
-)
+def _create_stream_info(video_id: str, stream: Stream, length: int) -> StreamInfo:
+    """Create the information about a ``pytube.Stream`` of a video of the length.
 
+    The file size is taken from the stream manifest and is ``0`` if it is unknown,
+    the estimated file size is the average bitrate over the length of the video.
+    """
+    return StreamInfo(
+        video_id=video_id,
+        title=stream.title,
+        itag=stream.itag,
+        url=stream.url,
+        mime_type=stream.mime_type,
+        type=stream.type,
+        resolution=stream.resolution,
+        abr=stream.abr,
+        is_progressive=stream.is_progressive,
+        filesize=stream._filesize or 0,
+        estimated_filesize=(stream.bitrate or 0) * length // 8,
+    )
 
-# defining helper functions
-def _increment_playlist_dir_name(root: Path | str, sub: Path | str) -> Path:
-    """Increment the directory if the user downloads a playlist more than once."""
-    if not (original_path := Path(f"{root}/{sub}")).exists():
-        return original_path
 
-    i: int = 1
-    while Path(f"{root}/{sub} ({i})").exists():
-        i += 1
+def _create_playlist_item(stream: StreamInfo) -> PlaylistItem:
+    """Create the compact record of a stream selected for a playlist."""
+    return PlaylistItem(
+        video_id=stream.video_id,
+        title=stream.title,
+        itag=stream.itag,
+        url=stream.url,
+        filesize=stream.filesize,
+        estimated_filesize=stream.estimated_filesize,
+        expires=_get_stream_url_expiry(stream.url),
+    )
 
-    new_path: Path = Path(f"{root}/{sub} ({i})")
-    return new_path
 
+def _create_video_info(
+    video: pytube.YouTube,
+    *,
+    estimate_sizes: bool = False,
+) -> VideoInfo:
+    """Create the information about a ``pytube.YouTube``.
 
-def _increment_video_file_name(root: Path | str, file_name: str) -> str:
-    """Increment the file if the user downloads a video more than once."""
-    if not Path(f"{root}/{file_name}.mp4").exists():
-        return file_name
+    The streams of the video are only fetched once.
+    Unknown file sizes of the streams matching a download option are requested,
+    unless only estimated sizes are needed.
+    """
+    video_info: VideoInfo = _read_video_info(video)
+    if estimate_sizes:
+        return video_info
+    return _probe_unknown_sizes(video_info)
 
-    i: int = 1
-    while Path(f"{root}/{file_name} ({i}).mp4").exists():
-        i += 1
 
-    new_file_name: str = f"{file_name} ({i})"
-    return new_file_name
+def _probe_unknown_sizes(video_info: VideoInfo) -> VideoInfo:
+    """Return the information about the video with the unknown file sizes probed.
+
+    Only the streams matching a download option are probed, at most
+    ``_DEFAULT_MAX_PROBES`` at once. Sizes probed before are not requested again.
+    """
+    unknown_size_streams: list[StreamInfo] = _get_unknown_size_streams(video_info)
+    if not unknown_size_streams:
+        return video_info
+    with ThreadPoolExecutor(
+        max_workers=min(len(unknown_size_streams), _DEFAULT_MAX_PROBES),
+    ) as executor:
+        filesizes: list[int] = list(
+            executor.map(_probe_filesize, unknown_size_streams),
+        )
+    return _replace_filesizes(
+        video_info,
+        {
+            stream.itag: filesizes[index]
+            for index, stream in enumerate(unknown_size_streams)
+        },
+    )
+
 
+# the sizes of the probed streams by their video id and itag, which never change,
+# only the most recently probed ones are kept
+_probed_filesizes: dict[tuple[str, int], int] = {}
+_probed_filesizes_lock: threading.Lock = threading.Lock()
 
-def _remove_forbidden_characters_from_file_name(name: str) -> str:
-    r"""Remove '"' '\', '/', ':', '*', '?', '<', '>', '|' from a a file name.
 
-    This avoids an OSError while saving or moving a file on Windows.
+def _probe_filesize(stream: StreamInfo) -> int:
+    """Return the size of the stream, requesting it only once per video and itag.
+
+    Like ``pytube.Stream.filesize``, the size of a stream answering a request
+    for its headers with 404 is taken from its sequential segments.
     """
-    return "".join(char for char in name if char not in r'"\/:*?<>|')
+    key: tuple[str, int] = (stream.video_id, stream.itag)
+    if (filesize := _probed_filesizes.get(key)) is None:
+        with _measure("probe", f"{stream.video_id}:{stream.itag}"):
+            try:
+                filesize = cast("int", pytube.request.filesize(stream.url))
+            except urllib.request.HTTPError as err:
+                if err.code != http.HTTPStatus.NOT_FOUND:
+                    raise
+                filesize = cast("int", pytube.request.seq_filesize(stream.url))
+        with _probed_filesizes_lock:
+            if len(_probed_filesizes) >= _MAX_PROBED_FILESIZES:
+                del _probed_filesizes[next(iter(_probed_filesizes))]
+            _probed_filesizes[key] = filesize
+    return filesize
 
 
-def get_downloader(url: str) -> YouTubeDownloader:
-    """Return the appropriate YouTube downloader based on the given url."""
-    if _YOUTUBE_PLAYLIST_URL_PATTERN.fullmatch(url) is not None:
-        return PlaylistDownloader(url)
-    if _YOUTUBE_VIDEO_URL_PATTERN.fullmatch(url) is not None:
-        return VideoDownloader(url)
-    raise pytube.exceptions.RegexMatchError(
-        get_downloader.__name__,
-        f"({_YOUTUBE_PLAYLIST_URL_PATTERN.pattern}) | ({_YOUTUBE_VIDEO_URL_PATTERN.pattern})",
+def _read_video_info(video: pytube.YouTube) -> VideoInfo:
+    """Read the information about a ``pytube.YouTube`` without requesting any size."""
+    with _measure("fetch", video.video_id):
+        return VideoInfo(
+            video_id=video.video_id,
+            title=video.title,
+            length=video.length,
+            views=video.views,
+            author=video.author,
+            channel_url=video.channel_url,
+            thumbnail_url=video.thumbnail_url,
+            description=video.description or "",
+            streams=tuple(
+                _create_stream_info(video.video_id, stream, video.length)
+                for stream in video.streams
+            ),
+        )
+
+
+def _get_unknown_size_streams(video_info: VideoInfo) -> list[StreamInfo]:
+    """Return the streams matching a download option whose file size is unknown."""
+    return list(
+        {
+            stream.itag: stream
+            for stream in _get_streams_from_video(video_info).values()
+            if stream is not None and not stream.filesize
+        }.values(),
     )
 
 
-def _get_stream_from_video(
-    video: YouTube,
-    download_options: DownloadOptions,
-) -> Stream | None:
-    """Return a stream filtered according to the download options."""
-    return video.streams.filter(
-        resolution=download_options.resolution,
-        type=download_options.type,
-        progressive=download_options.progressive,
-        abr=download_options.abr,
-    ).first()
+def _replace_filesizes(video_info: VideoInfo, filesizes: dict[int, int]) -> VideoInfo:
+    """Return the information about the video with the file sizes of the itags."""
+    if not filesizes:
+        return video_info
+    return video_info._replace(
+        streams=tuple(
+            (
+                stream._replace(filesize=filesizes[stream.itag])
+                if stream.itag in filesizes
+                else stream
+            )
+            for stream in video_info.streams
+        ),
+    )
+
+
+def _create_playlist_info(
+    playlist: pytube.Playlist,
+    video_ids: Iterable[str] | None = None,
+) -> PlaylistInfo:
+    """Create the information about a ``pytube.Playlist``.
+
+    The ids of its videos are taken from all of its pages, unless they are given.
+    """
+    if video_ids is None:
+        video_ids = (pytube.extract.video_id(url) for url in playlist.video_urls)
+    with _measure("fetch", playlist.playlist_id):
+        return PlaylistInfo(
+            playlist_id=playlist.playlist_id,
+            title=playlist.title,
+            length=playlist.length,
+            views=playlist.views,
+            owner=playlist.owner,
+            owner_url=playlist.owner_url,
+            last_updated=str(playlist.last_updated),
+            video_ids=tuple(video_ids),
+        )
+
+
+def _get_live_stream(video: pytube.YouTube, itag: int) -> Stream:
+    """Return the downloadable ``pytube.Stream`` with the given itag of the video."""
+    if (stream := video.streams.get_by_itag(itag)) is None:
+        raise pytube.exceptions.PytubeError(
+            f"Stream {itag} of {video.video_id} is no longer available",
+        )
+    return stream
+
+
+def _get_stream_url_expiry(url: str) -> int:
+    """Return the unix time the signed url of a stream expires at, ``0`` if unknown."""
+    expire: list[str] | None = parse_qs(urlsplit(url).query).get("expire")
+    return int(expire[0]) if expire is not None else 0
+
+
+def _is_stream_url_expired(url: str) -> bool:
+    """Return whether the signed url of a stream has expired."""
+    return 0 < _get_stream_url_expiry(url) <= time.time()
+
+
+def _read_sidecar(part_path: Path, sidecar_path: Path, filesize: int) -> int:
+    """Return the number of bytes of the partial file that can be resumed from.
+
+    A missing, unreadable or outdated sidecar file means nothing was downloaded yet.
+    """
+    try:
+        sidecar: dict[str, Any] = json.loads(sidecar_path.read_text(encoding="utf-8"))
+        part_size: int = part_path.stat().st_size
+    except (OSError, ValueError):
+        return 0
+    if sidecar.get("filesize") != filesize:
+        return 0
+    bytes_done: int = sidecar.get("bytes_done", 0)
+    return min(bytes_done, part_size)
+
+
+def _is_downloaded(file_path: Path, filesize: int) -> bool:
+    """Return whether the file is a complete download of the size.
+
+    Without the size it is unknown, an empty file only reserves its name.
+    """
+    return bool(filesize) and (
+        file_path.is_file() and file_path.stat().st_size == filesize
+    )
+
+
+def _is_earlier_download(file_path: Path, filesize: int) -> bool:
+    """Return whether the file is a complete or partial download of the size.
+
+    A partial download is told by its sidecar file and an empty file reserved
+    the name for a download, which did not start yet.
+    """
+    if file_path.is_file() and file_path.stat().st_size in {0, filesize}:
+        return True
+    try:
+        sidecar: dict[str, Any] = json.loads(
+            file_path.with_name(f"{file_path.name}{_SIDECAR_SUFFIX}").read_text(
+                encoding="utf-8",
+            ),
+        )
+    except (OSError, ValueError):
+        return False
+    return bool(sidecar.get("filesize") == filesize)
+
+
+def _read_manifest(download_path: Path) -> dict[str, Any] | None:
+    """Return the manifest of the playlist directory or ``None`` if it has none."""
+    try:
+        manifest: dict[str, Any] = json.loads(
+            (download_path / _MANIFEST_NAME).read_text(encoding="utf-8"),
+        )
+    except (OSError, ValueError):
+        return None
+    return manifest
+
+
+def _write_sidecar(
+    sidecar_path: Path,
+    url: str,
+    filesize: int,
+    bytes_done: int,
+) -> None:
+    """Record the progress of the download next to the partial file."""
+    sidecar_path.write_text(
+        json.dumps({"url": url, "filesize": filesize, "bytes_done": bytes_done}),
+        encoding="utf-8",
+    )
+
+
+def _stat_file(path: Path) -> os.stat_result | None:
+    """Return the status of the file or ``None`` if it does not exist."""
+    try:
+        return path.stat()
+    except OSError:
+        return None
+
+
+def _clone_file(source: Path, target: Path) -> str:
+    """Create the target file with the content of the source file.
+
+    A hardlink is tried first, then a copy-on-write reflink and lastly a copy.
+    Return how the file was created.
+    """
+    try:
+        os.link(source, target)
+    except OSError:
+        pass
+    else:
+        return "hardlink"
+
+    if sys.platform.startswith("linux"):
+        try:
+            with source.open("rb") as source_file, target.open("wb") as target_file:
+                fcntl.ioctl(target_file.fileno(), _FICLONE, source_file.fileno())
+        except OSError:
+            target.unlink(missing_ok=True)
+        else:
+            return "reflink"
+
+    shutil.copyfile(source, target)
+    return "copy"
+
+
+def _ignore_chunk(_: int) -> None:
+    """Do not hold back a transfer, whatever it has received."""
+
+
+def _download_range(  # noqa: PLR0913
+    url: str,
+    file: BinaryIO,
+    start: int,
+    end: int | None,
+    on_chunk: Callable[[int], None],
+    *,
+    allow_restart: bool = True,
+) -> int:
+    """Download the given inclusive byte range into the file at its current position.
+
+    The whole file is requested if ``end`` is ``None``.
+    If the server ignores the range and answers with the whole file,
+    the file is rewritten from the start, unless ``allow_restart`` is false,
+    which rejects the answer even for a range starting at the first byte.
+    Return the number of bytes written.
+    A connection closed before all announced bytes arrived raises ``IncompleteRead``.
+    """
+    headers: dict[str, str] = dict(_HTTP_HEADERS)
+    if end is not None:
+        headers["Range"] = f"bytes={start}-{end}"
+
+    bytes_written: int = 0
+    with urllib.request.urlopen(  # noqa: S310 # nosec
+        urllib.request.Request(url, headers=headers),  # noqa: S310
+    ) as response:
+        if end is not None and response.status != 206:
+            if not allow_restart:
+                raise pytube.exceptions.PytubeError(
+                    "The server does not support range requests",
+                )
+            file.seek(0)
+            file.truncate()
+        expected_length: int | None = response.length
+        measurement: _Measurement | None = _current_measurement()
+        while chunk := response.read(_CHUNK_SIZE):
+            file.write(chunk)
+            bytes_written += len(chunk)
+            on_chunk(len(chunk))
+            if measurement is not None:
+                measurement.add_bytes(len(chunk))
+    if expected_length is not None and bytes_written < expected_length:
+        raise http.client.IncompleteRead(b"", expected_length - bytes_written)
+    return bytes_written
+
+
+def _download_resumable(  # noqa: PLR0913
+    url: str,
+    file_path: Path,
+    filesize: int,
+    on_progress: Callable[[int, int], None] | None = None,
+    max_retries: int = _DEFAULT_MAX_RETRIES,
+    throttle: Callable[[int], None] = _ignore_chunk,
+) -> None:
+    """Download the url into the given file, resuming an interrupted download.
+
+    The data is written into a ``.part`` file, next to which a ``.part.json`` sidecar
+    records the url, the expected file size and the number of bytes downloaded.
+    A later call continues with a range request from the last recorded offset.
+    The file is only moved into place after its size was verified.
+    Every received chunk is reported to ``throttle``, which may hold back the transfer.
+    """
+    if _is_downloaded(file_path, filesize):
+        return
+
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    part_path: Path = file_path.with_name(f"{file_path.name}{_PART_SUFFIX}")
+    sidecar_path: Path = file_path.with_name(f"{file_path.name}{_SIDECAR_SUFFIX}")
+
+    if not filesize:
+        # without the size neither range requests nor the verification are possible
+        with part_path.open("wb") as file:
+            _download_range(url, file, 0, None, throttle)
+        part_path.replace(file_path)
+        return
+
+    bytes_done: int = _read_sidecar(part_path, sidecar_path, filesize)
+    part_path.touch()
+    with part_path.open("r+b") as part_file:
+        part_file.truncate(bytes_done)
+        part_file.seek(bytes_done)
+
+        def on_chunk(chunk_size: int) -> None:
+            throttle(chunk_size)
+            if on_progress is not None:
+                on_progress(part_file.tell(), filesize)
+
+        retries: int = 0
+        while bytes_done < filesize:
+            try:
+                if not _download_range(
+                    url,
+                    part_file,
+                    bytes_done,
+                    min(bytes_done + _RANGE_SIZE, filesize) - 1,
+                    on_chunk,
+                ):
+                    break
+                retries = 0
+            except (http.client.HTTPException, OSError):  # including URLError
+                if retries >= max_retries:
+                    raise
+                retries += 1
+                _count_retry()
+            finally:
+                # everything written so far is kept for the next attempt
+                part_file.flush()
+                bytes_done = part_file.tell()
+                _write_sidecar(sidecar_path, url, filesize, bytes_done)
+
+    if bytes_done != filesize:
+        raise pytube.exceptions.PytubeError(
+            f"{file_path.name} is incomplete, "
+            f"expected {filesize} bytes but got {bytes_done}",
+        )
+    part_path.replace(file_path)
+    sidecar_path.unlink()
+
+
+def _split_into_segments(
+    filesize: int,
+    segments: int,
+    min_segment_size: int,
+) -> list[tuple[int, int]]:
+    """Split the file into at most the given number of inclusive byte ranges.
+
+    Every segment but the last one is at least ``min_segment_size`` bytes large.
+    """
+    segment_count: int = max(1, min(segments, filesize // max(min_segment_size, 1)))
+    segment_size: int = -(-filesize // segment_count)
+    return [
+        (start, min(start + segment_size, filesize) - 1)
+        for start in range(0, filesize, segment_size)
+    ]
+
+
+def _read_segmented_sidecar(
+    part_path: Path,
+    sidecar_path: Path,
+    filesize: int,
+    segments: list[tuple[int, int]],
+) -> list[int]:
+    """Return the offsets of the segments of the partial file to resume from.
+
+    Unless the sidecar file describes the same segments of the same file,
+    every segment starts over.
+    """
+    try:
+        sidecar: dict[str, Any] = json.loads(sidecar_path.read_text(encoding="utf-8"))
+        part_size: int = part_path.stat().st_size
+    except (OSError, ValueError):
+        return [start for start, _ in segments]
+    if (
+        sidecar.get("filesize") != filesize
+        or part_size != filesize
+        or [(start, end) for start, end, _ in sidecar.get("segments", [])] != segments
+    ):
+        return [start for start, _ in segments]
+    return [offset for _, _, offset in sidecar["segments"]]
+
+
+class _SegmentedDownload:
+    """The progress of a download split into segments, shared by their threads."""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        url: str,
+        sidecar_path: Path,
+        filesize: int,
+        byte_ranges: list[tuple[int, int]],
+        offsets: list[int],
+        throttle: Callable[[int], None] = _ignore_chunk,
+    ) -> None:
+        self._url: str = url
+        self._sidecar_path: Path = sidecar_path
+        self._filesize: int = filesize
+        self._byte_ranges: list[tuple[int, int]] = byte_ranges
+        self._offsets: list[int] = offsets
+        self._throttle: Callable[[int], None] = throttle
+        self._lock: threading.Lock = threading.Lock()
+        self.bytes_done: int = sum(
+            offset - byte_ranges[index][0] for index, offset in enumerate(offsets)
+        )
+
+    def download_segment(self, part_path: Path, index: int, max_retries: int) -> None:
+        """Download the remainder of the segment into the partial file."""
+        end: int = self._byte_ranges[index][1]
+        retries: int = 0
+        with part_path.open("r+b") as part_file:
+            while self._offsets[index] <= end:
+                part_file.seek(self._offsets[index])
+                try:
+                    if not _download_range(
+                        self._url,
+                        part_file,
+                        self._offsets[index],
+                        min(self._offsets[index] + _RANGE_SIZE - 1, end),
+                        self._on_chunk,
+                        allow_restart=False,
+                    ):
+                        # an empty answer is retried, instead of requested forever
+                        raise http.client.IncompleteRead(
+                            b"",
+                            end - self._offsets[index] + 1,
+                        )
+                    retries = 0
+                except (http.client.HTTPException, OSError):  # including URLError
+                    if retries >= max_retries:
+                        raise
+                    retries += 1
+                    _count_retry()
+                finally:
+                    part_file.flush()
+                    self._save_offset(index, part_file.tell())
+
+    def _on_chunk(self, chunk_size: int) -> None:
+        with self._lock:
+            self.bytes_done += chunk_size
+        self._throttle(chunk_size)
+
+    def _save_offset(self, index: int, offset: int) -> None:
+        """Record the offset of the segment in the sidecar file."""
+        with self._lock:
+            self._offsets[index] = offset
+            self._sidecar_path.write_text(
+                json.dumps(
+                    {
+                        "url": self._url,
+                        "filesize": self._filesize,
+                        "segments": [
+                            [start, end, self._offsets[segment]]
+                            for segment, (start, end) in enumerate(self._byte_ranges)
+                        ],
+                    },
+                ),
+                encoding="utf-8",
+            )
+
+
+def _download_segmented(  # noqa: PLR0913
+    url: str,
+    file_path: Path,
+    filesize: int,
+    on_progress: Callable[[int, int], None] | None = None,
+    segments: int = 1,
+    min_segment_size: int = _DEFAULT_MIN_SEGMENT_SIZE,
+    max_retries: int = _DEFAULT_MAX_RETRIES,
+    throttle: Callable[[int], None] = _ignore_chunk,
+) -> None:
+    """Download the url into the given file over several connections in parallel.
+
+    The file is split into segments by its size, which are downloaded
+    into a preallocated ``.part`` file at their offsets. Just like with
+    ``_download_resumable`` a sidecar file records the progress of every segment,
+    so an interrupted download can be resumed.
+    The progress of all segments is reported together from the calling thread.
+    Files too small to be split are downloaded over a single connection.
+    The chunks of all segments are reported to the same ``throttle``.
+    """
+    byte_ranges: list[tuple[int, int]] = _split_into_segments(
+        filesize,
+        segments,
+        min_segment_size,
+    )
+    if len(byte_ranges) <= 1:
+        _download_resumable(
+            url,
+            file_path,
+            filesize,
+            on_progress,
+            max_retries,
+            throttle,
+        )
+        return
+
+    if _is_downloaded(file_path, filesize):
+        return
+
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    part_path: Path = file_path.with_name(f"{file_path.name}{_PART_SUFFIX}")
+    sidecar_path: Path = file_path.with_name(f"{file_path.name}{_SIDECAR_SUFFIX}")
+
+    offsets: list[int] = _read_segmented_sidecar(
+        part_path,
+        sidecar_path,
+        filesize,
+        byte_ranges,
+    )
+    if offsets == [start for start, _ in byte_ranges]:
+        with part_path.open("wb") as part_file:
+            part_file.truncate(filesize)
+
+    download: _SegmentedDownload = _SegmentedDownload(
+        url,
+        sidecar_path,
+        filesize,
+        byte_ranges,
+        offsets,
+        throttle,
+    )
+    with ThreadPoolExecutor(max_workers=len(byte_ranges)) as executor:
+        futures: list[Future[None]] = [
+            executor.submit(
+                _run_measured,
+                _current_measurement(),
+                download.download_segment,
+                part_path,
+                index,
+                max_retries,
+            )
+            for index in range(len(byte_ranges))
+        ]
+        pending: set[Future[None]] = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=_PROGRESS_INTERVAL)
+            if on_progress is not None:
+                on_progress(download.bytes_done, filesize)
+        for future in futures:
+            future.result()
+
+    part_path.replace(file_path)
+    sidecar_path.unlink()
+
+
+def _mux_with_ffmpeg(video_path: Path, audio_path: Path, file_path: Path) -> None:
+    """Mux the video and the audio into the file without re-encoding them."""
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+            "-i",
+            str(video_path),
+            "-i",
+            str(audio_path),
+            "-map",
+            "0:v:0",
+            "-map",
+            "1:a:0",
+            "-c",
+            "copy",
+            str(file_path),
+        ],
+        check=True,
+        capture_output=True,
+    )
+
+
+def _download_adaptive(  # noqa: PLR0913
+    stream: StreamInfo,
+    file_path: Path,
+    on_progress: Callable[[int, int], None] | None,
+    segments: int,
+    min_segment_size: int,
+    limiter: BandwidthLimiter | None,
+    muxer: Callable[[Path, Path, Path], object],
+) -> None:
+    """Download the video and the audio of an adaptive stream and mux them into the file.
+
+    Both are downloaded at the same time, so it takes about as long as
+    the slower of both downloads. Every download is resumed on its own.
+    The downloaded streams are deleted once they were muxed.
+    """
+    audio: StreamInfo = cast("StreamInfo", stream.audio)
+    parts: dict[StreamInfo, Path] = {
+        part: file_path.with_name(f"{file_path.stem}.{part.type}{file_path.suffix}")
+        for part in (stream, audio)
+    }
+    bytes_done: dict[StreamInfo, int] = dict.fromkeys(parts, 0)
+    lock: threading.Lock = threading.Lock()
+
+    def report(part: StreamInfo, part_bytes_done: int, _: int) -> None:
+        with lock:
+            bytes_done[part] = part_bytes_done
+            total_bytes_done: int = sum(bytes_done.values())
+        if on_progress is not None:
+            on_progress(total_bytes_done, stream.filesize)
+
+    with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+        futures: list[Future[None]] = [
+            executor.submit(
+                _run_measured,
+                _current_measurement(),
+                part.fetch,
+                part_path,
+                partial(report, part),
+                segments,
+                min_segment_size,
+                limiter,
+            )
+            for part, part_path in parts.items()
+        ]
+    for future in futures:
+        future.result()
+    muxer(parts[stream], parts[audio], file_path)
+    for part_path in parts.values():
+        part_path.unlink()
+
+
+def _resolve_video(
+    video: pytube.YouTube,
+    metadata_cache: MetadataCache | None,
+    *,
+    estimate_sizes: bool = False,
+) -> VideoInfo:
+    """Return the information about the video, fetching it only if it is not cached.
+
+    File sizes left unknown by a cached video are probed, unless only estimated
+    sizes are needed.
+    """
+    with _measure("resolve", video.video_id):
+        cached_video_info: VideoInfo | None = (
+            metadata_cache.get_video(video.video_id)
+            if metadata_cache is not None
+            else None
+        )
+        video_info: VideoInfo
+        if cached_video_info is None:
+            video_info = _create_video_info(video, estimate_sizes=estimate_sizes)
+        elif not estimate_sizes:
+            video_info = _probe_unknown_sizes(cached_video_info)
+        else:
+            video_info = cached_video_info
+        if metadata_cache is not None and video_info != cached_video_info:
+            metadata_cache.put_video(video_info)
+        return video_info
+
+
+def _resolve_playlist(
+    playlist: pytube.Playlist,
+    metadata_cache: MetadataCache | None,
+) -> PlaylistInfo:
+    """Return the information about the playlist, fetching it only if it is not cached."""
+    if metadata_cache is not None and (
+        playlist_info := metadata_cache.get_playlist(playlist.playlist_id)
+    ):
+        return playlist_info
+
+    playlist_info = _create_playlist_info(playlist)
+    if metadata_cache is not None:
+        metadata_cache.put_playlist(playlist_info)
+    return playlist_info
+
+
+def _resolve_playlist_header(
+    playlist: pytube.Playlist,
+    metadata_cache: MetadataCache | None,
+) -> PlaylistInfo:
+    """Return the information about the playlist by loading only its first page.
+
+    The ids of the videos are only known if the playlist is cached,
+    otherwise they are left empty to be taken from its pages as they load.
+    """
+    if metadata_cache is not None and (
+        playlist_info := metadata_cache.get_playlist(playlist.playlist_id)
+    ):
+        return playlist_info
+    return _create_playlist_info(playlist, ())
+
+
+def _iter_playlist_video_ids(
+    playlist: pytube.Playlist,
+    playlist_info: PlaylistInfo,
+    metadata_cache: MetadataCache | None,
+) -> Iterator[str]:
+    """Yield the ids of the videos of the playlist, loading its pages one by one.
+
+    The known ids of the information are yielded without loading anything.
+    The playlist is cached once all of its pages have been loaded.
+    """
+    if playlist_info.video_ids:
+        yield from playlist_info.video_ids
+        return
+
+    video_ids: list[str] = []
+    for url in playlist.url_generator():
+        video_id: str = pytube.extract.video_id(url)
+        video_ids.append(video_id)
+        yield video_id
+    if metadata_cache is not None:
+        metadata_cache.put_playlist(playlist_info._replace(video_ids=tuple(video_ids)))
+
+
+def _assign_file_name(title: str, allocator: FileNameAllocator) -> str:
+    """Return a file name without extension for the title, which is not taken yet.
+
+    The file name is reserved by the allocator.
+    """
+    return allocator.reserve(_remove_forbidden_characters_from_file_name(title))
+
+
+def _write_event(
+    window: sg.Window,
+    key: str,
+    value: Any,
+) -> None:  # pragma: no cover
+    """Write an event from a background thread into the window, unless it was closed."""
+    if not window.is_closed():
+        window.write_event_value(key, value)
+
+
+def _handle_resolution_event(
+    window: sg.Window,
+    event: str,
+    value: Any,
+    download_keys: dict[DownloadOptions, str],
+    info_download_keys: Iterable[str] = (),
+) -> None:  # pragma: no cover
+    """Fill the results written by the background resolution into the window.
+
+    The buttons of the download options are enabled once their streams are
+    resolved, the ones of the info download keys already with the information.
+    """
+    if event == _INFO_RESOLVED_EVENT:
+        for key, info in value.items():
+            window[key].update(info)
+        for key in info_download_keys:
+            window[key].update(disabled=False)
+
+    elif event == _STREAMS_RESOLVED_EVENT:
+        download_options, size = value
+        window[_SIZE_KEYS[download_options]].update(size)
+        if (key := download_keys.get(download_options)) is not None:
+            window[key].update(disabled=False)
+
+    elif event == _RESOLUTION_FAILED_EVENT:
+        window.close()
+        raise value
+
+
+def _format_progress(snapshot: ProgressSnapshot) -> str:
+    """Return the progress as text for the download window."""
+    parts: list[str] = [
+        f"{snapshot.percent}% completed",
+        f"{round(snapshot.bytes_per_second / 1048576, 1)} MB/s",
+    ]
+    if snapshot.eta is not None:
+        parts.append(f"{_format_eta(snapshot.eta)} left")
+    if snapshot.total_items > 1:
+        parts.append(f"{snapshot.items_done} of {snapshot.total_items}")
+    return ", ".join(parts)
+
+
+def _format_eta(eta: float) -> str:
+    """Return the seconds left as minutes and seconds."""
+    minutes, seconds = divmod(round(eta), 60)
+    return f"{minutes}:{seconds:02}"
+
+
+def _format_status(status: DownloadStatus) -> list[str]:
+    """Return the status of a job as row of the download queue of the start window."""
+    running: bool = status.state == _RUNNING
+    return [
+        status.title or status.url,
+        status.state,
+        f"{status.percent}%",
+        f"{round(status.bytes_per_second / 1048576, 1)} MB/s" if running else "",
+        _format_eta(status.eta) if running and status.eta is not None else "",
+    ]
+
+
+def _start_download(
+    window: sg.Window,
+    progress_bus: ProgressBus,
+    download_keys: Iterable[str],
+    target: Callable[[], None],
+) -> threading.Thread:  # pragma: no cover
+    """Run the download in a background thread, which reports into the window."""
+    for key in download_keys:
+        window[key].update(disabled=True)
+    progress_bus.subscribe(partial(_write_event, window, _PROGRESS_EVENT))
+    thread: threading.Thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def _handle_download_event(
+    window: sg.Window,
+    event: str,
+    value: Any,
+    download_keys: Iterable[str],
+) -> None:  # pragma: no cover
+    """Show the progress written by the background download in the window."""
+    if event == _PROGRESS_EVENT:
+        window["-DOWNLOADPROGRESS-"].update(value.percent)
+        window["-COMPLETED-"].update(_format_progress(value))
+
+    elif event == _DOWNLOAD_FINISHED_EVENT:
+        window["-DOWNLOADPROGRESS-"].update(0)
+        window["-COMPLETED-"].update("")
+        for key in download_keys:
+            window[key].update(disabled=False)
+        if isinstance(value, BaseException):
+            window.close()
+            raise value
+
+
+def _apply_limits(limiter: BandwidthLimiter, values: dict[str, Any]) -> bool:
+    """Apply the bandwidth limits typed into the window.
+
+    Return false without changing any limit if one of them is invalid.
+    """
+    try:
+        rate: float | None = _parse_rate(values["-LIMIT-"])
+        transfer_rate: float | None = _parse_rate(
+            values.get("-TRANSFERLIMIT-", _format_rate(limiter.transfer_rate)),
+        )
+    except ValueError:
+        return False
+    limiter.set_rate(rate)
+    limiter.set_transfer_rate(transfer_rate)
+    return True
+
+
+def _handle_limit_event(
+    limiter: BandwidthLimiter,
+    event: str,
+    values: dict[str, Any],
+) -> None:  # pragma: no cover
+    """Apply the bandwidth limits typed into the window once they are confirmed."""
+    if event == "-APPLYLIMIT-" and not _apply_limits(limiter, values):
+        _invalid_limit_popup()
 
 
 def _download_dir_popup() -> None:  # pragma: no cover
@@ -131,6 +4216,11 @@ def _download_dir_popup() -> None:  # pragma: no cover
     sg.Popup("Please select a download directory", title="Info")
 
 
+def _invalid_limit_popup() -> None:  # pragma: no cover
+    """Create an info popup telling that the bandwidth limit is invalid."""
+    sg.Popup("Please enter a limit like 500K or 2M.", title="Info")
+
+
 def _resolution_unavailable_popup() -> None:  # pragma: no cover
     """Create an info pop telling 'This resolution is unavailable."""
     sg.Popup("This resolution is unavailable.", title="Info")
@@ -150,35 +4240,73 @@ class PlaylistDownloader:
     and implements playlist-specific download functionalities.
     """
 
-    def __init__(self, url: str) -> None:
+    def __init__(  # noqa: PLR0913
+        self,
+        url: str,
+        max_workers: int = _DEFAULT_MAX_DOWNLOAD_WORKERS,
+        metadata_cache: MetadataCache | None = None,
+        archive: DownloadArchive | None = None,
+        limiter: BandwidthLimiter | None = None,
+        engine: DownloadEngine | None = None,
+        job_queue: JobQueue | None = None,
+        *,
+        estimate_sizes: bool = False,
+    ) -> None:
         self._url: str = url if url.startswith("https://") else f"https://{url}"
-        self._playlist: Playlist = Playlist(self._url)
-
-        # binding the playlists (list of streams) to corresponding download option
-        hd_list: list[Stream | None] = self._get_playlist(HD)
-        ld_list: list[Stream | None] = self._get_playlist(LD)
-        audio_list: list[Stream | None] = self._get_playlist(AUDIO)
-        self._stream_selection: dict[DownloadOptions, list[Stream] | None] = {
-            HD: hd_list if None not in hd_list else None,
-            LD: ld_list if None not in ld_list else None,
-            AUDIO: audio_list if None not in audio_list else None,
-        }
+        # estimated sizes are shown without probing a single stream
+        self._estimate_sizes: bool = estimate_sizes
+        self._max_workers: int = max_workers
+        self._metadata_cache: MetadataCache | None = metadata_cache
+        self._archive: DownloadArchive | None = archive
+        self._limiter: BandwidthLimiter = (
+            limiter if limiter is not None else BandwidthLimiter()
+        )
+        # the engine and the job queue created here are closed with the window
+        self._created: list[DownloadEngine | JobQueue] = []
+        if engine is None:
+            engine = DownloadEngine()
+            self._created.append(engine)
+        self._engine: DownloadEngine = engine
+        # the downloads are recorded as jobs, so they are resumed after a crash
+        if job_queue is None:
+            job_queue = JobQueue(":memory:")
+            self._created.append(job_queue)
+        self._job_queue: JobQueue = job_queue
+        self._download_thread: threading.Thread | None = None
+
+        # the playlist is resolved in the background once the window is opened,
+        # only compact records of it are kept instead of the pytube objects;
+        # the header has a lock of its own, so downloading does not wait for
+        # the videos and their streams being resolved
+        self._header_lock: threading.Lock = threading.Lock()
+        self._resolved_playlist_header: PlaylistInfo | None = None
+        # kept from loading the header until all pages are loaded
+        self._playlist: pytube.Playlist | None = None
+        self._resolution_lock: threading.RLock = threading.RLock()
+        self._resolved_playlist_info: PlaylistInfo | None = None
+        self._resolved_stream_selection: (
+            dict[DownloadOptions, list[PlaylistItem] | None] | None
+        ) = None
 
         # defining layouts
         info_tab: list[list[sg.Text]] = [
             [sg.Text("URL:"), sg.Text(self._url, enable_events=True, key="-URL-")],
-            [sg.Text("Title:"), sg.Text(self._playlist.title)],
-            [sg.Text("Videos:"), sg.Text(self._playlist.length)],
-            [sg.Text("Views:"), sg.Text(f"{self._playlist.views:,}")],
+            [sg.Text("Title:"), sg.Text(_LOADING_PLACEHOLDER, key="-TITLE-")],
+            [sg.Text("Videos:"), sg.Text(_LOADING_PLACEHOLDER, key="-VIDEOS-")],
+            [sg.Text("Views:"), sg.Text(_LOADING_PLACEHOLDER, key="-VIEWS-")],
             [
                 sg.Text("Owner:"),
-                sg.Text(self._playlist.owner, enable_events=True, key="-OWNER-"),
+                sg.Text(_LOADING_PLACEHOLDER, enable_events=True, key="-OWNER-"),
+            ],
+            [
+                sg.Text("Last updated:"),
+                sg.Text(_LOADING_PLACEHOLDER, key="-LASTUPDATED-"),
             ],
-            [sg.Text("Last updated:"), sg.Text(self._playlist.last_updated)],
         ]
 
         download_all_tab: list[
             list[sg.Text | sg.Input | sg.Button]
+            | list[sg.Checkbox]
             | list[sg.Frame]
             | list[sg.Text | sg.Input | sg.Frame]
             | list[sg.ProgressBar]
@@ -188,14 +4316,47 @@ class PlaylistDownloader:
                 sg.Input(size=(53, 1), enable_events=True, key="-FOLDER-"),
                 sg.FolderBrowse(),
             ],
+            [
+                sg.Text("Parallel downloads"),
+                sg.Spin(
+                    list(range(1, _MAX_DOWNLOAD_WORKERS + 1)),
+                    initial_value=self._max_workers,
+                    size=(3, 1),
+                    key="-WORKERS-",
+                ),
+            ],
+            [
+                sg.Checkbox(
+                    "Only download new videos",
+                    key="-SYNC-",
+                    tooltip="sync the playlist with the folder it was downloaded to",
+                ),
+                sg.Checkbox("Delete removed videos", key="-PRUNE-"),
+            ],
+            [
+                sg.Text("Bandwidth limit"),
+                sg.Input(
+                    _format_rate(self._limiter.rate),
+                    size=(8, 1),
+                    key="-LIMIT-",
+                ),
+                sg.Text("per download"),
+                sg.Input(
+                    _format_rate(self._limiter.transfer_rate),
+                    size=(8, 1),
+                    key="-TRANSFERLIMIT-",
+                ),
+                sg.Text("bytes/s, e.g. 500K or 2M"),
+                sg.Button("Apply", key="-APPLYLIMIT-"),
+            ],
             [
                 sg.Frame(
                     "Highest resolution",
                     [
                         [
-                            sg.Button("Download All", key="-HD-"),
+                            sg.Button("Download All", key="-HD-", disabled=True),
                             sg.Text(HD.resolution),
-                            sg.Text(self._get_playlist_size(HD)),
+                            sg.Text(_LOADING_PLACEHOLDER, key=_SIZE_KEYS[HD]),
                         ],
                     ],
                 ),
@@ -205,9 +4366,9 @@ class PlaylistDownloader:
                     "Lowest resolution",
                     [
                         [
-                            sg.Button("Download All", key="-LD-"),
+                            sg.Button("Download All", key="-LD-", disabled=True),
                             sg.Text(LD.resolution),
-                            sg.Text(self._get_playlist_size(LD)),
+                            sg.Text(_LOADING_PLACEHOLDER, key=_SIZE_KEYS[LD]),
                         ],
                     ],
                 ),
@@ -217,8 +4378,8 @@ class PlaylistDownloader:
                     "Audio only",
                     [
                         [
-                            sg.Button("Download All", key="-AUDIOALL-"),
-                            sg.Text(self._get_playlist_size(AUDIO)),
+                            sg.Button("Download All", key="-AUDIOALL-", disabled=True),
+                            sg.Text(_LOADING_PLACEHOLDER, key=_SIZE_KEYS[AUDIO]),
                         ],
                     ],
                 ),
@@ -235,7 +4396,7 @@ class PlaylistDownloader:
             ],
             [
                 sg.ProgressBar(
-                    self._playlist.length,
+                    100,
                     orientation="h",
                     size=(20, 20),
                     key="-DOWNLOADPROGRESS-",
@@ -264,22 +4425,70 @@ class PlaylistDownloader:
             modal=True,
         )
 
-    def _get_playlist(
-        self,
-        download_options: DownloadOptions,
-    ) -> list[Stream | None]:
-        """Return a list of the streams to the corresponding download option by using threads."""
-        with ThreadPoolExecutor() as executor:
-            stream_list: list[Stream | None] = list(
-                executor.map(
-                    lambda stream: _get_stream_from_video(
-                        stream,
-                        download_options,
-                    ),
-                    self._playlist.videos,
-                ),
-            )
-        return stream_list
+    @property
+    def _playlist_header(self) -> PlaylistInfo:
+        """Return the information about the playlist, loading only its first page.
+
+        The ids of the videos are only known once the playlist has been resolved.
+        """
+        if (playlist_info := self._resolved_playlist_info) is not None:
+            return playlist_info
+        with self._header_lock:
+            if self._resolved_playlist_header is None:
+                self._playlist = pytube.Playlist(self._url)
+                self._resolved_playlist_header = _resolve_playlist_header(
+                    self._playlist,
+                    self._metadata_cache,
+                )
+            return self._resolved_playlist_header
+
+    @property
+    def _playlist_info(self) -> PlaylistInfo:
+        """Return the information about the playlist, resolving it on first access."""
+        with self._resolution_lock:
+            if self._resolved_playlist_info is None:
+                playlist_header: PlaylistInfo = self._playlist_header
+                self._resolved_playlist_info = playlist_header._replace(
+                    video_ids=tuple(
+                        _iter_playlist_video_ids(
+                            self._playlist or pytube.Playlist(self._url),
+                            playlist_header,
+                            self._metadata_cache,
+                        ),
+                    ),
+                )
+                self._playlist = None
+            return self._resolved_playlist_info
+
+    @property
+    def _stream_selection(self) -> dict[DownloadOptions, list[PlaylistItem] | None]:
+        """Return the streams to every download option, resolving them on first access.
+
+        The streams are reduced to compact records as soon as they are selected.
+        """
+        with self._resolution_lock:
+            if self._resolved_stream_selection is None:
+                # binding the playlists (list of streams) to corresponding download option
+                self._resolved_stream_selection = {
+                    download_options: (
+                        [
+                            _create_playlist_item(stream)
+                            for stream in cast("list[StreamInfo]", stream_list)
+                        ]
+                        if None not in stream_list
+                        else None
+                    )
+                    for download_options, stream_list in self._get_playlist().items()
+                }
+            return self._resolved_stream_selection
+
+    def _get_playlist(self) -> dict[DownloadOptions, list[StreamInfo | None]]:
+        """Return the lists of the streams to every download option by using the engine."""
+        return self._engine.get_playlist_streams(
+            self._playlist_info,
+            self._metadata_cache,
+            estimate_sizes=self._estimate_sizes,
+        )
 
     def _get_playlist_size(self, download_options: DownloadOptions) -> str:
         """Return the size of the playlist to the corresponding download option."""
@@ -287,16 +4496,36 @@ class PlaylistDownloader:
             stream_selections := self._stream_selection[download_options]
         ) is None:  # pragma: no cover
             return "Unavailable"
+        return _format_size(stream_selections)
 
-        with ThreadPoolExecutor() as executor:
-            stream_sizes: Iterator[int] = executor.map(
-                lambda stream: stream.filesize,
-                stream_selections,
+    def _resolve_in_background(self) -> None:  # pragma: no cover
+        """Resolve the playlist and write the results as events into the download window."""
+        try:
+            _write_event(
+                self._download_window,
+                _INFO_RESOLVED_EVENT,
+                {
+                    "-TITLE-": self._playlist_header.title,
+                    "-VIDEOS-": self._playlist_header.length,
+                    "-VIEWS-": f"{self._playlist_header.views:,}",
+                    "-OWNER-": self._playlist_header.owner,
+                    "-LASTUPDATED-": self._playlist_header.last_updated,
+                },
             )
-        return f"{round(sum(stream_sizes) / 1048576, 1)} MB"
+            for download_options in DOWNLOAD_OPTIONS:
+                _write_event(
+                    self._download_window,
+                    _STREAMS_RESOLVED_EVENT,
+                    (download_options, self._get_playlist_size(download_options)),
+                )
+        except Exception as err:  # pylint: disable=W0718
+            _write_event(self._download_window, _RESOLUTION_FAILED_EVENT, err)
 
     def create_window(self) -> None:  # pragma: no cover
         """Create the event loop for the download window."""
+        self._download_window.finalize()
+        threading.Thread(target=self._resolve_in_background, daemon=True).start()
+
         # download window event loops
         while True:
             event, values = self._download_window.read()
@@ -304,58 +4533,217 @@ class PlaylistDownloader:
             if event == sg.WIN_CLOSED:
                 break
 
+            # the playlist is downloaded in a pipeline,
+            # which does not wait until the sizes of the videos are known
+            _handle_resolution_event(
+                self._download_window,
+                event,
+                values.get(event),
+                {},
+                ("-HD-", "-LD-", "-AUDIOALL-"),
+            )
+
+            _handle_download_event(
+                self._download_window,
+                event,
+                values.get(event),
+                ("-HD-", "-LD-", "-AUDIOALL-"),
+            )
+
+            _handle_limit_event(self._limiter, event, values)
+
+            if event == _DOWNLOAD_FINISHED_EVENT:
+                self._download_complete(values[event])
+
             if event == "-URL-":
                 webbrowser.open(self._url)
 
             if event == "-OWNER-":
-                webbrowser.open(self._playlist.owner_url)
+                webbrowser.open(self._playlist_header.owner_url)
 
             if event == "-HD-":
-                self._download(HD, values["-FOLDER-"])
+                self._download(
+                    HD,
+                    values["-FOLDER-"],
+                    int(values["-WORKERS-"]),
+                    sync=values["-SYNC-"],
+                    prune=values["-PRUNE-"],
+                )
 
             if event == "-LD-":
-                self._download(LD, values["-FOLDER-"])
+                self._download(
+                    LD,
+                    values["-FOLDER-"],
+                    int(values["-WORKERS-"]),
+                    sync=values["-SYNC-"],
+                    prune=values["-PRUNE-"],
+                )
 
             if event == "-AUDIOALL-":
-                self._download(AUDIO, values["-FOLDER-"])
+                self._download(
+                    AUDIO,
+                    values["-FOLDER-"],
+                    int(values["-WORKERS-"]),
+                    sync=values["-SYNC-"],
+                    prune=values["-PRUNE-"],
+                )
 
         self._download_window.close()
+        self.close()
 
-    def _download(
+    def close(self) -> None:
+        """Close the engine and the job queue, if the downloader created them.
+
+        The running download is waited for, since it uses them.
+        """
+        if not self._created:
+            return
+        if self._download_thread is not None:
+            self._download_thread.join()
+        for resource in self._created:
+            resource.close()
+        self._created.clear()
+
+    def _download(  # noqa: PLR0913
         self,
         download_options: DownloadOptions,
         download_dir: Path,
-    ) -> None:  # pragma: no cover
-        """Download the YouTube content into the given directory."""
-        if not download_dir:
+        max_workers: int,
+        *,
+        sync: bool,
+        prune: bool,
+    ) -> None:
+        """Download the YouTube content into the given directory.
+
+        A synced playlist only downloads the videos missing in its directory
+        and, if pruned, deletes the ones removed from the playlist.
+        Only the header of the playlist is needed to start downloading.
+        """
+        if not download_dir:  # pragma: no cover
             _download_dir_popup()
             return
 
-        if (streams_selection := self._stream_selection[download_options]) is None:
-            _resolution_unavailable_popup()
-            return
+        playlist_header: PlaylistInfo = self._playlist_header
+        clean_playlist_title: str = _remove_forbidden_characters_from_file_name(
+            playlist_header.title,
+        )
+        sync = sync or prune
+        # an interrupted download is resumed instead of starting over
+        download_path: Path = (
+            _find_synced_playlist_dir(
+                download_dir,
+                clean_playlist_title,
+                playlist_header.playlist_id,
+            )
+            if sync
+            else _find_interrupted_playlist_dir(download_dir, clean_playlist_title)
+            or _create_playlist_dir(download_dir, clean_playlist_title)
+        )
+
+        job: Job = self._job_queue.start(
+            self._url,
+            next(
+                profile
+                for profile, options in _PROFILES.items()
+                if options == download_options
+            ),
+            Path(download_dir).absolute(),
+            sync=sync,
+            prune=prune,
+        )
+        self._job_queue.set_target(job.job_id, download_path)
 
-        download_path: Path = _increment_playlist_dir_name(
-            download_dir,
-            _remove_forbidden_characters_from_file_name(self._playlist.title),
+        # the totals grow as the videos are resolved by the pipeline
+        progress_bus: ProgressBus = ProgressBus(0, 0)
+        self._download_thread = _start_download(
+            self._download_window,
+            progress_bus,
+            ("-HD-", "-LD-", "-AUDIOALL-"),
+            partial(
+                self._download_in_background,
+                download_options,
+                download_path,
+                max_workers,
+                progress_bus,
+                job,
+            ),
         )
 
-        for download_counter, video in enumerate(streams_selection, start=1):
-            clean_filename: str = (
-                f"{_remove_forbidden_characters_from_file_name(video.title)}.mp4"
-            )
-            video.download(output_path=str(download_path), filename=clean_filename)
-            self._download_window["-DOWNLOADPROGRESS-"].update(download_counter)
-            self._download_window["-COMPLETED-"].update(
-                f"{download_counter} of {self._playlist.length}",
-            )
-        self._download_complete()
+    def _download_in_background(  # noqa: PLR0913
+        self,
+        download_options: DownloadOptions,
+        download_path: Path,
+        max_workers: int,
+        progress_bus: ProgressBus,
+        job: Job,
+    ) -> None:  # pragma: no cover
+        """Download the videos and write the outcome as event into the download window.
 
-    def _download_complete(self) -> None:  # pragma: no cover
-        """Reset the download progressbar and notifies the user when the download has finished."""
-        self._download_window["-DOWNLOADPROGRESS-"].update(0)
-        self._download_window["-COMPLETED-"].update("")
-        sg.Popup("Download completed")
+        The videos are resolved and downloaded in a pipeline while the pages
+        of the playlist are still loading, so the first download starts right
+        away instead of once all videos are resolved.
+        The videos and their progress are recorded in the job,
+        the downloaded videos in the manifest of the directory.
+        """
+        playlist_header: PlaylistInfo = self._playlist_header
+        run: _PlaylistJobRun = _PlaylistJobRun(
+            self._job_queue,
+            job,
+            download_path,
+            PlaylistManifest(download_path, playlist_header.playlist_id),
+            progress_bus,
+        )
+        try:
+            failures: list[str] = [
+                f"{result.stream.title}: {error}"
+                for result in self._engine.download_playlist(
+                    run.select(
+                        _iter_playlist_video_ids(
+                            pytube.Playlist(self._url),
+                            playlist_header,
+                            self._metadata_cache,
+                        ),
+                    ),
+                    download_options,
+                    download_path,
+                    run.name_stream,
+                    self._metadata_cache,
+                    max_workers,
+                    partial(
+                        _report_job_progress,
+                        self._job_queue,
+                        job.job_id,
+                        progress_bus,
+                    ),
+                    self._archive,
+                    self._limiter,
+                )
+                if (error := run.finish(result)) is not None
+            ]
+            progress_bus.publish()
+            failures.extend(f"{video_id}: unavailable" for video_id in run.unavailable)
+            if job.prune:
+                run.prune()
+        except Exception as err:  # pylint: disable=W0718
+            self._job_queue.finish(job.job_id, f"{err.__class__.__name__}: {err}")
+            _write_event(self._download_window, _DOWNLOAD_FINISHED_EVENT, err)
+            return
+        self._job_queue.finish(
+            job.job_id,
+            _INCOMPLETE_JOB_ERROR if failures else None,
+        )
+        _write_event(self._download_window, _DOWNLOAD_FINISHED_EVENT, failures)
+
+    def _download_complete(self, failures: list[str]) -> None:  # pragma: no cover
+        """Notify the user when the download has finished."""
+        if not failures:
+            sg.Popup("Download completed")
+            return
+
+        sg.Popup(
+            f"Download completed, {len(failures)} failed:\n" + "\n".join(failures),
+            title="Info",
+        )
 
 
 class VideoDownloader:
@@ -365,45 +4753,55 @@ class VideoDownloader:
     and implements video-specific download functionalities.
     """
 
-    def __init__(self, url: str) -> None:
+    def __init__(  # noqa: PLR0913
+        self,
+        url: str,
+        metadata_cache: MetadataCache | None = None,
+        segments: int = _DEFAULT_SEGMENTS,
+        min_segment_size: int = _DEFAULT_MIN_SEGMENT_SIZE,
+        archive: DownloadArchive | None = None,
+        limiter: BandwidthLimiter | None = None,
+        *,
+        estimate_sizes: bool = False,
+    ) -> None:
         self._url: str = url if url.startswith("https://") else f"https://{url}"
-        self._video: YouTube = YouTube(
-            self._url,
-            on_progress_callback=self._progress_check,
-            on_complete_callback=self._download_complete,
+        self._video: pytube.YouTube = pytube.YouTube(self._url)
+        # estimated sizes are shown without probing a single stream
+        self._estimate_sizes: bool = estimate_sizes
+        self._metadata_cache: MetadataCache | None = metadata_cache
+        self._segments: int = segments
+        self._min_segment_size: int = min_segment_size
+        self._archive: DownloadArchive | None = archive
+        self._limiter: BandwidthLimiter = (
+            limiter if limiter is not None else BandwidthLimiter()
         )
 
-        # binding videos to corresponding download option
-        self._stream_selection: dict[DownloadOptions, Stream | None] = {
-            HD: _get_stream_from_video(self._video, HD),
-            LD: _get_stream_from_video(self._video, LD),
-            AUDIO: _get_stream_from_video(self._video, AUDIO),
-        }
+        # the video is resolved in the background once the window is opened
+        self._resolution_lock: threading.RLock = threading.RLock()
+        self._resolved_video_info: VideoInfo | None = None
 
         # defining layouts
         info_tab: list[list[sg.Text | sg.Multiline]] = [
             [sg.Text("URL:"), sg.Text(self._url, enable_events=True, key="-URL-")],
-            [sg.Text("Title:"), sg.Text(self._video.title)],
-            [
-                sg.Text("Length:"),
-                sg.Text(f"{round(self._video.length / 60,2)} minutes"),
-            ],
-            [sg.Text("Views:"), sg.Text(f"{self._video.views:,}")],
+            [sg.Text("Title:"), sg.Text(_LOADING_PLACEHOLDER, key="-TITLE-")],
+            [sg.Text("Length:"), sg.Text(_LOADING_PLACEHOLDER, key="-LENGTH-")],
+            [sg.Text("Views:"), sg.Text(_LOADING_PLACEHOLDER, key="-VIEWS-")],
             [
                 sg.Text("Creator:"),
-                sg.Text(self._video.author, enable_events=True, key="-CREATOR-"),
+                sg.Text(_LOADING_PLACEHOLDER, enable_events=True, key="-CREATOR-"),
             ],
             [
                 sg.Text("Thumbnail:"),
-                sg.Text(self._video.thumbnail_url, enable_events=True, key="-THUMB-"),
+                sg.Text(_LOADING_PLACEHOLDER, enable_events=True, key="-THUMB-"),
             ],
             [
                 sg.Text("Description:"),
                 sg.Multiline(
-                    self._video.description,
+                    _LOADING_PLACEHOLDER,
                     size=(40, 20),
                     no_scrollbar=True,
                     disabled=True,
+                    key="-DESCRIPTION-",
                 ),
             ],
         ]
@@ -416,14 +4814,33 @@ class VideoDownloader:
                 sg.Input(size=(27, 1), enable_events=True, key="-FOLDER-"),
                 sg.FolderBrowse(),
             ],
+            [
+                sg.Text("Connections"),
+                sg.Spin(
+                    list(range(1, _MAX_SEGMENTS + 1)),
+                    initial_value=self._segments,
+                    size=(3, 1),
+                    key="-SEGMENTS-",
+                ),
+            ],
+            [
+                sg.Text("Bandwidth limit"),
+                sg.Input(
+                    _format_rate(self._limiter.rate),
+                    size=(8, 1),
+                    key="-LIMIT-",
+                ),
+                sg.Text("bytes/s, e.g. 500K or 2M"),
+                sg.Button("Apply", key="-APPLYLIMIT-"),
+            ],
             [
                 sg.Frame(
                     "Highest resolution",
                     [
                         [
-                            sg.Button("Download", key="-HD-"),
+                            sg.Button("Download", key="-HD-", disabled=True),
                             sg.Text(HD.resolution),
-                            sg.Text(self._get_video_size(HD)),
+                            sg.Text(_LOADING_PLACEHOLDER, key=_SIZE_KEYS[HD]),
                         ],
                     ],
                 ),
@@ -433,9 +4850,9 @@ class VideoDownloader:
                     "Lowest resolution",
                     [
                         [
-                            sg.Button("Download", key="-LD-"),
+                            sg.Button("Download", key="-LD-", disabled=True),
                             sg.Text(LD.resolution),
-                            sg.Text(self._get_video_size(LD)),
+                            sg.Text(_LOADING_PLACEHOLDER, key=_SIZE_KEYS[LD]),
                         ],
                     ],
                 ),
@@ -445,8 +4862,8 @@ class VideoDownloader:
                     "Audio only",
                     [
                         [
-                            sg.Button("Download", key="-AUDIO-"),
-                            sg.Text(self._get_video_size(AUDIO)),
+                            sg.Button("Download", key="-AUDIO-", disabled=True),
+                            sg.Text(_LOADING_PLACEHOLDER, key=_SIZE_KEYS[AUDIO]),
                         ],
                     ],
                 ),
@@ -487,14 +4904,59 @@ class VideoDownloader:
             modal=True,
         )
 
+    @property
+    def _video_info(self) -> VideoInfo:
+        """Return the information about the video, resolving it on first access."""
+        with self._resolution_lock:
+            if self._resolved_video_info is None:
+                self._resolved_video_info = _resolve_video(
+                    self._video,
+                    self._metadata_cache,
+                    estimate_sizes=self._estimate_sizes,
+                )
+            return self._resolved_video_info
+
+    @property
+    def _stream_selection(self) -> dict[DownloadOptions, StreamInfo | None]:
+        """Return the stream to every download option, resolving them on first access."""
+        # binding videos to corresponding download option
+        return _get_streams_from_video(self._video_info)
+
     def _get_video_size(self, download_options: DownloadOptions) -> str:
         """Return the size of the video to the corresponding download option."""
         if (stream_selection := self._stream_selection[download_options]) is None:
             return "Unavailable"
-        return f"{round(stream_selection.filesize / 1048576, 1)} MB"
+        return _format_size((stream_selection,))
+
+    def _resolve_in_background(self) -> None:  # pragma: no cover
+        """Resolve the video and write the results as events into the download window."""
+        try:
+            _write_event(
+                self._download_window,
+                _INFO_RESOLVED_EVENT,
+                {
+                    "-TITLE-": self._video_info.title,
+                    "-LENGTH-": f"{round(self._video_info.length / 60,2)} minutes",
+                    "-VIEWS-": f"{self._video_info.views:,}",
+                    "-CREATOR-": self._video_info.author,
+                    "-THUMB-": self._video_info.thumbnail_url,
+                    "-DESCRIPTION-": self._video_info.description,
+                },
+            )
+            for download_options in DOWNLOAD_OPTIONS:
+                _write_event(
+                    self._download_window,
+                    _STREAMS_RESOLVED_EVENT,
+                    (download_options, self._get_video_size(download_options)),
+                )
+        except Exception as err:  # pylint: disable=W0718
+            _write_event(self._download_window, _RESOLUTION_FAILED_EVENT, err)
 
     def create_window(self) -> None:  # pragma: no cover
         """Create the event loop for the download window."""
+        self._download_window.finalize()
+        threading.Thread(target=self._resolve_in_background, daemon=True).start()
+
         # download window event loop
         while True:
             event, values = self._download_window.read()
@@ -502,23 +4964,42 @@ class VideoDownloader:
             if event == sg.WIN_CLOSED:
                 break
 
+            _handle_resolution_event(
+                self._download_window,
+                event,
+                values.get(event),
+                {HD: "-HD-", LD: "-LD-", AUDIO: "-AUDIO-"},
+            )
+
+            _handle_download_event(
+                self._download_window,
+                event,
+                values.get(event),
+                ("-HD-", "-LD-", "-AUDIO-"),
+            )
+
+            _handle_limit_event(self._limiter, event, values)
+
+            if event == _DOWNLOAD_FINISHED_EVENT:
+                self._download_complete()
+
             if event == "-URL-":
                 webbrowser.open(self._url)
 
             if event == "-CREATOR-":
-                webbrowser.open(self._video.channel_url)
+                webbrowser.open(self._video_info.channel_url)
 
             if event == "-THUMB-":
-                webbrowser.open(self._video.thumbnail_url)
+                webbrowser.open(self._video_info.thumbnail_url)
 
             if event == "-HD-":
-                self._download(HD, values["-FOLDER-"])
+                self._download(HD, values["-FOLDER-"], int(values["-SEGMENTS-"]))
 
             if event == "-LD-":
-                self._download(LD, values["-FOLDER-"])
+                self._download(LD, values["-FOLDER-"], int(values["-SEGMENTS-"]))
 
             if event == "-AUDIO-":
-                self._download(AUDIO, values["-FOLDER-"])
+                self._download(AUDIO, values["-FOLDER-"], int(values["-SEGMENTS-"]))
 
         self._download_window.close()
 
@@ -526,6 +5007,7 @@ class VideoDownloader:
         self,
         download_options: DownloadOptions,
         download_dir: Path,
+        segments: int,
     ) -> None:  # pragma: no cover
         """Download the YouTube content into the given directory."""
         if not download_dir:
@@ -537,36 +5019,64 @@ class VideoDownloader:
             return
 
         clean_video_title: str = _remove_forbidden_characters_from_file_name(
-            self._video.title,
+            self._video_info.title,
         )
+        # the name of an interrupted download is not taken yet, so it gets resumed
         file_path: str = (
             f"{_increment_video_file_name(download_dir, clean_video_title)}.mp4"
         )
 
-        stream_selection.download(output_path=str(download_dir), filename=file_path)
-
-    # pylint: disable=W0613
-
-    def _progress_check(
-        self,
-        stream: Any,
-        chunk: bytes,
-        bytes_remaining: int,
-    ) -> None:  # pragma: no cover
-        """Update the progress bar when progress in the download was made."""
-        self._download_window["-DOWNLOADPROGRESS-"].update(
-            100 - round(bytes_remaining / stream.filesize * 100),
+        progress_bus: ProgressBus = ProgressBus(
+            stream_selection.filesize or stream_selection.estimated_filesize,
+        )
+        _start_download(
+            self._download_window,
+            progress_bus,
+            ("-HD-", "-LD-", "-AUDIO-"),
+            partial(
+                self._download_in_background,
+                stream_selection,
+                download_dir,
+                file_path,
+                segments,
+                progress_bus,
+            ),
         )
-        self._download_window["-COMPLETED-"].update(r"100% completed")
 
-    def _download_complete(
+    def _download_in_background(  # noqa: PLR0913
         self,
-        stream: Any,
-        file_path: str | None,
+        stream: StreamInfo,
+        download_dir: Path,
+        file_name: str,
+        segments: int,
+        progress_bus: ProgressBus,
     ) -> None:  # pragma: no cover
-        """Reset the progress bar when the video download has finished."""
-        self._download_window["-DOWNLOADPROGRESS-"].update(0)
-        self._download_window["-COMPLETED-"].update("")
+        """Download the stream and write the outcome as event into the download window.
+
+        The file name of a failed download is released, so it can be resumed.
+        """
+        try:
+            stream.download(
+                output_path=str(download_dir),
+                filename=file_name,
+                on_progress=partial(progress_bus.update, stream),
+                segments=segments,
+                min_segment_size=self._min_segment_size,
+                archive=self._archive,
+                limiter=self._limiter,
+            )
+            progress_bus.complete_item()
+            progress_bus.publish()
+        except Exception as err:  # pylint: disable=W0718
+            _get_file_name_allocator(download_dir, ".mp4").release(
+                Path(file_name).stem,
+            )
+            _write_event(self._download_window, _DOWNLOAD_FINISHED_EVENT, err)
+            return
+        _write_event(self._download_window, _DOWNLOAD_FINISHED_EVENT, None)
+
+    def _download_complete(self) -> None:  # pragma: no cover
+        """Notify the user when the video download has finished."""
         sg.Popup("Downloaded complete")
 
 
@@ -597,28 +5107,1071 @@ def create_error_window(error_name: str, message: str) -> None:  # pragma: no co
 # pylint: disable=R0912, W0718
 
 
-def main() -> int:  # pragma: no cover
-    """Run the program."""
-    exit_code: int = 0
+class _ProgressPrinter:
+    """Write the progress of the downloads as JSON lines."""
+
+    def __init__(self, file: TextIO) -> None:
+        self._file: TextIO = file
+        self._lock: threading.Lock = threading.Lock()
+        self._subscribers: list[Callable[[dict[str, Any]], None]] = []
+
+    def subscribe(self, subscriber: Callable[[dict[str, Any]], None]) -> None:
+        """Call the subscriber with every written event and its fields."""
+        with self._lock:
+            self._subscribers.append(subscriber)
+
+    def write(self, event: str, **fields: object) -> None:
+        """Write the event with its fields as a single line."""
+        record: dict[str, Any] = {"event": event, **fields}
+        line: str = json.dumps(record)
+        with self._lock:
+            self._file.write(f"{line}\n")
+            self._file.flush()
+            subscribers: tuple[Callable[[dict[str, Any]], None], ...] = tuple(
+                self._subscribers,
+            )
+        for subscriber in subscribers:
+            subscriber(record)
+
+    def progress(self, url: str, job_id: int, snapshot: ProgressSnapshot) -> None:
+        """Write the progress of the downloads of the job and its url."""
+        self.write(
+            "progress",
+            url=url,
+            job=job_id,
+            percent=snapshot.percent,
+            **snapshot._asdict(),
+        )
+
+
+def _read_urls(urls: Iterable[str], input_file: TextIO | None) -> list[str]:
+    """Return the urls given directly and the ones listed in the input file.
+
+    A url ``-`` reads the urls from the standard input. Empty lines and lines
+    starting with ``#`` are skipped.
+    """
+    lines: list[str] = []
+    for url in urls:
+        lines.extend(sys.stdin if url == "-" else (url,))
+    if input_file is not None:
+        lines.extend(input_file)
+    return [
+        line.strip()
+        for line in lines
+        if line.strip() and not line.strip().startswith("#")
+    ]
+
+
+def _cli_enqueue(
+    urls: Iterable[str],
+    args: argparse.Namespace,
+    job_queue: JobQueue,
+    printer: _ProgressPrinter,
+) -> int:
+    """Add a job for every valid url to the job queue and return the invalid ones.
+
+    A video or playlist linked by more than one url is only added once.
+    """
+    classification: UrlClassification = classify_urls(urls)
+    for url in classification.invalid:
+        printer.write("failed", url=url, error="Invalid link.")
+    for duplicate in classification.duplicates:
+        printer.write("duplicate", url=duplicate.url, of=duplicate.canonical_url)
+    for youtube_url in classification.unique:
+        normalized_url: str = (
+            youtube_url.url
+            if youtube_url.url.startswith("https://")
+            else f"https://{youtube_url.url}"
+        )
+        job_id: int = job_queue.add(
+            normalized_url,
+            args.profile,
+            args.output_dir.absolute(),
+            args.priority,
+            sync=args.sync or args.prune,
+            prune=args.prune,
+        )
+        if args.enqueue:
+            printer.write(
+                "queued",
+                url=normalized_url,
+                job=job_id,
+                priority=args.priority,
+            )
+    return len(classification.invalid)
+
+
+def _parse_args(argv: Sequence[str] | None) -> argparse.Namespace:
+    """Parse the arguments of the command line interface."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog=__title__,
+        description="Download YouTube videos and playlists without a window.",
+    )
+    parser.add_argument(
+        "urls",
+        nargs="*",
+        metavar="URL",
+        help="url of a video or playlist, - reads the urls from stdin",
+    )
+    parser.add_argument(
+        "-i",
+        "--input-file",
+        type=argparse.FileType("r", encoding="utf-8"),
+        help="file with one url per line",
+    )
+    parser.add_argument(
+        "-p",
+        "--profile",
+        type=str.upper,
+        choices=tuple(_PROFILES),
+        default="HD",
+        help="download option (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        type=Path,
+        default=Path(),
+        help="directory to download into (default: current directory)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        choices=range(1, _MAX_DOWNLOAD_WORKERS + 1),
+        default=_DEFAULT_MAX_DOWNLOAD_WORKERS,
+        metavar=f"1-{_MAX_DOWNLOAD_WORKERS}",
+        help="videos of a playlist downloaded in parallel (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-c",
+        "--connections",
+        type=int,
+        choices=range(1, _MAX_SEGMENTS + 1),
+        default=_DEFAULT_SEGMENTS,
+        metavar=f"1-{_MAX_SEGMENTS}",
+        help="connections per video (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--limit-rate",
+        type=_parse_rate,
+        metavar="RATE",
+        help="bytes per second of all downloads together, e.g. 500K or 2M",
+    )
+    parser.add_argument(
+        "--transfer-limit-rate",
+        type=_parse_rate,
+        metavar="RATE",
+        help="bytes per second of every single download",
+    )
+    parser.add_argument(
+        "--limit-file",
+        type=Path,
+        help="file with the rate and optionally the transfer rate, "
+        "which is read again whenever it changes while downloading",
+    )
+    parser.add_argument(
+        "--post-process",
+        type=_parse_command_processor,
+        action="append",
+        dest="processors",
+        metavar="COMMAND",
+        help="command run on every downloaded file, {} is replaced by its path",
+    )
+    parser.add_argument(
+        "--post-process-function",
+        type=_parse_function_processor,
+        action="append",
+        dest="processors",
+        metavar="MODULE:FUNCTION",
+        help="function called with the path of every downloaded file, "
+        "the processors run in the given order",
+    )
+    parser.add_argument(
+        "--post-process-workers",
+        type=int,
+        choices=range(1, _MAX_PROCESSES + 1),
+        default=_DEFAULT_MAX_PROCESSES,
+        metavar=f"1-{_MAX_PROCESSES}",
+        help="files post-processed in parallel (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--muxer",
+        type=_parse_muxer,
+        metavar="MODULE:FUNCTION",
+        help="function called with the paths of the video, the audio and the file "
+        "to mux the streams of the BEST profile into (default: ffmpeg)",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="only download the videos of a playlist missing in its directory, "
+        "instead of downloading it into a new directory",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="delete the videos no longer in the playlist when syncing it",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="do not use the metadata cache",
+    )
+    parser.add_argument(
+        "--no-archive",
+        action="store_true",
+        help="do not link already downloaded videos from the download archive",
+    )
+    parser.add_argument(
+        "--no-queue",
+        action="store_true",
+        help="do not record the downloads in the job queue, which resumes "
+        "the unfinished ones on the next run",
+    )
+    parser.add_argument(
+        "--priority",
+        type=int,
+        default=0,
+        help="priority of the urls in the job queue, "
+        "higher ones are downloaded first (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--enqueue",
+        action="store_true",
+        help="only add the urls to the job queue, e.g. of a run in progress",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=Path,
+        metavar="FILE",
+        help="append the durations, bytes, requests and retries of every phase "
+        "and every item to the file as JSON lines",
+    )
+    parser.add_argument(
+        "--metrics-prometheus",
+        type=Path,
+        metavar="FILE",
+        help="write the totals of every phase to the file in the Prometheus text "
+        "format, e.g. into the textfile directory of the node exporter",
+    )
+    parser.add_argument(
+        "--report-duplicates",
+        action="store_true",
+        help="report the videos stored more than once in the download archive",
+    )
+    parser.add_argument(
+        "--reclaim-duplicates",
+        action="store_true",
+        help="replace the videos stored more than once by hardlinks",
+    )
+    parser.add_argument(
+        "--version",
+        action="version",
+        version=f"%(prog)s {__version__}",
+    )
+    return parser.parse_args(argv)
+
+
+def _report_job_progress(  # noqa: PLR0913
+    job_queue: JobQueue,
+    job_id: int,
+    progress_bus: ProgressBus,
+    stream: StreamInfo,
+    bytes_done: int,
+    filesize: int,
+) -> None:
+    """Report the progress of a video to the progress bus and to the job queue."""
+    progress_bus.update(stream, bytes_done, filesize)
+    job_queue.record_progress(job_id, stream.video_id, bytes_done)
+
+
+def _report_processed(
+    printer: _ProgressPrinter,
+    url: str,
+    errors: list[str],
+    result: _ProcessingResult,
+) -> None:
+    """Write the result of post-processing a file of the url and collect its error."""
+    if result.error is not None:
+        errors.append(result.error)
+        printer.write("failed", url=url, path=str(result.path), error=result.error)
+    else:
+        printer.write(
+            "processed",
+            url=url,
+            path=str(result.path),
+            seconds=result.seconds,
+        )
+
+
+class _PlaylistJobRun:
+    """Bookkeeping of a playlist job, whose videos are downloaded in a pipeline.
+
+    Every video arriving from the pipeline is recorded as item of the job with
+    the file it is downloaded into, which it keeps when the job is resumed.
+    Completed videos are skipped and downloaded ones are recorded in the
+    manifest of the directory. A synced playlist also skips the videos,
+    which are already in the directory.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        job_queue: JobQueue,
+        job: Job,
+        download_path: Path,
+        manifest: PlaylistManifest,
+        progress_bus: ProgressBus,
+    ) -> None:
+        # all ids of the playlist in order, the directory is pruned by them
+        self.video_ids: dict[str, None] = {}
+        self.unavailable: list[str] = []
+        self._job_queue: JobQueue = job_queue
+        self._job: Job = job
+        self._download_path: Path = download_path
+        self._manifest: PlaylistManifest = manifest
+        self._progress_bus: ProgressBus = progress_bus
+        self._items: dict[str, JobItem] = {
+            item.video_id: item for item in job_queue.items(job.job_id)
+        }
+        # the files of the directory, which belong to a video
+        self._claimed_file_names: set[str] = {
+            Path(file_name).stem for file_name in manifest.videos.values()
+        } | {item.path.stem for item in self._items.values()}
+        # new videos get a file taken neither by the job nor by the manifest
+        self._file_name_allocator: FileNameAllocator = FileNameAllocator(
+            download_path,
+            ".mp4",
+            self._claimed_file_names,
+        )
+
+    def select(self, video_ids: Iterable[str]) -> Iterator[str]:
+        """Yield the videos to download, every video only once."""
+        for video_id in video_ids:
+            if video_id in self.video_ids:
+                continue
+            self.video_ids[video_id] = None
+            if not (self._job.sync and self._manifest.has(video_id)):
+                yield video_id
+
+    def name_stream(self, video_id: str, stream: StreamInfo | None) -> str | None:
+        """Record the video and return the file name to download its stream into.
+
+        Return ``None`` for a video, which is unavailable or was already completed.
+        """
+        if stream is None:
+            self.unavailable.append(video_id)
+            return None
+        if (item := self._items.get(video_id)) is None:
+            item = self._items[video_id] = self._add_item(video_id, stream)
+        if item.state == _COMPLETED:
+            return None
+        self._progress_bus.add_item(stream.filesize)
+        return item.path.stem
+
+    def _add_item(self, video_id: str, stream: StreamInfo) -> JobItem:
+        """Record the video as item of the job with the file to download it into.
+
+        A video downloaded into the directory before, e.g. by an interrupted job,
+        keeps its file and is completed, if the manifest records it.
+        """
+        if (file_name := self._find_earlier_file_name(video_id, stream)) is None:
+            file_name = _assign_file_name(stream.title, self._file_name_allocator)
+        else:
+            self._file_name_allocator.take(file_name)
+        self._claimed_file_names.add(file_name)
+        path: Path = self._download_path / f"{file_name}.mp4"
+        self._job_queue.add_items(
+            self._job.job_id,
+            ((video_id, path, stream.filesize),),
+        )
+        if self._manifest.has(video_id):
+            self._job_queue.finish_item(self._job.job_id, video_id)
+            return JobItem(
+                video_id,
+                path,
+                _COMPLETED,
+                stream.filesize,
+                stream.filesize,
+                0,
+            )
+        return JobItem(video_id, path, _PENDING, 0, stream.filesize, 0)
+
+    def _find_earlier_file_name(
+        self,
+        video_id: str,
+        stream: StreamInfo,
+    ) -> str | None:
+        """Return the file name the video was downloaded into before, if any.
+
+        It is the file recorded by the manifest, otherwise the first copy
+        of the title, which belongs to no other video and is a complete
+        or partial download of the same size.
+        """
+        if (file_name := self._manifest.videos.get(video_id)) is not None:
+            return Path(file_name).stem
+        name: str = _remove_forbidden_characters_from_file_name(stream.title)
+        candidate: str = name
+        number: int = 1
+        while (path := self._download_path / f"{candidate}.mp4").exists() or (
+            path.with_name(f"{path.name}{_SIDECAR_SUFFIX}").exists()
+        ):
+            if candidate not in self._claimed_file_names and _is_earlier_download(
+                path,
+                stream.filesize,
+            ):
+                return candidate
+            candidate = f"{name} ({number})"
+            number += 1
+        return None
+
+    def finish(self, result: _DownloadResult) -> str | None:
+        """Record the result of a download and return its error, if it failed."""
+        self._progress_bus.complete_item()
+        video_id: str = result.stream.video_id
+        if result.error is not None:
+            error: str = f"{result.error.__class__.__name__}: {result.error}"
+            self._job_queue.finish_item(self._job.job_id, video_id, error)
+            return error
+        self._job_queue.finish_item(self._job.job_id, video_id)
+        self._manifest.add(video_id, self._items[video_id].path.name)
+        return None
+
+    def path(self, video_id: str) -> Path:
+        """Return the file the video is downloaded into."""
+        return self._items[video_id].path
+
+    def prune(self) -> dict[str, Path]:
+        """Delete the files of the videos no longer in the playlist.
+
+        Return the deleted files by the ids of their videos.
+        """
+        return {
+            video_id: self._manifest.remove(video_id)
+            for video_id in self._manifest.removed(self.video_ids)
+        }
+
+
+def _download_video_job(  # noqa: PLR0913
+    job: Job,
+    job_queue: JobQueue,
+    connections: int,
+    metadata_cache: MetadataCache | None,
+    archive: DownloadArchive | None,
+    limiter: BandwidthLimiter,
+    muxer: Callable[[Path, Path, Path], object] | None,
+    post_processor: PostProcessor | None,
+    printer: _ProgressPrinter,
+    processing_errors: list[str],
+) -> bool:
+    """Download the video of the job and return whether it succeeded.
+
+    A resumed job downloads into the file it was started with.
+    The downloaded file is post-processed, if a post-processor is given,
+    while the next jobs run. The errors of processing it are collected.
+    """
+    video_info: VideoInfo = _resolve_video(pytube.YouTube(job.url), metadata_cache)
+    printer.write(
+        "resolved",
+        url=job.url,
+        job=job.job_id,
+        title=video_info.title,
+        videos=1,
+    )
+    if (stream := _get_stream_from_video(video_info, _PROFILES[job.profile])) is None:
+        printer.write(
+            "failed",
+            url=job.url,
+            video_id=video_info.video_id,
+            error="unavailable",
+        )
+        return False
+
+    clean_video_title: str = _remove_forbidden_characters_from_file_name(
+        video_info.title,
+    )
+    file_path: Path = job.target or job.output_dir / (
+        f"{_increment_video_file_name(job.output_dir, clean_video_title)}.mp4"
+    )
+    job_queue.set_target(job.job_id, file_path)
+    job_queue.add_items(job.job_id, [(stream.video_id, file_path, stream.filesize)])
+    progress_bus: ProgressBus = ProgressBus(stream.filesize)
+    progress_bus.subscribe(partial(printer.progress, job.url, job.job_id))
+    try:
+        stream.download(
+            output_path=str(file_path.parent),
+            filename=file_path.name,
+            on_progress=partial(
+                _report_job_progress,
+                job_queue,
+                job.job_id,
+                progress_bus,
+                stream,
+            ),
+            segments=connections,
+            archive=archive,
+            limiter=limiter,
+            muxer=muxer,
+        )
+    except Exception as err:
+        job_queue.finish_item(job.job_id, stream.video_id, str(err))
+        raise
+    job_queue.finish_item(job.job_id, stream.video_id)
+    progress_bus.complete_item()
+    progress_bus.publish()
+    printer.write(
+        "completed",
+        url=job.url,
+        video_id=stream.video_id,
+        path=str(file_path),
+    )
+    if post_processor is not None:
+        post_processor.submit(
+            file_path,
+            partial(_report_processed, printer, job.url, processing_errors),
+        )
+    return True
+
+
+def _download_playlist_job(  # noqa: PLR0913
+    job: Job,
+    job_queue: JobQueue,
+    max_workers: int,
+    engine: DownloadEngine,
+    metadata_cache: MetadataCache | None,
+    archive: DownloadArchive | None,
+    limiter: BandwidthLimiter,
+    post_processor: PostProcessor | None,
+    printer: _ProgressPrinter,
+) -> bool:
+    """Download the playlist of the job and return whether every video succeeded.
+
+    The videos are downloaded in a pipeline while the pages of the playlist
+    are still loading. Videos unavailable in the download option are reported
+    and skipped. A resumed job downloads into the directory it was started
+    with, every video into the file it was assigned, and skips the completed
+    videos. A synced playlist only resolves and downloads the videos missing
+    in its directory, so an unchanged playlist is synced without resolving
+    any video, and prunes the directory once all pages have loaded.
+    Every downloaded video is post-processed while the others are still
+    downloading, if a post-processor is given.
+    """
+    download_options: DownloadOptions = _PROFILES[job.profile]
+    playlist: pytube.Playlist = pytube.Playlist(job.url)
+    playlist_info: PlaylistInfo = _resolve_playlist_header(playlist, metadata_cache)
+    clean_playlist_title: str = _remove_forbidden_characters_from_file_name(
+        playlist_info.title,
+    )
+    download_path: Path = job.target or (
+        _find_synced_playlist_dir(
+            job.output_dir,
+            clean_playlist_title,
+            playlist_info.playlist_id,
+        )
+        if job.sync
+        else _find_interrupted_playlist_dir(job.output_dir, clean_playlist_title)
+        or _create_playlist_dir(job.output_dir, clean_playlist_title)
+    )
+    job_queue.set_target(job.job_id, download_path)
+    printer.write(
+        "resolved",
+        url=job.url,
+        job=job.job_id,
+        title=playlist_info.title,
+        videos=playlist_info.length,
+        path=str(download_path),
+    )
+
+    progress_bus: ProgressBus = ProgressBus(0, 0)
+    progress_bus.subscribe(partial(printer.progress, job.url, job.job_id))
+    run: _PlaylistJobRun = _PlaylistJobRun(
+        job_queue,
+        job,
+        download_path,
+        PlaylistManifest(download_path, playlist_info.playlist_id),
+        progress_bus,
+    )
+    succeeded: bool = True
+    processing_errors: list[str] = []
+    for result in engine.download_playlist(
+        run.select(_iter_playlist_video_ids(playlist, playlist_info, metadata_cache)),
+        download_options,
+        download_path,
+        run.name_stream,
+        metadata_cache,
+        max_workers,
+        partial(_report_job_progress, job_queue, job.job_id, progress_bus),
+        archive,
+        limiter,
+    ):
+        if (error := run.finish(result)) is not None:
+            printer.write(
+                "failed",
+                url=job.url,
+                video_id=result.stream.video_id,
+                error=error,
+            )
+            succeeded = False
+        else:
+            printer.write("completed", url=job.url, video_id=result.stream.video_id)
+            if post_processor is not None:
+                post_processor.submit(
+                    run.path(result.stream.video_id),
+                    partial(_report_processed, printer, job.url, processing_errors),
+                )
+    progress_bus.publish()
+    if post_processor is not None:
+        post_processor.join()
+    for video_id in run.unavailable:
+        printer.write("failed", url=job.url, video_id=video_id, error="unavailable")
+    if job.prune:
+        for video_id, path in run.prune().items():
+            printer.write("removed", url=job.url, video_id=video_id, path=str(path))
+    return succeeded and not run.unavailable and not processing_errors
+
+
+def _run_job(  # noqa: PLR0913
+    job: Job,
+    job_queue: JobQueue,
+    workers: int,
+    connections: int,
+    engine: DownloadEngine,
+    metadata_cache: MetadataCache | None,
+    archive: DownloadArchive | None,
+    limiter: BandwidthLimiter,
+    muxer: Callable[[Path, Path, Path], object] | None,
+    post_processor: PostProcessor | None,
+    printer: _ProgressPrinter,
+    processing_errors: list[str],
+) -> str | None:
+    """Download the video or playlist of the job and return its error, if it failed.
+
+    Playlists are downloaded by the engine.
+    The downloaded files are post-processed, if a post-processor is given.
+    A playlist fails if processing its files fails, which are processed
+    during the job, while the errors of processing a video are collected,
+    since it is processed while the next jobs run.
+    """
+    try:
+        if _is_playlist_url(job.url):
+            succeeded: bool = _download_playlist_job(
+                job,
+                job_queue,
+                workers,
+                engine,
+                metadata_cache,
+                archive,
+                limiter,
+                post_processor,
+                printer,
+            )
+        else:
+            succeeded = _download_video_job(
+                job,
+                job_queue,
+                connections,
+                metadata_cache,
+                archive,
+                limiter,
+                muxer,
+                post_processor,
+                printer,
+                processing_errors,
+            )
+    except Exception as err:  # pylint: disable=W0718
+        error: str = f"{err.__class__.__name__}: {err}"
+        printer.write("failed", url=job.url, error=error)
+        return error
+    return None if succeeded else _INCOMPLETE_JOB_ERROR
+
+
+def _run_jobs(
+    job_queue: JobQueue,
+    run_job: Callable[[Job], str | None],
+    post_processor: PostProcessor | None = None,
+) -> list[Job]:
+    """Run the jobs of the queue in priority order until the queue is drained.
+
+    Jobs added while running are run too. The failed jobs of earlier runs are
+    retried first, a job failing in this run is only retried by the next run.
+    Running jobs of other processes are waited for, since they are taken over
+    if the process turns out to have crashed. The files still processed by the
+    post-processor are waited for once all jobs ran. Return the finished jobs.
+    """
+    job_queue.retry_failed()
+    finished_jobs: list[Job] = []
+    while True:
+        if (job := job_queue.claim()) is None:
+            if not job_queue.running_elsewhere():
+                break
+            time.sleep(_JOB_HEARTBEAT_INTERVAL)
+            continue
+        job_queue.finish(job.job_id, run_job(job))
+        finished_jobs.append(cast("Job", job_queue.get(job.job_id)))
+    if post_processor is not None:
+        post_processor.join()
+    return finished_jobs
+
+
+def _watch_limit_file(
+    path: Path,
+    limiter: BandwidthLimiter,
+    printer: _ProgressPrinter,
+    stop: threading.Event,
+) -> None:
+    """Apply the rates in the file to the limiter whenever it changes, until stopped.
+
+    The file holds the rate of all downloads together,
+    optionally followed by the rate of every single download.
+    """
+    last_modified: float | None = None
+    while not stop.is_set():
+        try:
+            modified: float = path.stat().st_mtime
+            if modified != last_modified:
+                last_modified = modified
+                rate, *transfer_rate = path.read_text(encoding="utf-8").split() or [""]
+                limiter.set_rate(_parse_rate(rate))
+                if transfer_rate:
+                    limiter.set_transfer_rate(_parse_rate(transfer_rate[0]))
+                printer.write(
+                    "limit",
+                    rate=limiter.rate,
+                    transfer_rate=limiter.transfer_rate,
+                )
+        except OSError:
+            pass
+        except ValueError as err:
+            printer.write("failed", path=str(path), error=str(err))
+        stop.wait(_LIMIT_FILE_INTERVAL)
+
+
+def _cli_manage_archive(
+    archive: DownloadArchive,
+    printer: _ProgressPrinter,
+    *,
+    reclaim: bool,
+) -> None:
+    """Report the duplicates in the download archive and reclaim their space."""
+    duplicates: list[_DuplicateGroup] = archive.duplicates()
+    for group in duplicates:
+        printer.write(
+            "duplicate",
+            video_id=group.video_id,
+            itag=group.itag,
+            size=group.size,
+            paths=[str(path) for path in group.paths],
+        )
+    printer.write(
+        "duplicates",
+        streams=len(duplicates),
+        reclaimable=sum(group.size * (len(group.paths) - 1) for group in duplicates),
+    )
+    if reclaim:
+        printer.write("reclaimed", bytes=archive.reclaim())
+
+
+def _start_metrics(args: argparse.Namespace) -> Metrics | None:
+    """Install the metrics, if any export of them was requested."""
+    if args.metrics is None and args.metrics_prometheus is None:
+        return None
+    metrics: Metrics = Metrics(args.metrics)
+    metrics.install()
+    return metrics
+
+
+def _finish_metrics(metrics: Metrics | None, prometheus_path: Path | None) -> None:
+    """Write the totals of the metrics, if they were installed, and close them."""
+    if metrics is None:
+        return
+    metrics.uninstall()
+    metrics.write_totals()
+    if prometheus_path is not None:
+        metrics.write_prometheus(prometheus_path)
+    metrics.close()
+
+
+def cli(argv: Sequence[str] | None = None, file: TextIO = sys.stdout) -> int:
+    """Run the program without a window.
+
+    The urls are added to the job queue, which downloads them one after another
+    in priority order together with the jobs left unfinished by earlier runs.
+    Those jobs are not run, if the download archive is only managed without urls.
+    The progress is written as JSON lines.
+    Return 1 if any download failed, otherwise 0.
+    """
+    args: argparse.Namespace = _parse_args(argv)
+    urls: list[str] = _read_urls(args.urls, args.input_file)
+    printer: _ProgressPrinter = _ProgressPrinter(file)
+    metrics: Metrics | None = _start_metrics(args)
+    metadata_cache: MetadataCache | None = None if args.no_cache else MetadataCache()
+    archive: DownloadArchive | None = None if args.no_archive else DownloadArchive()
+    connection_pool: ConnectionPool = ConnectionPool()
+    connection_pool.install()
+    limiter: BandwidthLimiter = BandwidthLimiter(
+        args.limit_rate,
+        args.transfer_limit_rate,
+    )
+    stop_watching: threading.Event = threading.Event()
+    if args.limit_file is not None:
+        threading.Thread(
+            target=_watch_limit_file,
+            args=(args.limit_file, limiter, printer, stop_watching),
+            daemon=True,
+        ).start()
+
+    managing_archive: bool = args.report_duplicates or args.reclaim_duplicates
+    if archive is not None and managing_archive:
+        _cli_manage_archive(archive, printer, reclaim=args.reclaim_duplicates)
+
+    job_queue: JobQueue = JobQueue(":memory:" if args.no_queue else None)
+    invalid: int = _cli_enqueue(urls, args, job_queue, printer)
+
+    finished_jobs: list[Job] = []
+    processing_errors: list[str] = []
+    if not args.enqueue and (urls or not managing_archive):
+        threading.Thread(
+            target=job_queue.keep_alive,
+            args=(stop_watching,),
+            daemon=True,
+        ).start()
+        engine: DownloadEngine = DownloadEngine(muxer=args.muxer)
+        post_processor: PostProcessor | None = (
+            PostProcessor(args.processors, args.post_process_workers)
+            if args.processors
+            else None
+        )
+        try:
+            finished_jobs = _run_jobs(
+                job_queue,
+                partial(
+                    _run_job,
+                    job_queue=job_queue,
+                    workers=args.workers,
+                    connections=args.connections,
+                    engine=engine,
+                    metadata_cache=metadata_cache,
+                    archive=archive,
+                    limiter=limiter,
+                    muxer=args.muxer,
+                    post_processor=post_processor,
+                    printer=printer,
+                    processing_errors=processing_errors,
+                ),
+                post_processor,
+            )
+        finally:
+            engine.close()
+            if post_processor is not None:
+                post_processor.close()
+    failed: int = (
+        invalid
+        + sum(job.state != _COMPLETED for job in finished_jobs)
+        + len(processing_errors)
+    )
+
+    printer.write(
+        "finished",
+        urls=invalid + len(finished_jobs) if not args.enqueue else len(urls),
+        failed=failed,
+        connections_opened=connection_pool.opened,
+        connections_reused=connection_pool.reused,
+    )
+    _finish_metrics(metrics, args.metrics_prometheus)
+    stop_watching.set()
+    job_queue.close()
+    connection_pool.close()
+    if metadata_cache is not None:
+        metadata_cache.close()
+    if archive is not None:
+        archive.close()
+    return int(failed > 0)
+
+
+def _create_download_manager(  # noqa: PLR0913
+    job_queue: JobQueue,
+    engine: DownloadEngine,
+    metadata_cache: MetadataCache | None,
+    archive: DownloadArchive | None,
+    limiter: BandwidthLimiter,
+    printer: _ProgressPrinter,
+    workers: int = _DEFAULT_MAX_DOWNLOAD_WORKERS,
+    connections: int = _DEFAULT_SEGMENTS,
+) -> DownloadManager:
+    """Create the download manager running the jobs of the start window.
+
+    Videos are muxed by the muxer of the engine, which muxes the playlists.
+    """
+    return DownloadManager(
+        job_queue,
+        partial(
+            _run_job,
+            job_queue=job_queue,
+            workers=workers,
+            connections=connections,
+            engine=engine,
+            metadata_cache=metadata_cache,
+            archive=archive,
+            limiter=limiter,
+            muxer=engine.muxer,
+            post_processor=None,
+            printer=printer,
+            processing_errors=[],
+        ),
+        printer,
+    )
+
+
+def _stop_download_manager(
+    manager: DownloadManager,
+    engine: DownloadEngine,
+    limiter: BandwidthLimiter,
+) -> None:
+    """Interrupt the running jobs of the manager and wait until they returned.
+
+    Their downloads are cancelled, so they fail fast and are resumed by the next run.
+    """
+    limiter.cancel()
+    engine.cancel()
+    manager.close()
+    engine.close()
+
+
+def _handle_queue_event(
+    window: sg.Window,
+    manager: DownloadManager,
+    rows: list[list[str]],
+    event: str,
+    values: dict[str, Any],
+) -> list[list[str]]:  # pragma: no cover
+    """Add the typed links to the queue and return the rows of the listed jobs."""
+    if event == "Add to queue":
+        _add_to_queue(manager, values)
+    return _refresh_queue(window, manager, rows)
+
 
+def _add_to_queue(
+    manager: DownloadManager,
+    values: dict[str, Any],
+) -> None:  # pragma: no cover
+    """Add the links typed into the start window to the download manager."""
+    if not values["-QUEUEFOLDER-"]:
+        _download_dir_popup()
+        return
+    classification: UrlClassification = manager.add(
+        values["-LINKS-"].split(),
+        values["-PROFILE-"],
+        Path(values["-QUEUEFOLDER-"]),
+    )
+    if classification.invalid:
+        _invalid_links_popup(classification.invalid)
+
+
+def _invalid_links_popup(urls: list[str]) -> None:  # pragma: no cover
+    """Create an info popup listing the links, which were not added."""
+    sg.Popup("Invalid links:\n" + "\n".join(urls), title="Info")
+
+
+def _refresh_queue(
+    window: sg.Window,
+    manager: DownloadManager,
+    rows: list[list[str]],
+) -> list[list[str]]:  # pragma: no cover
+    """Show the statuses of the jobs in the start window, if any of them changed."""
+    new_rows: list[list[str]] = [
+        _format_status(status) for status in manager.statuses()
+    ]
+    if new_rows != rows:
+        window["-QUEUE-"].update(values=new_rows)
+    return new_rows
+
+
+def _create_start_window() -> sg.Window:  # pragma: no cover
+    """Create the window asking for the link and listing the download queue."""
     sg.theme("Darkred1")
 
     # defining layouts
-    start_layout: list[list[sg.Input | sg.Button]] = [
+    start_layout: list[list[sg.Element]] = [
         [sg.Input(key="-LINKINPUT-"), sg.Button("Submit")],
+        [sg.Checkbox("Estimate sizes instead of requesting them", key="-ESTIMATE-")],
+        [sg.Text("Download in the background, one link per line:")],
+        [sg.Multiline(size=(60, 4), key="-LINKS-")],
+        [
+            sg.Combo(
+                tuple(_PROFILES),
+                default_value="HD",
+                readonly=True,
+                key="-PROFILE-",
+            ),
+            sg.Input(size=(30, 1), key="-QUEUEFOLDER-"),
+            sg.FolderBrowse(),
+            sg.Button("Add to queue"),
+        ],
+        [
+            sg.Table(
+                values=[],
+                headings=["Title", "State", "Progress", "Speed", "ETA"],
+                col_widths=[30, 9, 8, 10, 6],
+                auto_size_columns=False,
+                num_rows=8,
+                key="-QUEUE-",
+            ),
+        ],
     ]
-    start_window: sg.Window = sg.Window("Youtube Downloader", start_layout)
+    return sg.Window("Youtube Downloader", start_layout)
 
-    # main event loop
+
+def main() -> int:  # pragma: no cover
+    """Run the program."""
+    exit_code: int = 0
+
+    metadata_cache: MetadataCache = MetadataCache()
+    archive: DownloadArchive = DownloadArchive()
+    connection_pool: ConnectionPool = ConnectionPool()
+    connection_pool.install()
+    # the limits typed into a download window apply to all downloads
+    limiter: BandwidthLimiter = BandwidthLimiter()
+    engine: DownloadEngine = DownloadEngine()
+    job_queue: JobQueue = JobQueue(_user_cache_dir() / _GUI_JOB_QUEUE_NAME)
+    stop_heartbeat: threading.Event = threading.Event()
+    threading.Thread(
+        target=job_queue.keep_alive,
+        args=(stop_heartbeat,),
+        daemon=True,
+    ).start()
+    # the progress of the jobs run in the background is logged next to the queue
+    log_file: TextIO = (_user_cache_dir() / "jobs.log").open("a", encoding="utf-8")
+    manager: DownloadManager = _create_download_manager(
+        job_queue,
+        engine,
+        metadata_cache,
+        archive,
+        limiter,
+        _ProgressPrinter(log_file),
+    )
+    start_window: sg.Window = _create_start_window().finalize()
+    # the downloads left unfinished by the last run are resumed right away
+    manager.resume()
+    rows: list[list[str]] = []
+
+    # main event loop, the download queue is refreshed while waiting for events
     while True:
-        event, values = start_window.read()
+        event, values = start_window.read(timeout=_QUEUE_REFRESH_INTERVAL)
         if event == sg.WIN_CLOSED:
             break
 
+        rows = _handle_queue_event(start_window, manager, rows, event, values)
+
         if event == "Submit":
             try:
                 downloader: YouTubeDownloader = get_downloader(
                     values["-LINKINPUT-"],
+                    metadata_cache,
+                    archive,
+                    limiter,
+                    engine,
+                    job_queue,
+                    estimate_sizes=values["-ESTIMATE-"],
                 )
                 downloader.create_window()
 
@@ -649,8 +6202,16 @@ def main() -> int:  # pragma: no cover
                 break
 
     start_window.close()
+    # the files and databases the jobs write to are only closed once they returned
+    _stop_download_manager(manager, engine, limiter)
+    stop_heartbeat.set()
+    log_file.close()
+    job_queue.close()
+    connection_pool.close()
+    metadata_cache.close()
+    archive.close()
     return exit_code
 
 
 if __name__ == "__main__":
-    raise SystemExit(main())
+    raise SystemExit(cli() if len(sys.argv) > 1 else main())
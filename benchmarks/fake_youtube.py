@@ -0,0 +1,432 @@
+"""A local stand-in for YouTube serving synthetic videos and playlists.
+
+It serves everything pytube fetches: watch pages, the player api, the player
+javascript deciphering the signatures of the streams, playlist pages with their
+continuations and the media itself, with support for range requests.
+Every response can be delayed by a latency, the first response on a connection
+additionally by the latency of establishing it, and the media is sent with
+a limited bandwidth per connection, just like YouTube throttles connections.
+
+The requests pytube sends to YouTube are redirected to the server by installing
+``RedirectToFakeYouTube`` into the opener of ``urllib.request``.
+"""
+
+from __future__ import annotations
+
+import json
+import multiprocessing
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Any, Final, NamedTuple
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from multiprocessing.connection import Connection
+
+PLAYLIST_ID: Final[str] = "PLfakeYouTubePlaylist0000000000000"
+_API_KEY: Final[str] = "fake-api-key"
+_JS_PATH: Final[str] = "/s/player/fake0000/player_ias.vflset/en_US/base.js"
+_YOUTUBE_HOSTS: Final[frozenset[str]] = frozenset(
+    {"youtube.com", "www.youtube.com", "m.youtube.com"},
+)
+# playlist pages list at most 100 videos, like the ones of YouTube
+_PAGE_SIZE: Final[int] = 100
+_CHUNK_SIZE: Final[int] = 16 * 1024
+_PATTERN: Final[bytes] = bytes(range(256)) * (_CHUNK_SIZE // 256 + 1)
+# itag, mime type and share of the media size of the served streams
+_STREAMS: Final[tuple[tuple[int, str, float], ...]] = (
+    (22, 'video/mp4; codecs="avc1.64001F, mp4a.40.2"', 1.0),
+    (18, 'video/mp4; codecs="avc1.42001E, mp4a.40.2"', 0.5),
+    (140, 'audio/mp4; codecs="mp4a.40.2"', 0.125),
+)
+# the player reverses the ciphered signature and drops its first two characters,
+# the names match the patterns pytube looks for
+_PLAYER_JS: Final[
+    str
+] = """var DE={AJ:function(a){a.reverse()}, VR:function(a,b){a.splice(0,b)}};
+Xy=function(a){a=a.split("");DE.AJ(a,1);DE.VR(a,2);return a.join("")}
+var Bpa=[Nfn];
+var Yz=function(a){a.C&&(b=a.get("n"))&&(b=Bpa[0](b),a.set("n",b))};
+Nfn=function(a){var b=a.split(""),c=[function(d){d.reverse()},b,null];try{c[0](c[1])}catch(e){return"enhanced_except_"+a}return b.join("")};
+"""
+
+
+class FakeYouTubeConfig(NamedTuple):
+    """Tuple-like class holding the behaviour of the fake YouTube."""
+
+    latency: float = 0.0
+    connect_latency: float = 0.0
+    bandwidth: float | None = None
+    playlist_size: int = 100
+    media_size: int = 1024 * 1024
+    content_length: bool = True
+
+
+def video_id(index: int) -> str:
+    """Return the id of the video at the index of the playlist."""
+    return f"fake{index:07}"
+
+
+def _signature(video_id: str, itag: int) -> str:
+    return f"sig{video_id}{itag}"
+
+
+def _media_size(media_size: int, share: float) -> int:
+    return max(int(media_size * share), 1)
+
+
+class FakeYouTubeServer(ThreadingHTTPServer):
+    """Server of the fake YouTube."""
+
+    def __init__(self, config: FakeYouTubeConfig) -> None:
+        super().__init__(("127.0.0.1", 0), _FakeYouTubeRequestHandler)
+        self.config: FakeYouTubeConfig = config
+        self.requests: int = 0
+        self.connections: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """Return the url the server is reachable at."""
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, *, connection: bool = False) -> None:
+        """Count a request or a new connection."""
+        with self._lock:
+            if connection:
+                self.connections += 1
+            else:
+                self.requests += 1
+
+    def player_response(self, video_id: str) -> dict[str, Any]:
+        """Return the response of the player api to the video."""
+        formats: list[dict[str, Any]] = []
+        for itag, mime_type, share in _STREAMS:
+            url: str = f"{self.url}/videoplayback?" + urlencode(
+                {
+                    "id": video_id,
+                    "itag": itag,
+                    "expire": int(time.time()) + 6 * 60 * 60,
+                    "n": "throttled",
+                },
+            )
+            stream: dict[str, Any] = {
+                "itag": itag,
+                "mimeType": mime_type,
+                "bitrate": 128_000,
+                "signatureCipher": urlencode(
+                    {
+                        "s": f"ab{_signature(video_id, itag)}"[::-1],
+                        "sp": "sig",
+                        "url": url,
+                    },
+                ),
+            }
+            if self.config.content_length:
+                stream["contentLength"] = str(
+                    _media_size(self.config.media_size, share),
+                )
+            formats.append(stream)
+        return {
+            "playabilityStatus": {"status": "OK"},
+            "videoDetails": {
+                "videoId": video_id,
+                "title": f"Video {video_id}",
+                "lengthSeconds": "60",
+                "viewCount": "1234",
+                "author": "Fake channel",
+                "channelId": "UCfakeChannel",
+                "shortDescription": "A video served by the fake YouTube.",
+                "thumbnail": {
+                    "thumbnails": [{"url": f"{self.url}/vi/{video_id}/default.jpg"}],
+                },
+            },
+            "streamingData": {"formats": formats[:2], "adaptiveFormats": formats[2:]},
+        }
+
+    def playlist_items(self, start: int) -> list[dict[str, Any]]:
+        """Return the page of the playlist from the index, with its continuation."""
+        end: int = min(start + _PAGE_SIZE, self.config.playlist_size)
+        items: list[dict[str, Any]] = [
+            {"playlistVideoRenderer": {"videoId": video_id(index)}}
+            for index in range(start, end)
+        ]
+        if end < self.config.playlist_size:
+            items.append(
+                {
+                    "continuationItemRenderer": {
+                        "continuationEndpoint": {
+                            "continuationCommand": {"token": str(end)},
+                        },
+                    },
+                },
+            )
+        return items
+
+    def playlist_data(self) -> dict[str, Any]:
+        """Return the initial data of the playlist page."""
+        playlist_size: int = self.config.playlist_size
+        return {
+            "contents": {
+                "twoColumnBrowseResultsRenderer": {
+                    "tabs": [
+                        {
+                            "tabRenderer": {
+                                "content": {
+                                    "sectionListRenderer": {
+                                        "contents": [
+                                            {
+                                                "itemSectionRenderer": {
+                                                    "contents": [
+                                                        {
+                                                            "playlistVideoListRenderer": {
+                                                                "contents": self.playlist_items(
+                                                                    0,
+                                                                ),
+                                                            },
+                                                        },
+                                                    ],
+                                                },
+                                            },
+                                        ],
+                                    },
+                                },
+                            },
+                        },
+                    ],
+                },
+            },
+            "sidebar": {
+                "playlistSidebarRenderer": {
+                    "items": [
+                        {
+                            "playlistSidebarPrimaryInfoRenderer": {
+                                "title": {"runs": [{"text": "Fake playlist"}]},
+                                "description": {"simpleText": ""},
+                                "stats": [
+                                    {
+                                        "runs": [
+                                            {"text": f"{playlist_size:,}"},
+                                            {"text": " videos"},
+                                        ],
+                                    },
+                                    {"simpleText": "1,234 views"},
+                                    {
+                                        "runs": [
+                                            {"text": "Last updated on "},
+                                            {"text": "Jan 1, 2024"},
+                                        ],
+                                    },
+                                ],
+                            },
+                        },
+                        {
+                            "playlistSidebarSecondaryInfoRenderer": {
+                                "videoOwner": {
+                                    "videoOwnerRenderer": {
+                                        "title": {
+                                            "runs": [
+                                                {
+                                                    "text": "Fake channel",
+                                                    "navigationEndpoint": {
+                                                        "browseEndpoint": {
+                                                            "browseId": "UCfake",
+                                                        },
+                                                    },
+                                                },
+                                            ],
+                                        },
+                                    },
+                                },
+                            },
+                        },
+                    ],
+                },
+            },
+        }
+
+
+class _FakeYouTubeRequestHandler(BaseHTTPRequestHandler):
+    """Serve the pages, the api and the media of the fake YouTube."""
+
+    server: FakeYouTubeServer
+    protocol_version: str = "HTTP/1.1"
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.count(connection=True)
+        time.sleep(self.server.config.connect_latency)
+
+    def do_GET(self) -> None:  # noqa: N802
+        self._respond(head=False)
+
+    def do_HEAD(self) -> None:  # noqa: N802
+        self._respond(head=True)
+
+    def do_POST(self) -> None:  # noqa: N802
+        body: bytes = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.count()
+        time.sleep(self.server.config.latency)
+        path: str = urlsplit(self.path).path
+        query: dict[str, list[str]] = parse_qs(urlsplit(self.path).query)
+        if path == "/youtubei/v1/player":
+            self._send_json(self.server.player_response(query["videoId"][0]))
+        elif path == "/youtubei/v1/browse":
+            token: str = json.loads(body)["continuation"]
+            self._send_json(
+                {
+                    "onResponseReceivedActions": [
+                        {
+                            "appendContinuationItemsAction": {
+                                "continuationItems": self.server.playlist_items(
+                                    int(token),
+                                ),
+                            },
+                        },
+                    ],
+                },
+            )
+        else:
+            self._send(404, b"", "text/plain", head=False)
+
+    def _respond(self, *, head: bool) -> None:
+        self.server.count()
+        time.sleep(self.server.config.latency)
+        path: str = urlsplit(self.path).path
+        query: dict[str, list[str]] = parse_qs(urlsplit(self.path).query)
+        if path == "/watch":
+            html: str = (
+                "<html><head>"
+                f'<script src="{_JS_PATH}"></script>'
+                "<script>var ytInitialPlayerResponse = "
+                '{"playabilityStatus": {"status": "OK"}};</script>'
+                "</head></html>"
+            )
+            self._send(200, html.encode(), "text/html", head=head)
+        elif path == "/playlist":
+            html = (
+                "<html><head>"
+                f"<script>var ytInitialData = {json.dumps(self.server.playlist_data())};"
+                "</script>"
+                f'<script>ytcfg.set({{"INNERTUBE_API_KEY": "{_API_KEY}"}});</script>'
+                "</head></html>"
+            )
+            self._send(200, html.encode(), "text/html", head=head)
+        elif path == _JS_PATH:
+            self._send(200, _PLAYER_JS.encode(), "text/javascript", head=head)
+        elif path == "/videoplayback":
+            self._send_media(query, head=head)
+        else:
+            self._send(404, b"", "text/plain", head=head)
+
+    def _send_json(self, data: dict[str, Any]) -> None:
+        self._send(200, json.dumps(data).encode(), "application/json", head=False)
+
+    def _send(self, status: int, body: bytes, content_type: str, *, head: bool) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _send_media(self, query: dict[str, list[str]], *, head: bool) -> None:
+        """Send the requested range of the media with the limited bandwidth."""
+        video: str = query["id"][0]
+        itag: int = int(query["itag"][0])
+        share: float | None = next(
+            (share for stream_itag, _, share in _STREAMS if stream_itag == itag),
+            None,
+        )
+        if share is None or query.get("sig") != [_signature(video, itag)]:
+            self._send(403, b"", "text/plain", head=head)
+            return
+
+        size: int = _media_size(self.server.config.media_size, share)
+        start: int = 0
+        end: int = size - 1
+        if (range_header := self.headers.get("Range")) is not None:
+            start_text, end_text = range_header[len("bytes=") :].split("-")
+            start, end = int(start_text), min(int(end_text or end), end)
+        self.send_response(206 if range_header is not None else 200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        if head:
+            return
+
+        bandwidth: float | None = self.server.config.bandwidth
+        for offset in range(start, end + 1, _CHUNK_SIZE):
+            chunk_size: int = min(_CHUNK_SIZE, end + 1 - offset)
+            self.wfile.write(_PATTERN[offset % 256 : offset % 256 + chunk_size])
+            if bandwidth is not None:
+                time.sleep(chunk_size / bandwidth)
+
+    def log_message(self, *_: object) -> None:
+        pass
+
+
+class RedirectToFakeYouTube(urllib.request.BaseHandler):
+    """Handler of ``urllib.request`` sending the requests to YouTube to the server."""
+
+    # before the default handlers, which prepare the request for its host
+    handler_order = 100
+
+    def __init__(self, url: str) -> None:
+        self._url: str = url
+
+    def https_request(self, request: urllib.request.Request) -> urllib.request.Request:
+        """Redirect the request if it is sent to YouTube."""
+        if urlsplit(request.full_url).hostname in _YOUTUBE_HOSTS:
+            request.full_url = f"{self._url}{request.selector}"
+        return request
+
+    http_request = https_request
+
+
+@contextmanager
+def serve_in_thread(config: FakeYouTubeConfig) -> Iterator[FakeYouTubeServer]:
+    """Run the server in a thread of this process."""
+    server: FakeYouTubeServer = FakeYouTubeServer(config)
+    thread: threading.Thread = threading.Thread(
+        target=server.serve_forever,
+        daemon=True,
+    )
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _serve(config: FakeYouTubeConfig, connection: Connection) -> None:
+    """Run the server until told to stop through the connection."""
+    with serve_in_thread(config) as server:
+        connection.send(server.url)
+        connection.recv()
+
+
+@contextmanager
+def serve_in_process(config: FakeYouTubeConfig) -> Iterator[str]:
+    """Run the server in a separate process and return its url.
+
+    The work of the server then neither slows down nor adds to the memory
+    of the measured process.
+    """
+    connection, child_connection = multiprocessing.Pipe()
+    process: multiprocessing.Process = multiprocessing.Process(
+        target=_serve,
+        args=(config, child_connection),
+        daemon=True,
+    )
+    process.start()
+    try:
+        yield connection.recv()
+    finally:
+        connection.send(None)
+        process.join()
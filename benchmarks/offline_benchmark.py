@@ -0,0 +1,310 @@
+"""Benchmark opening and downloading a playlist without access to YouTube.
+
+A fake YouTube serving synthetic watch pages, playlist pages, player javascript
+and media runs in a separate process, with a configurable latency per request,
+bandwidth per connection and playlist size. ``pytube`` and the program run
+unchanged against it, their requests to YouTube are redirected to the server.
+Measured are the time to open the playlist, the time to probe the sizes of the
+streams to download, the throughput of downloading them and the peak memory
+allocated by every phase, the latter in a separate traced run,
+since tracing slows down the program.
+
+The results can be saved as JSON and compared against the results of another
+run, e.g. before a change::
+
+    python -m benchmarks.offline_benchmark --playlist-size 200 --output before.json
+    python -m benchmarks.offline_benchmark --playlist-size 200 --compare before.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+import pytube
+import pytube.request
+
+import YTDownloader
+from benchmarks.fake_youtube import (
+    PLAYLIST_ID,
+    FakeYouTubeConfig,
+    RedirectToFakeYouTube,
+    serve_in_process,
+)
+from YTDownloader import (
+    HD,
+    ConnectionPool,
+    DownloadEngine,
+    FileNameAllocator,
+    _assign_file_name,
+    _parse_rate,
+    _probe_filesize,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Sequence
+
+    from YTDownloader import PlaylistInfo, StreamInfo
+
+_PLAYLIST_URL: str = f"https://www.youtube.com/playlist?list={PLAYLIST_ID}"
+_PHASES: tuple[str, ...] = ("open", "size_probe", "download")
+
+
+class _Result(NamedTuple):
+    """Tuple-like class holding the measurements of one phase."""
+
+    phase: str
+    seconds: float
+    peak_bytes: int
+    throughput: float | None
+
+
+def _reset_caches() -> None:
+    """Forget everything ``pytube`` cached, so every run fetches it again."""
+    pytube.request.filesize.cache_clear()
+    YTDownloader._probed_filesizes.clear()
+    pytube.__js__ = None
+    pytube.__js_url__ = None
+
+
+def _open(engine: DownloadEngine) -> int:
+    """Open the playlist and resolve the streams of all of its videos."""
+    return len(_resolve_streams(engine))
+
+
+def _probe_sizes(streams: list[StreamInfo], workers: int) -> int:
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(_probe_filesize, streams))
+
+
+def _download(
+    streams: list[StreamInfo],
+    workers: int,
+    engine: DownloadEngine,
+) -> int:
+    """Download the videos of the streams in the pipeline of the engine.
+
+    Like the program does, every video is resolved again before its download.
+    """
+    downloaded: int = 0
+    with tempfile.TemporaryDirectory() as download_dir:
+        allocator: FileNameAllocator = FileNameAllocator(Path(download_dir), ".mp4")
+        for result in engine.download_playlist(
+            [stream.video_id for stream in streams],
+            HD,
+            Path(download_dir),
+            lambda _, stream: (
+                None if stream is None else _assign_file_name(stream.title, allocator)
+            ),
+            max_workers=workers,
+        ):
+            if result.error is not None:
+                raise result.error
+            downloaded += result.stream.filesize
+    return downloaded
+
+
+def _resolve_streams(engine: DownloadEngine) -> list[StreamInfo]:
+    """Return the streams of the playlist to download with the HD option."""
+    playlist_info: PlaylistInfo = engine.resolve_playlist(
+        pytube.Playlist(_PLAYLIST_URL),
+    )
+    stream_lists = engine.get_playlist_streams(playlist_info, None, (HD,))
+    return [stream for stream in stream_lists[HD] if stream is not None]
+
+
+def _measure(
+    phase: Callable[[list[StreamInfo]], int],
+    streams: list[StreamInfo],
+    *,
+    traced: bool,
+) -> tuple[float, int, int]:
+    """Return the seconds, the peak of the allocated bytes and the result of a phase."""
+    _reset_caches()
+    if traced:
+        tracemalloc.start()
+    start: float = time.perf_counter()
+    result: int = phase(streams)
+    seconds: float = time.perf_counter() - start
+    peak_bytes: int = 0
+    if traced:
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak_bytes, result
+
+
+def run(runs: int, workers: int, engine: DownloadEngine) -> list[_Result]:
+    """Measure every phase against the installed fake YouTube.
+
+    The playlist is opened and downloaded by the engine.
+    """
+    phases: dict[str, Callable[[list[StreamInfo]], int]] = {
+        "open": lambda _: _open(engine),
+        "size_probe": lambda streams: _probe_sizes(streams, workers),
+        "download": lambda streams: _download(streams, workers, engine),
+    }
+    _reset_caches()
+    streams: list[StreamInfo] = _resolve_streams(engine)
+    results: list[_Result] = []
+    for name in _PHASES:
+        samples: list[float] = []
+        downloaded: int = 0
+        for _ in range(runs):
+            seconds, _, downloaded = _measure(
+                phases[name],
+                streams,
+                traced=False,
+            )
+            samples.append(seconds)
+        _, peak_bytes, _ = _measure(
+            phases[name],
+            streams,
+            traced=True,
+        )
+        seconds = statistics.median(samples)
+        results.append(
+            _Result(
+                name,
+                seconds,
+                peak_bytes,
+                downloaded / seconds if name == "download" else None,
+            ),
+        )
+    return results
+
+
+def _compare(results: dict[str, Any], baseline: dict[str, Any]) -> None:
+    """Print the ratios of the results to the results of the baseline."""
+    baseline_results: dict[str, dict[str, Any]] = {
+        result["phase"]: result for result in baseline["results"]
+    }
+    print(f"\n{'phase':<11} {'time':>9} {'peak memory':>12} {'throughput':>11}")
+    for result in results["results"]:
+        if (base := baseline_results.get(result["phase"])) is None:
+            continue
+        ratios: list[str] = [
+            (
+                f"{result[metric] / base[metric]:.2f}x"
+                if result[metric] and base[metric]
+                else "-"
+            )
+            for metric in ("seconds", "peak_bytes", "throughput")
+        ]
+        print(f"{result['phase']:<11} {ratios[0]:>9} {ratios[1]:>12} {ratios[2]:>11}")
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    """Run the benchmark, print the results and save or compare them."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--playlist-size", type=int, default=50)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.02,
+        help="seconds every request is delayed by",
+    )
+    parser.add_argument(
+        "--connect-latency",
+        type=float,
+        default=0.02,
+        help="seconds every new connection is delayed by",
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=_parse_rate,
+        default=None,
+        help="bytes per second of every connection, e.g. 2M, unlimited by default",
+    )
+    parser.add_argument(
+        "--media-size",
+        type=_parse_rate,
+        default=1024 * 1024,
+        help="bytes of the largest stream of every video, e.g. 1M",
+    )
+    parser.add_argument(
+        "--no-content-length",
+        action="store_true",
+        help="leave the sizes out of the stream manifests",
+    )
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--no-pool",
+        action="store_true",
+        help="open a new connection for every request",
+    )
+    parser.add_argument("--output", type=Path, help="save the results as JSON")
+    parser.add_argument("--compare", type=Path, help="results of a previous run")
+    args: argparse.Namespace = parser.parse_args(argv)
+
+    config: FakeYouTubeConfig = FakeYouTubeConfig(
+        latency=args.latency,
+        connect_latency=args.connect_latency,
+        bandwidth=args.bandwidth,
+        playlist_size=args.playlist_size,
+        media_size=int(args.media_size),
+        content_length=not args.no_content_length,
+    )
+    connection_pool: ConnectionPool = ConnectionPool()
+    with serve_in_process(config) as url:
+        if args.no_pool:
+            urllib.request.install_opener(
+                urllib.request.build_opener(RedirectToFakeYouTube(url)),
+            )
+        else:
+            connection_pool.install(RedirectToFakeYouTube(url))
+        engine: DownloadEngine = DownloadEngine()
+        try:
+            results: list[_Result] = run(args.runs, args.workers, engine)
+        finally:
+            engine.close()
+            connection_pool.close()
+            urllib.request.install_opener(None)
+
+    print(f"{'phase':<11} {'time (s)':>9} {'peak memory (MiB)':>18} {'MiB/s':>8}")
+    for result in results:
+        throughput: str = (
+            f"{result.throughput / 1024**2:>8.1f}"
+            if result.throughput is not None
+            else f"{'-':>8}"
+        )
+        print(
+            f"{result.phase:<11} {result.seconds:>9.3f} "
+            f"{result.peak_bytes / 1024**2:>18.1f} {throughput}",
+        )
+    if not args.no_pool:
+        print(
+            f"\nconnections opened: {connection_pool.opened}, "
+            f"reused: {connection_pool.reused}",
+        )
+
+    data: dict[str, Any] = {
+        "config": {**config._asdict(), "workers": args.workers, "runs": args.runs},
+        "environment": {
+            "python": sys.version,
+            "platform": platform.platform(),
+            "version": YTDownloader.__version__,
+            "pool": not args.no_pool,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "results": [result._asdict() for result in results],
+    }
+    if args.output is not None:
+        args.output.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    if args.compare is not None:
+        _compare(data, json.loads(args.compare.read_text(encoding="utf-8")))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,211 @@
+"""Benchmark how the time to open a playlist scales with its length.
+
+The network is simulated by fake videos, which sleep for the given latency
+the first time their streams are fetched, just like ``pytube`` does when fetching
+the watch page and the stream manifest of a video.
+The previous approach, which resolved the whole playlist once per download option,
+is compared against the current single pass resolution
+and against reopening the playlist from the metadata cache.
+
+Run it with::
+
+    python -m benchmarks.playlist_open_benchmark --lengths 10 50 100 --latency 0.05
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+from unittest import mock
+
+import pytube
+
+from YTDownloader import (
+    DOWNLOAD_OPTIONS,
+    MetadataCache,
+    PlaylistDownloader,
+    PlaylistInfo,
+    _create_video_info,
+    _get_stream_from_video,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Sequence
+
+    from YTDownloader import DownloadOptions, StreamInfo
+
+
+class _FakeStream:
+    """Stand-in for ``pytube.Stream``."""
+
+    def __init__(  # noqa: PLR0913
+        self,
+        itag: int,
+        type: str,  # noqa: A002 # pylint: disable=W0622
+        resolution: str | None,
+        abr: str | None,
+        *,
+        is_progressive: bool,
+    ) -> None:
+        self.title: str = "video"
+        self.itag: int = itag
+        self.url: str = f"https://example.com/{itag}"
+        self.mime_type: str = f"{type}/mp4"
+        self.type: str = type
+        self.resolution: str | None = resolution
+        self.abr: str | None = abr
+        self.is_progressive: bool = is_progressive
+        self._filesize: int = 1048576
+
+
+class _FakeYouTube:
+    """Stand-in for ``pytube.YouTube`` simulating the fetching of its streams."""
+
+    latency: float = 0.0
+
+    def __init__(self, url: str) -> None:
+        self.video_id: str = url[-11:]
+        self.title: str = "video"
+        self.length: int = 60
+        self.views: int = 0
+        self.author: str = "author"
+        self.channel_url: str = "https://example.com/channel"
+        self.thumbnail_url: str = "https://example.com/thumbnail.jpg"
+        self.description: str = ""
+        self._fetched: bool = False
+
+    @property
+    def streams(self) -> list[_FakeStream]:
+        if not self._fetched:
+            time.sleep(self.latency)
+            self._fetched = True
+        return [
+            _FakeStream(22, "video", "720p", None, is_progressive=True),
+            _FakeStream(18, "video", "360p", None, is_progressive=True),
+            _FakeStream(140, "audio", None, "128kbps", is_progressive=False),
+        ]
+
+
+def _playlist_info(length: int) -> PlaylistInfo:
+    return PlaylistInfo(
+        playlist_id="PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        title="playlist",
+        length=length,
+        views=0,
+        owner="owner",
+        owner_url="https://example.com/owner",
+        last_updated="",
+        video_ids=tuple(f"{i:011}" for i in range(length)),
+    )
+
+
+def _legacy_get_playlist(
+    playlist_info: PlaylistInfo,
+    download_options: DownloadOptions,
+) -> list[StreamInfo | None]:
+    """Resolve the playlist for a single download option, as it was done before."""
+    with ThreadPoolExecutor() as executor:
+        return list(
+            executor.map(
+                lambda video_id: _get_stream_from_video(
+                    _create_video_info(_FakeYouTube(video_id)),  # type: ignore[arg-type]
+                    download_options,
+                ),
+                playlist_info.video_ids,
+            ),
+        )
+
+
+def _open_legacy(playlist_info: PlaylistInfo, _: MetadataCache) -> None:
+    for download_options in DOWNLOAD_OPTIONS:
+        _legacy_get_playlist(playlist_info, download_options)
+
+
+def _open_single_pass(
+    playlist_info: PlaylistInfo,
+    metadata_cache: MetadataCache | None,
+) -> None:
+    downloader: PlaylistDownloader = PlaylistDownloader(
+        f"https://www.youtube.com/playlist?list={playlist_info.playlist_id}",
+        metadata_cache=metadata_cache,
+    )
+    downloader._resolved_playlist_info = playlist_info
+    try:
+        with mock.patch.object(pytube, "YouTube", _FakeYouTube):
+            downloader._get_playlist()
+    finally:
+        downloader.close()
+
+
+def _open_uncached(playlist_info: PlaylistInfo, _: MetadataCache) -> None:
+    _open_single_pass(playlist_info, None)
+
+
+class _Result(NamedTuple):
+    """Tuple-like class holding the timings for one playlist length."""
+
+    length: int
+    legacy: float
+    single_pass: float
+    cached: float
+
+
+def _time(
+    func: Callable[[PlaylistInfo, MetadataCache], None],
+    playlist_info: PlaylistInfo,
+    metadata_cache: MetadataCache,
+) -> float:
+    start: float = time.perf_counter()
+    func(playlist_info, metadata_cache)
+    return time.perf_counter() - start
+
+
+def run(lengths: Sequence[int], latency: float) -> list[_Result]:
+    """Time opening playlists of the given lengths with all approaches."""
+    _FakeYouTube.latency = latency
+    results: list[_Result] = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        metadata_cache: MetadataCache = MetadataCache(Path(cache_dir) / "cache.sqlite3")
+        for length in lengths:
+            playlist_info: PlaylistInfo = _playlist_info(length)
+            legacy: float = _time(_open_legacy, playlist_info, metadata_cache)
+            single_pass: float = _time(_open_uncached, playlist_info, metadata_cache)
+            # the first open fills the cache, the second one is served from it
+            _open_single_pass(playlist_info, metadata_cache)
+            cached: float = _time(_open_single_pass, playlist_info, metadata_cache)
+            results.append(_Result(length, legacy, single_pass, cached))
+        metadata_cache.close()
+    return results
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    """Run the benchmark and print the results as a table."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="simulated seconds to fetch the streams of one video",
+    )
+    args: argparse.Namespace = parser.parse_args(argv)
+
+    print(
+        f"{'videos':>8} {'legacy (s)':>12} {'single pass (s)':>16} "
+        f"{'cached (s)':>11} {'speedup':>8}",
+    )
+    for result in run(args.lengths, args.latency):
+        print(
+            f"{result.length:>8} {result.legacy:>12.3f} "
+            f"{result.single_pass:>16.3f} {result.cached:>11.3f} "
+            f"{result.legacy / result.single_pass:>7.1f}x",
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
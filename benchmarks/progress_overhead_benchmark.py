@@ -0,0 +1,161 @@
+"""Benchmark the overhead of reporting the progress of every downloaded chunk.
+
+Concurrent transfers report every chunk they download. The previous approach
+updated two widgets of the download window for every chunk, the progress bus
+collects the chunks and updates the widgets with a snapshot at a bounded rate.
+The widgets are simulated by counting their updates, since every update of
+a real widget costs far more than the reporting itself.
+
+Run it with::
+
+    python -m benchmarks.progress_overhead_benchmark --transfers 1 4 16 --chunks 100000
+"""
+
+from __future__ import annotations
+
+import argparse
+import threading
+import time
+from functools import partial
+from typing import TYPE_CHECKING, NamedTuple
+
+from YTDownloader import _CHUNK_SIZE, ProgressBus, ProgressSnapshot
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Sequence
+
+
+class _FakeElement:
+    """Stand-in for a widget of the download window counting its updates."""
+
+    def __init__(self) -> None:
+        self.updates: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def update(self, *_: object) -> None:
+        with self._lock:
+            self.updates += 1
+
+
+class _FakeWindow:
+    """Stand-in for the download window."""
+
+    def __init__(self) -> None:
+        self._elements: dict[str, _FakeElement] = {
+            "-DOWNLOADPROGRESS-": _FakeElement(),
+            "-COMPLETED-": _FakeElement(),
+        }
+
+    def __getitem__(self, key: str) -> _FakeElement:
+        return self._elements[key]
+
+    @property
+    def updates(self) -> int:
+        return sum(element.updates for element in self._elements.values())
+
+
+def _legacy_progress_check(
+    window: _FakeWindow,
+    _: int,
+    bytes_done: int,
+    filesize: int,
+) -> None:
+    """Update the widgets for every chunk, as it was done before."""
+    window["-DOWNLOADPROGRESS-"].update(round(bytes_done / filesize * 100))
+    window["-COMPLETED-"].update(r"100% completed")
+
+
+def _show_snapshot(window: _FakeWindow, snapshot: ProgressSnapshot) -> None:
+    window["-DOWNLOADPROGRESS-"].update(snapshot.percent)
+    window["-COMPLETED-"].update(f"{snapshot.percent}% completed")
+
+
+class _Result(NamedTuple):
+    """Tuple-like class holding the overhead for one number of transfers."""
+
+    transfers: int
+    legacy_ns: float
+    legacy_updates: int
+    bus_ns: float
+    bus_updates: int
+
+
+def _report_chunks(
+    transfers: int,
+    chunks: int,
+    report: Callable[[int, int, int], None],
+) -> float:
+    """Report the chunks of concurrent transfers and return the nanoseconds per chunk."""
+    filesize: int = chunks * _CHUNK_SIZE
+
+    def transfer(key: int) -> None:
+        for chunk in range(1, chunks + 1):
+            report(key, chunk * _CHUNK_SIZE, filesize)
+
+    threads: list[threading.Thread] = [
+        threading.Thread(target=transfer, args=(key,)) for key in range(transfers)
+    ]
+    start: int = time.perf_counter_ns()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return (time.perf_counter_ns() - start) / (transfers * chunks)
+
+
+def run(transfer_counts: Sequence[int], chunks: int) -> list[_Result]:
+    """Measure the overhead per chunk with both approaches."""
+    results: list[_Result] = []
+    for transfers in transfer_counts:
+        legacy_window: _FakeWindow = _FakeWindow()
+        legacy_ns: float = _report_chunks(
+            transfers,
+            chunks,
+            partial(_legacy_progress_check, legacy_window),
+        )
+
+        bus_window: _FakeWindow = _FakeWindow()
+        progress_bus: ProgressBus = ProgressBus(transfers * chunks * _CHUNK_SIZE)
+        progress_bus.subscribe(partial(_show_snapshot, bus_window))
+        bus_ns: float = _report_chunks(transfers, chunks, progress_bus.update)
+        progress_bus.publish()
+
+        results.append(
+            _Result(
+                transfers,
+                legacy_ns,
+                legacy_window.updates,
+                bus_ns,
+                bus_window.updates,
+            ),
+        )
+    return results
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    """Run the benchmark and print the results as a table."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--transfers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument(
+        "--chunks",
+        type=int,
+        default=100_000,
+        help="chunks reported by every transfer",
+    )
+    args: argparse.Namespace = parser.parse_args(argv)
+
+    print(
+        f"{'transfers':>9} {'legacy (ns/chunk)':>18} {'widget updates':>15} "
+        f"{'bus (ns/chunk)':>15} {'widget updates':>15}",
+    )
+    for result in run(args.transfers, args.chunks):
+        print(
+            f"{result.transfers:>9} {result.legacy_ns:>18.0f} "
+            f"{result.legacy_updates:>15} {result.bus_ns:>15.0f} "
+            f"{result.bus_updates:>15}",
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
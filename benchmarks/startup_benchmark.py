@@ -0,0 +1,170 @@
+"""Benchmark the startup of the program and check it against a budget.
+
+The import of ``YTDownloader`` is measured in fresh interpreters with
+``-X importtime``, which breaks the time down by module. The wall-clock time
+from starting the interpreter until the first window is shown is measured too,
+unless there is no display to show it on.
+The medians of all runs are compared against the budgets, so the benchmark
+exits with a non-zero code if the startup regressed.
+
+Run it with::
+
+    python -m benchmarks.startup_benchmark --runs 10 --import-budget 100
+"""
+
+from __future__ import annotations
+
+import argparse
+import compileall
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+_MODULE: str = "YTDownloader"
+_ROOT: Path = Path(__file__).resolve().parent.parent
+_FIRST_WINDOW_SCRIPT: str = (
+    "import YTDownloader\n"
+    "window = YTDownloader._create_start_window().finalize()\n"
+    "print('ready', flush=True)\n"
+    "window.close()\n"
+)
+
+
+class _ImportTime(NamedTuple):
+    """Tuple-like class holding the import time of a module in microseconds."""
+
+    module: str
+    self: int
+    cumulative: int
+
+
+def _parse_import_times(output: str) -> list[_ImportTime]:
+    """Parse the ``-X importtime`` output of an interpreter."""
+    import_times: list[_ImportTime] = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_time, cumulative, module = line[len("import time:") :].split("|")
+        import_times.append(
+            _ImportTime(module.strip(), int(self_time), int(cumulative)),
+        )
+    return import_times
+
+
+def measure_import(runs: int) -> list[_ImportTime]:
+    """Return the median import time of every module imported by the program."""
+    command: list[str] = [sys.executable, "-X", "importtime", "-c", f"import {_MODULE}"]
+    samples: dict[str, list[_ImportTime]] = {}
+    for _ in range(runs):
+        result: subprocess.CompletedProcess[str] = subprocess.run(
+            command,  # noqa: S603
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=_ROOT,
+        )
+        for import_time in _parse_import_times(result.stderr):
+            samples.setdefault(import_time.module, []).append(import_time)
+    return [
+        _ImportTime(
+            module,
+            round(statistics.median(sample.self for sample in module_samples)),
+            round(statistics.median(sample.cumulative for sample in module_samples)),
+        )
+        for module, module_samples in samples.items()
+    ]
+
+
+def measure_first_window(runs: int) -> float | None:
+    """Return the median seconds from starting the interpreter to the first window.
+
+    Return ``None`` if no window can be shown, e.g. because there is no display.
+    """
+    samples: list[float] = []
+    for _ in range(runs):
+        start: float = time.perf_counter()
+        with subprocess.Popen(
+            [sys.executable, "-c", _FIRST_WINDOW_SCRIPT],  # noqa: S603
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            cwd=_ROOT,
+        ) as process:
+            assert process.stdout is not None  # noqa: S101
+            ready: bool = process.stdout.readline().strip() == "ready"
+            elapsed: float = time.perf_counter() - start
+        if not ready:
+            return None
+        samples.append(elapsed)
+    return statistics.median(samples)
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    """Run the benchmark, print the results and check them against the budgets."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=15,
+        help="number of slowest modules to list",
+    )
+    parser.add_argument(
+        "--import-budget",
+        type=float,
+        default=100,
+        help="allowed milliseconds to import the program",
+    )
+    parser.add_argument(
+        "--window-budget",
+        type=float,
+        default=1000,
+        help="allowed milliseconds until the first window is shown",
+    )
+    args: argparse.Namespace = parser.parse_args(argv)
+
+    # a stale bytecode cache would add the compilation to the first import
+    compileall.compile_file(_ROOT / f"{_MODULE}.py", quiet=1)
+
+    import_times: list[_ImportTime] = measure_import(args.runs)
+    print(f"{'self (ms)':>10} {'cumulative (ms)':>16}  module")
+    for import_time in sorted(
+        import_times,
+        key=lambda import_time: import_time.cumulative,
+        reverse=True,
+    )[: args.top]:
+        print(
+            f"{import_time.self / 1000:>10.1f} "
+            f"{import_time.cumulative / 1000:>16.1f}  {import_time.module}",
+        )
+
+    exit_code: int = 0
+    import_ms: float = next(
+        import_time.cumulative / 1000
+        for import_time in import_times
+        if import_time.module == _MODULE
+    )
+    print(f"\nimport: {import_ms:.1f} ms (budget {args.import_budget:.0f} ms)")
+    if import_ms > args.import_budget:
+        print("import budget exceeded")
+        exit_code = 1
+
+    if (first_window := measure_first_window(args.runs)) is None:
+        print("first window: skipped, no window could be shown")
+        return exit_code
+    window_ms: float = first_window * 1000
+    print(f"first window: {window_ms:.1f} ms (budget {args.window_budget:.0f} ms)")
+    if window_ms > args.window_budget:
+        print("first window budget exceeded")
+        exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
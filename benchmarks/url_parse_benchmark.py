@@ -0,0 +1,141 @@
+r"""Benchmark classifying urls with the parser against the previous patterns.
+
+The previous approach matched every url against a playlist pattern and a video
+pattern, the latter with nested ``.*`` and ``\S+``, which backtrack on long
+urls. The parser splits the url into its parts in a single pass. Measured are
+the time to classify and deduplicate a list of typical urls and the time to
+reject adversarial urls of growing length.
+
+Run it with::
+
+    python -m benchmarks.url_parse_benchmark --urls 10000 --lengths 250 500 1000
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import itertools
+import re
+import time
+from typing import TYPE_CHECKING, NamedTuple
+
+import pytube.exceptions
+
+from YTDownloader import classify_urls, parse_youtube_url
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Sequence
+
+_PREVIOUS_PLAYLIST_URL_PATTERN: re.Pattern[str] = re.compile(
+    r"^(?:https?:\/\/)?(?:www\.|m\.)?"
+    r"(?:youtube(?:-nocookie)?\.com|youtu.be)"
+    r"\/playlist\?list=[\w\-_]{34}$",
+)
+_PREVIOUS_VIDEO_URL_PATTERN: re.Pattern[str] = re.compile(
+    r"^(?:https?:\/\/)?(?:www\.|m\.)?"
+    r"(?:youtube(?:-nocookie)?\.com|youtu.be)"
+    r"\/?.*(?:watch|embed)?(?:.*v=|v\/|\/)[\w\-\_]{11}"
+    r"(?:\S+)?(?:\?t=(?:\d+h)?(?:\d+m)?(?:\d+s)?(?:\d+))?$",
+)
+
+_URL_TEMPLATES: tuple[str, ...] = (
+    "https://www.youtube.com/watch?v={video_id}",
+    "https://youtu.be/{video_id}?t=85",
+    "youtube.com/watch?v={video_id}&feature=related",
+    "https://www.youtube-nocookie.com/embed/{video_id}",
+    "https://www.youtube.com/playlist?list=PL{video_id}{video_id}{video_id}",
+    "https://www.youtube.com/watch",
+)
+
+
+class _Result(NamedTuple):
+    """Tuple-like class holding the seconds both approaches took for one input."""
+
+    input: str
+    previous_seconds: float
+    parser_seconds: float
+
+
+def _urls(count: int) -> list[str]:
+    """Return typical urls, every video linked twice and some of them invalid."""
+    return [
+        template.format(video_id=f"{index // 2:011d}")
+        for index, template in zip(range(count), itertools.cycle(_URL_TEMPLATES))
+    ]
+
+
+def _classify_with_patterns(urls: Sequence[str]) -> None:
+    """Classify and deduplicate the urls like the previous patterns allowed to."""
+    unique: set[str] = set()
+    for url in urls:
+        if (
+            _PREVIOUS_PLAYLIST_URL_PATTERN.fullmatch(url) is not None
+            or _PREVIOUS_VIDEO_URL_PATTERN.fullmatch(url) is not None
+        ):
+            # the patterns only classify, the urls themselves are compared
+            unique.add(url)
+
+
+def _reject_with_parser(urls: Sequence[str]) -> None:
+    for url in urls:
+        with contextlib.suppress(pytube.exceptions.RegexMatchError):
+            parse_youtube_url(url)
+
+
+def _seconds(function: Callable[[Sequence[str]], object], urls: Sequence[str]) -> float:
+    start: float = time.perf_counter()
+    function(urls)
+    return time.perf_counter() - start
+
+
+def run(url_count: int, lengths: Sequence[int]) -> list[_Result]:
+    """Measure both approaches on typical urls and on adversarial ones."""
+    urls: list[str] = _urls(url_count)
+    results: list[_Result] = [
+        _Result(
+            f"{url_count} urls",
+            _seconds(_classify_with_patterns, urls),
+            _seconds(classify_urls, urls),
+        ),
+    ]
+    for length in lengths:
+        # the whitespace at the end makes the patterns try every split of the url
+        adversarial: list[str] = [
+            "youtube.com/" + "v=aaaaaaaaaaa" * (length // 13) + " ",
+        ]
+        results.append(
+            _Result(
+                f"{length} chars",
+                _seconds(_classify_with_patterns, adversarial),
+                _seconds(_reject_with_parser, adversarial),
+            ),
+        )
+    return results
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    """Run the benchmark and print the results as a table."""
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--urls", type=int, default=10_000)
+    parser.add_argument(
+        "--lengths",
+        type=int,
+        nargs="+",
+        default=[250, 500, 1000],
+        help="lengths of the adversarial urls, the patterns take cubic time",
+    )
+    args: argparse.Namespace = parser.parse_args(argv)
+
+    print(f"{'input':>12} {'patterns (s)':>13} {'parser (s)':>11} {'speedup':>8}")
+    for result in run(args.urls, args.lengths):
+        print(
+            f"{result.input:>12} {result.previous_seconds:>13.4f} "
+            f"{result.parser_seconds:>11.4f} "
+            f"{result.previous_seconds / result.parser_seconds:>7.1f}x",
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
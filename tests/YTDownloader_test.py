@@ -2,35 +2,124 @@
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+from http.client import HTTPException
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Any, ClassVar, cast
 
 import pytest
 import pytube.exceptions
+import pytube.request
 from pytube import Playlist, Stream, YouTube
 
+import YTDownloader
 from YTDownloader import (
-    _YOUTUBE_PLAYLIST_URL_PATTERN,
-    _YOUTUBE_VIDEO_URL_PATTERN,
     AUDIO,
+    BEST,
+    DOWNLOAD_OPTIONS,
     HD,
     LD,
+    AsyncDownloadEngine,
+    BandwidthLimiter,
+    CommandProcessor,
+    ConnectionPool,
+    DownloadArchive,
+    DownloadCancelledError,
+    DownloadEngine,
+    DownloadManager,
+    DownloadOptions,
+    DownloadStatus,
+    FileNameAllocator,
+    JobQueue,
+    MetadataCache,
+    Metrics,
     PlaylistDownloader,
+    PlaylistInfo,
+    PlaylistItem,
+    PlaylistManifest,
+    PostProcessor,
+    ProgressBus,
+    ProgressSnapshot,
+    StreamInfo,
+    UrlClassification,
     VideoDownloader,
+    VideoInfo,
     YouTubeDownloader,
-    _increment_playlist_dir_name,
+    YouTubeUrl,
+    _apply_limits,
+    _assign_file_name,
+    _clone_file,
+    _create_download_manager,
+    _create_playlist_dir,
+    _create_playlist_item,
+    _create_video_info,
+    _current_measurement,
+    _download_range,
+    _download_resumable,
+    _download_segmented,
+    _DownloadResult,
+    _DuplicateGroup,
+    _find_interrupted_playlist_dir,
+    _find_synced_playlist_dir,
+    _format_progress,
+    _format_rate,
+    _format_size,
+    _format_status,
+    _get_file_name_allocator,
+    _get_stream_from_video,
+    _get_streams_from_video,
     _increment_video_file_name,
+    _iter_playlist_video_ids,
+    _measure,
+    _parse_function_processor,
+    _parse_rate,
+    _probe_filesize,
+    _ProcessingResult,
+    _ProgressPrinter,
+    _read_urls,
     _remove_forbidden_characters_from_file_name,
+    _resolve_video,
+    _run_jobs,
+    _split_into_segments,
+    _watch_limit_file,
+    classify_urls,
+    cli,
     get_downloader,
+    parse_youtube_url,
 )
 
 if TYPE_CHECKING:
-    from pathlib import Path
+    from collections.abc import AsyncIterator, Callable, Iterator
 
-    from YTDownloader import DownloadOptions
+    from YTDownloader import Job
 
 # pylint: disable=C0116, C0301, W0621, W0212
 
 
+@pytest.fixture(autouse=True)
+def _forget_probed_filesizes() -> Iterator[None]:
+    # the sizes probed by one test must not be taken from the memo by another
+    yield
+    YTDownloader._probed_filesizes.clear()
+
+
 def test_ld_options() -> None:
     assert LD.resolution == "360p"
     assert LD.type == "video"
@@ -139,8 +228,10 @@ def video_downloader(youtube_video: YouTube) -> VideoDownloader:
 
 
 @pytest.fixture(scope="session")
-def playlist_downloader(youtube_playlist: Playlist) -> PlaylistDownloader:
-    return PlaylistDownloader(youtube_playlist.playlist_url)
+def playlist_downloader(youtube_playlist: Playlist) -> Iterator[PlaylistDownloader]:
+    downloader: PlaylistDownloader = PlaylistDownloader(youtube_playlist.playlist_url)
+    yield downloader
+    downloader.close()
 
 
 @pytest.mark.parametrize(
@@ -153,25 +244,43 @@ def playlist_downloader(youtube_playlist: Playlist) -> PlaylistDownloader:
         "youtube-nocookie.com/embed/dQw4w9WgXcQ",
         "http://www.youtube.com/watch?v=i-GFalTRHDA&feature=related",
         "http://www.youtube.com/attribution_link?u=/watch?v=dQw4w9WgXcQ&feature=share&a=9QlmP1yvjcllp0h3l0NwuA",
+    ],
+)
+def test_parse_youtube_url_valid_video_urls(video_url: str) -> None:
+    youtube_url: YouTubeUrl = parse_youtube_url(video_url)
+
+    assert not youtube_url.is_playlist
+    assert youtube_url.video_id in {"dQw4w9WgXcQ", "d_w4w9WgX-Q", "i-GFalTRHDA"}
+
+
+@pytest.mark.parametrize(
+    "video_url",
+    [
         "http://www.youtube.com/attribution_link?a=dQw4w9WgXcQ&u=/watch?v=xvFZjo5PgG0&feature=em-uploademail",
         "http://www.youtube.com/attribution_link?a=dQw4w9WgXcQ&feature=em-uploademail&u=/watch?v=xvFZjo5PgG0",
     ],
 )
-def test_youtube_video_url_pattern_valid_urls(video_url: str) -> None:
-    assert _YOUTUBE_VIDEO_URL_PATTERN.fullmatch(video_url) is not None
+def test_parse_youtube_url_relative_attribution_link(video_url: str) -> None:
+    assert parse_youtube_url(video_url).video_id == "xvFZjo5PgG0"
 
 
 @pytest.mark.parametrize("video_url", INVALID_VIDEO_URLS)
 def test_invalid_video_url(video_url: str) -> None:
-    assert _YOUTUBE_VIDEO_URL_PATTERN.fullmatch(video_url) is None
+    with pytest.raises(pytube.exceptions.RegexMatchError):
+        parse_youtube_url(video_url)
 
 
 @pytest.mark.parametrize(
     "playlist_url",
     VALID_PLAYLIST_URLS,
 )
-def test_youtube_playlist_url_pattern_valid_urls(playlist_url: str) -> None:
-    assert _YOUTUBE_PLAYLIST_URL_PATTERN.fullmatch(playlist_url) is not None
+def test_parse_youtube_url_valid_playlist_urls(playlist_url: str) -> None:
+    assert parse_youtube_url(playlist_url) == YouTubeUrl(
+        playlist_url,
+        None,
+        "PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        None,
+    )
 
 
 @pytest.mark.parametrize(
@@ -179,36 +288,118 @@ def test_youtube_playlist_url_pattern_valid_urls(playlist_url: str) -> None:
     INVALID_PLAYLIST_URLS,
 )
 def test_invalid_playlist_url(playlist_url: str) -> None:
-    assert _YOUTUBE_PLAYLIST_URL_PATTERN.fullmatch(playlist_url) is None
+    with pytest.raises(pytube.exceptions.RegexMatchError):
+        parse_youtube_url(playlist_url)
+
+
+@pytest.mark.parametrize(
+    ("url", "video_id", "playlist_id", "start"),
+    [
+        ("https://youtu.be/dQw4w9WgXcQ?t=85", "dQw4w9WgXcQ", None, 85),
+        (
+            "https://m.youtube.com/watch?v=dQw4w9WgXcQ&t=1h2m3s",
+            "dQw4w9WgXcQ",
+            None,
+            3723,
+        ),
+        ("https://www.youtube.com/embed/dQw4w9WgXcQ?start=42", "dQw4w9WgXcQ", None, 42),
+        (
+            "https://www.youtube.com/shorts/dQw4w9WgXcQ?t=oops",
+            "dQw4w9WgXcQ",
+            None,
+            None,
+        ),
+        (
+            "https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+            "dQw4w9WgXcQ",
+            "PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+            None,
+        ),
+    ],
+)
+def test_parse_youtube_url_ids_and_start(
+    url: str,
+    video_id: str,
+    playlist_id: str | None,
+    start: int | None,
+) -> None:
+    assert parse_youtube_url(url) == YouTubeUrl(url, video_id, playlist_id, start)
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        # the first ones took the previous pattern hours to reject
+        "youtube.com/" + "v=aaaaaaaaaaa" * 10_000 + " ",
+        "youtube.com/" + "v=" * 100_000 + " ",
+        "youtube.com/watch?" + "v=" * 100_000 + "&t=" + "1" * 100_000 + "x",
+        "youtube.com/" + "/" * 100_000 + " ",
+        "https://" + "www." * 100_000 + "youtube.com/watch?v=dQw4w9WgXcQ",
+        "youtube.com/attribution_link?u=" + "/watch?v=" * 100_000,
+        "https://youtube.com/playlist?" + "list=" * 100_000,
+    ],
+    ids=["ids", "v", "start", "slashes", "host", "attribution", "playlist"],
+)
+def test_parse_youtube_url_rejects_pathological_urls_in_linear_time(url: str) -> None:
+    start: float = time.perf_counter()
+
+    with pytest.raises(pytube.exceptions.RegexMatchError):
+        parse_youtube_url(url)
+
+    assert time.perf_counter() - start < 1
+
+
+def test_classify_urls_dedupes_by_canonical_id() -> None:
+    classification: UrlClassification = classify_urls(
+        [
+            "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+            "invalid",
+            "youtu.be/dQw4w9WgXcQ?t=85",
+            "https://www.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+            "https://youtu.be/jNQXAC9IVRw",
+            "m.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        ],
+    )
 
+    assert [url.canonical_url for url in classification.unique] == [
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        "https://www.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        "https://www.youtube.com/watch?v=jNQXAC9IVRw",
+    ]
+    assert [url.url for url in classification.duplicates] == [
+        "youtu.be/dQw4w9WgXcQ?t=85",
+        "m.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+    ]
+    assert classification.invalid == ["invalid"]
 
-def test_increment_playlist_dir_name_not_exists(tmp_path: Path) -> None:
+
+def test_create_playlist_dir_not_exists(tmp_path: Path) -> None:
     root: Path = tmp_path
     sub = "playlist"
 
-    result: Path = _increment_playlist_dir_name(root, sub)
+    result: Path = _create_playlist_dir(root, sub)
     expected_path: Path = root / sub
     assert result == expected_path
 
 
-def test_increment_playlist_dir_name_single_existing(tmp_path: Path) -> None:
+def test_create_playlist_dir_single_existing(tmp_path: Path) -> None:
     root: Path = tmp_path
     sub = "playlist"
     (root / sub).mkdir(parents=True, exist_ok=True)
 
-    result: Path = _increment_playlist_dir_name(root, sub)
+    result: Path = _create_playlist_dir(root, sub)
     expected_path: Path = root / f"{sub} (1)"
     assert result == expected_path
 
 
-def test_increment_playlist_dir_name_multiple_existing(tmp_path: Path) -> None:
+def test_create_playlist_dir_multiple_existing(tmp_path: Path) -> None:
     root: Path = tmp_path
     sub = "playlist"
     (root / sub).mkdir(parents=True, exist_ok=True)
     for i in range(1, 3):
         (root / f"{sub} ({i})").mkdir(parents=True, exist_ok=True)
 
-    result: Path = _increment_playlist_dir_name(root, sub)
+    result: Path = _create_playlist_dir(root, sub)
     expected_path: Path = root / f"{sub} (3)"
     assert result == expected_path
 
@@ -244,6 +435,102 @@ def test_increment_video_file_name_multiple_existing(tmp_path: Path) -> None:
     assert result == expected_file_name
 
 
+def test_file_name_allocator_lists_directory_once(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    for name in ("video.mp4", "video (1).mp4", "video (2).mp4", "other.mp4"):
+        (tmp_path / name).touch()
+    listings: list[object] = []
+    listdir: Callable[[Any], list[str]] = os.listdir
+
+    def counting_listdir(path: Any) -> list[str]:
+        listings.append(path)
+        return listdir(path)
+
+    monkeypatch.setattr(os, "listdir", counting_listdir)
+    allocator: FileNameAllocator = FileNameAllocator(tmp_path, ".mp4", ["taken"])
+
+    names: list[str] = [allocator.reserve("video") for _ in range(100)]
+
+    assert listings == [tmp_path]
+    assert names == [f"video ({number})" for number in range(3, 103)]
+    assert allocator.reserve("taken") == "taken (1)"
+    assert allocator.reserve("new") == "new"
+
+
+def test_file_name_allocator_reserves_names_for_concurrent_downloads(
+    tmp_path: Path,
+) -> None:
+    allocator: FileNameAllocator = FileNameAllocator(tmp_path, ".mp4")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        names: list[str] = list(
+            executor.map(lambda _: allocator.reserve("video"), range(400)),
+        )
+
+    assert len(set(names)) == 400
+
+
+def test_file_name_allocator_releases_name(tmp_path: Path) -> None:
+    allocator: FileNameAllocator = FileNameAllocator(tmp_path, ".mp4")
+    name: str = allocator.reserve("video")
+
+    allocator.release(name)
+    (tmp_path / "other.mp4").write_bytes(b"other")
+    allocator.release("other")
+
+    assert not (tmp_path / "video.mp4").exists()
+    assert allocator.reserve("video") == "video"
+    # the file was created after the directory was listed
+    assert allocator.reserve("other") == "other (1)"
+
+
+def test_file_name_allocators_of_least_recently_used_directories_are_evicted(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(YTDownloader, "_file_name_allocators", {})
+    monkeypatch.setattr(YTDownloader, "_MAX_FILE_NAME_ALLOCATORS", 2)
+    first: FileNameAllocator = _get_file_name_allocator(tmp_path / "first", ".mp4")
+    second: FileNameAllocator = _get_file_name_allocator(tmp_path / "second", ".mp4")
+    assert first.reserve("video") == "video"
+
+    assert _get_file_name_allocator(tmp_path / "first", ".mp4") is first
+    _get_file_name_allocator(tmp_path / "third", ".mp4")
+
+    assert len(YTDownloader._file_name_allocators) == 2
+    assert _get_file_name_allocator(tmp_path / "first", ".mp4") is first
+    assert _get_file_name_allocator(tmp_path / "second", ".mp4") is not second
+    # the name reserved by an evicted allocator stays taken
+    monkeypatch.setattr(YTDownloader, "_file_name_allocators", {})
+    allocator: FileNameAllocator = _get_file_name_allocator(tmp_path / "first", ".mp4")
+    assert allocator is not first
+    assert allocator.reserve("video") == "video (1)"
+
+
+def test_file_name_allocator_reserves_files_exclusively(tmp_path: Path) -> None:
+    # another process listed the directory before the first file was reserved
+    first: FileNameAllocator = FileNameAllocator(tmp_path, ".mp4")
+    second: FileNameAllocator = FileNameAllocator(tmp_path, ".mp4")
+    second.reserve("unrelated")
+
+    assert first.reserve("video") == "video"
+    assert second.reserve("video") == "video (1)"
+    assert (tmp_path / "video (1).mp4").read_bytes() == b""
+
+
+def test_file_name_allocator_creates_directories_exclusively(tmp_path: Path) -> None:
+    # another process listed the directory before the first one was created
+    first: FileNameAllocator = FileNameAllocator(tmp_path)
+    second: FileNameAllocator = FileNameAllocator(tmp_path)
+    second.reserve("unrelated")
+
+    assert first.create_dir("playlist") == tmp_path / "playlist"
+    assert second.create_dir("playlist") == tmp_path / "playlist (1)"
+    assert (tmp_path / "playlist (1)").is_dir()
+
+
 @pytest.mark.parametrize(
     ("file_name", "expected_file_name"),
     [
@@ -258,188 +545,3176 @@ def test_remove_forbidden_characters(file_name: str, expected_file_name: str) ->
     assert result == expected_file_name
 
 
-# pylint: enable=E1101
+_MEDIA: bytes = bytes(range(256)) * 4096  # 1 MiB
+
+
+class _MediaRequestHandler(BaseHTTPRequestHandler):
+    """Serve ``_MEDIA`` with support for range requests over keep-alive connections.
+
+    The server can be told to break off the connection after sending some bytes,
+    to close every connection after a response without announcing it,
+    to answer with empty bodies or to ignore the ranges.
+    """
+
+    server: _MediaServer
+    protocol_version: str = "HTTP/1.1"
+
+    def do_HEAD(self) -> None:  # noqa: N802
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(_MEDIA)))
+        self.end_headers()
+
+    def do_GET(self) -> None:  # noqa: N802
+        start: int = 0
+        end: int = len(_MEDIA) - 1
+        range_header: str | None = self.headers.get("Range")
+        if range_header is not None and not self.server.ignore_ranges:
+            start_text, end_text = range_header[len("bytes=") :].split("-")
+            start, end = int(start_text), min(int(end_text), end)
+        else:
+            range_header = None
+        self.server.requested_ranges.append((start, end))
+
+        body: bytes = b"" if self.server.empty_bodies else _MEDIA[start : end + 1]
+        self.send_response(206 if range_header is not None else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if (break_after := self.server.break_after) is not None:
+            self.server.break_after = None
+            self.wfile.write(body[:break_after])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        # a client rejecting the answer closes the connection without reading it
+        with contextlib.suppress(ConnectionError):
+            self.wfile.write(body)
+        self.close_connection = self.server.close_connections
+
+    def log_message(self, *_: object) -> None:
+        pass
+
+
+class _MediaServer(ThreadingHTTPServer):
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), _MediaRequestHandler)
+        self.requested_ranges: list[tuple[int, int]] = []
+        self.break_after: int | None = None
+        self.close_connections: bool = False
+        self.empty_bodies: bool = False
+        self.ignore_ranges: bool = False
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/media"
+
+
+@pytest.fixture()
+def media_server() -> Iterator[_MediaServer]:
+    server: _MediaServer = _MediaServer()
+    thread: threading.Thread = threading.Thread(
+        target=server.serve_forever,
+        daemon=True,
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
 
 
-def test_get_downloader_for_video() -> None:
-    downloader: YouTubeDownloader = get_downloader(
-        "www.youtube.com/watch?v=dQw4w9WgXcQ&t=85s&feature=related",
-    )
-    assert isinstance(downloader, VideoDownloader)
-    assert (
-        downloader._url
-        == "https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=85s&feature=related"
+def test_download_resumable(tmp_path: Path, media_server: _MediaServer) -> None:
+    file_path: Path = tmp_path / "video.mp4"
+    progress: list[tuple[int, int]] = []
+
+    _download_resumable(
+        media_server.url,
+        file_path,
+        len(_MEDIA),
+        lambda bytes_done, filesize: progress.append((bytes_done, filesize)),
     )
 
+    assert file_path.read_bytes() == _MEDIA
+    assert progress[-1] == (len(_MEDIA), len(_MEDIA))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["video.mp4"]
 
-def test_get_downloader_for_playlist() -> None:
-    downloader: YouTubeDownloader = get_downloader(
-        "www.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
-    )
-    assert isinstance(downloader, PlaylistDownloader)
-    assert (
-        downloader._url
-        == "https://www.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu"
+
+def test_download_resumable_resumes_interrupted_download(
+    tmp_path: Path,
+    media_server: _MediaServer,
+) -> None:
+    file_path: Path = tmp_path / "video.mp4"
+    media_server.break_after = 300_000
+
+    with pytest.raises(HTTPException):
+        _download_resumable(media_server.url, file_path, len(_MEDIA), max_retries=0)
+
+    assert not file_path.exists()
+    sidecar: dict[str, object] = json.loads(
+        (tmp_path / "video.mp4.part.json").read_text(encoding="utf-8"),
     )
+    assert sidecar == {
+        "url": media_server.url,
+        "filesize": len(_MEDIA),
+        "bytes_done": 300_000,
+    }
 
+    _download_resumable(media_server.url, file_path, len(_MEDIA))
 
-@pytest.mark.parametrize(
-    "invalid_url",
-    [
-        *INVALID_VIDEO_URLS,
-        *INVALID_PLAYLIST_URLS,
-    ],
-)
-def test_get_downloader_invalid_url_regex_error(invalid_url: str) -> None:
-    with pytest.raises(pytube.exceptions.RegexMatchError):
-        get_downloader(invalid_url)
+    assert media_server.requested_ranges[-1] == (300_000, len(_MEDIA) - 1)
+    assert file_path.read_bytes() == _MEDIA
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["video.mp4"]
 
 
-def test_video_property_video_downloader(
-    youtube_video: YouTube,
-    video_downloader: VideoDownloader,
+def test_download_resumable_retries_from_last_offset(
+    tmp_path: Path,
+    media_server: _MediaServer,
 ) -> None:
-    assert video_downloader._video == youtube_video
+    file_path: Path = tmp_path / "video.mp4"
+    media_server.break_after = 100_000
 
+    _download_resumable(media_server.url, file_path, len(_MEDIA))
 
-@pytest.mark.parametrize(
-    ("download_options", "expected_size"),
-    [
-        pytest.param(HD, "19.3 MB", id="HD"),
-        pytest.param(LD, "8.7 MB", id="LD"),
-        pytest.param(AUDIO, "3.3 MB", id="AUDIO"),
-    ],
-)
-def test_get_video_size_video_downloader(
-    video_downloader: VideoDownloader,
-    download_options: DownloadOptions,
-    expected_size: str,
+    assert media_server.requested_ranges == [
+        (0, len(_MEDIA) - 1),
+        (100_000, len(_MEDIA) - 1),
+    ]
+    assert file_path.read_bytes() == _MEDIA
+
+
+def test_download_resumable_ignores_outdated_sidecar(
+    tmp_path: Path,
+    media_server: _MediaServer,
 ) -> None:
-    assert video_downloader._get_video_size(download_options) in {
-        expected_size,
-        "Unavailable",
-    }
+    file_path: Path = tmp_path / "video.mp4"
+    (tmp_path / "video.mp4.part").write_bytes(b"x" * 1000)
+    (tmp_path / "video.mp4.part.json").write_text(
+        json.dumps({"url": media_server.url, "filesize": 42, "bytes_done": 1000}),
+        encoding="utf-8",
+    )
 
+    _download_resumable(media_server.url, file_path, len(_MEDIA))
 
-@pytest.mark.parametrize(
-    ("download_options", "expected_size"),
-    [
-        pytest.param(HD, "Unavailable", id="HD"),
-        pytest.param(LD, "0.8 MB", id="LD"),
-        pytest.param(AUDIO, "0.3 MB", id="AUDIO"),
-    ],
-)
-def test_get_video_size_video_downloader_unavailable(
-    download_options: DownloadOptions,
-    expected_size: str,
+    assert media_server.requested_ranges == [(0, len(_MEDIA) - 1)]
+    assert file_path.read_bytes() == _MEDIA
+
+
+def test_download_resumable_rejects_incomplete_file(
+    tmp_path: Path,
+    media_server: _MediaServer,
 ) -> None:
-    assert (
-        VideoDownloader("https://www.youtube.com/watch?v=jNQXAC9IVRw")._get_video_size(
-            download_options,
+    file_path: Path = tmp_path / "video.mp4"
+
+    with pytest.raises(pytube.exceptions.PytubeError, match="incomplete"):
+        _download_resumable(media_server.url, file_path, len(_MEDIA) + 10)
+
+    assert not file_path.exists()
+
+
+def test_measure_without_metrics() -> None:
+    with _measure("download", "dQw4w9WgXcQ") as measurement:
+        assert measurement is None
+        assert _current_measurement() is None
+
+
+def test_metrics_credit_work_of_segment_threads(
+    tmp_path: Path,
+    media_server: _MediaServer,
+) -> None:
+    connection_pool: ConnectionPool = ConnectionPool()
+    connection_pool.install()
+    metrics: Metrics = Metrics(tmp_path / "metrics.jsonl")
+    metrics.install()
+    media_server.break_after = 100_000
+
+    with _measure("download", "dQw4w9WgXcQ") as measurement:
+        _download_segmented(
+            media_server.url,
+            tmp_path / "video.mp4",
+            len(_MEDIA),
+            segments=4,
+            min_segment_size=64 * 1024,
         )
-        == expected_size
+    metrics.close()
+    connection_pool.close()
+
+    assert measurement is not None
+    assert measurement.bytes == len(_MEDIA)
+    assert measurement.requests == 5
+    assert measurement.retries == 1
+    assert _current_measurement() is None
+    item: dict[str, object] = json.loads(
+        (tmp_path / "metrics.jsonl").read_text(encoding="utf-8"),
+    )
+    assert item["event"] == "item"
+    assert item["phase"] == "download"
+    assert item["item"] == "dQw4w9WgXcQ"
+    assert item["bytes"] == measurement.bytes
+    assert item["error"] is None
+
+
+@pytest.fixture()
+def download_archive(tmp_path: Path) -> Iterator[DownloadArchive]:
+    archive: DownloadArchive = DownloadArchive(tmp_path / "archive.sqlite3")
+    yield archive
+    archive.close()
+
+
+def _media_stream_info(media_server: _MediaServer) -> StreamInfo:
+    return StreamInfo(
+        video_id="dQw4w9WgXcQ",
+        title="video",
+        itag=18,
+        url=media_server.url,
+        mime_type="video/mp4",
+        type="video",
+        resolution="360p",
+        abr=None,
+        is_progressive=True,
+        filesize=len(_MEDIA),
     )
 
 
-@pytest.mark.parametrize(
-    "download_options",
-    [
-        pytest.param(HD, id="HD"),
-        pytest.param(LD, id="LD"),
-        pytest.param(AUDIO, id="AUDIO"),
-    ],
-)
-def test_stream_selection_video_downloader(
-    video_downloader: VideoDownloader,
-    download_options: DownloadOptions,
+def test_download_probes_unknown_size_first(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    monkeypatch: pytest.MonkeyPatch,
 ) -> None:
-    stream_selection: Stream | None = video_downloader._stream_selection[
-        download_options
-    ]
-    if stream_selection is None:  # pragma: no cover # pylint: disable=R1705
-        return
-    else:  # pragma: no cover  # noqa: RET505
-        assert stream_selection.resolution == download_options.resolution
-        assert stream_selection.type == download_options.type
-        assert stream_selection.is_progressive is download_options.progressive
+    probed: list[str] = []
 
-        if download_options.type == "audio":  # specific ABR is only relevant for audio
-            assert stream_selection.abr == download_options.abr
+    def filesize(url: str) -> int:
+        probed.append(url)
+        return len(_MEDIA)
 
+    monkeypatch.setattr(pytube.request, "filesize", filesize)
+    stream: StreamInfo = _media_stream_info(media_server)._replace(filesize=0)
 
-def test_playlist_property_playlist_downloader(
-    youtube_playlist: Playlist,
-    playlist_downloader: PlaylistDownloader,
+    stream.download(str(tmp_path), "video.mp4", segments=4, min_segment_size=1)
+
+    assert probed == [media_server.url]
+    assert (tmp_path / "video.mp4").read_bytes() == _MEDIA
+
+
+def test_download_links_stream_from_archive(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    download_archive: DownloadArchive,
 ) -> None:
-    assert playlist_downloader._playlist.videos == youtube_playlist.videos
+    stream: StreamInfo = _media_stream_info(media_server)
+    progress: list[tuple[int, int]] = []
+
+    first_path: Path = Path(
+        stream.download(str(tmp_path / "first"), "video.mp4", archive=download_archive),
+    )
+    second_path: Path = Path(
+        stream.download(
+            str(tmp_path / "second"),
+            "video.mp4",
+            lambda bytes_done, filesize: progress.append((bytes_done, filesize)),
+            archive=download_archive,
+        ),
+    )
 
+    assert len(media_server.requested_ranges) == 1
+    assert second_path.read_bytes() == _MEDIA
+    assert second_path.stat().st_ino == first_path.stat().st_ino
+    assert progress == [(len(_MEDIA), len(_MEDIA))]
 
-@pytest.mark.parametrize(
-    ("download_options", "expected_size"),
-    [
-        pytest.param(HD, "162.9 MB", id="HD"),
-        pytest.param(LD, "104.2 MB", id="LD"),
-        pytest.param(AUDIO, "71.2 MB", id="AUDIO"),
-    ],
-)
-def test_get_playlist_size_playlist_downloader(
-    playlist_downloader: PlaylistDownloader,
-    download_options: DownloadOptions,
-    expected_size: str,
+
+def test_download_replaces_file_reserving_its_name(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    download_archive: DownloadArchive,
 ) -> None:
-    assert playlist_downloader._get_playlist_size(download_options) in {
-        expected_size,
-        "Unavailable",
-    }
+    stream: StreamInfo = _media_stream_info(media_server)
+    first_path: Path = (
+        tmp_path
+        / "first"
+        / f"{_increment_video_file_name(tmp_path / 'first', 'video')}.mp4"
+    )
+    second_path: Path = (
+        tmp_path
+        / "second"
+        / f"{_increment_video_file_name(tmp_path / 'second', 'video')}.mp4"
+    )
 
+    stream.download(str(first_path.parent), first_path.name, archive=download_archive)
+    stream.download(str(second_path.parent), second_path.name, archive=download_archive)
 
-@pytest.mark.parametrize(
-    "download_options",
-    [
-        pytest.param(HD, id="HD"),
-        pytest.param(LD, id="LD"),
-        pytest.param(AUDIO, id="AUDIO"),
-    ],
-)
-def test_stream_selection_len_playlist_downloader(
-    playlist_downloader: PlaylistDownloader,
-    download_options: DownloadOptions,
+    assert first_path.read_bytes() == _MEDIA
+    assert second_path.stat().st_ino == first_path.stat().st_ino
+
+
+def test_download_archive_forgets_removed_files(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    download_archive: DownloadArchive,
 ) -> None:
-    stream_selection: list[Stream] = playlist_downloader._stream_selection[  # type: ignore[assignment]
-        download_options
-    ]
+    stream: StreamInfo = _media_stream_info(media_server)
+    first_path: Path = Path(
+        stream.download(str(tmp_path / "first"), "video.mp4", archive=download_archive),
+    )
+    first_path.unlink()
+
+    stream.download(str(tmp_path / "second"), "video.mp4", archive=download_archive)
+
+    assert len(media_server.requested_ranges) == 2
     assert (
-        stream_selection is None
-        or len(stream_selection) == playlist_downloader._playlist.length
+        download_archive.find("dQw4w9WgXcQ", 18)
+        == (tmp_path / "second" / "video.mp4").resolve()
+    )
+
+
+def test_download_archive_reclaims_duplicates(
+    tmp_path: Path,
+    download_archive: DownloadArchive,
+) -> None:
+    paths: list[Path] = [tmp_path / "video.mp4", tmp_path / "video (1).mp4"]
+    for path in paths:
+        path.write_bytes(_MEDIA)
+        download_archive.add("dQw4w9WgXcQ", 18, path)
+    os.link(paths[0], tmp_path / "link.mp4")
+    download_archive.add("dQw4w9WgXcQ", 18, tmp_path / "link.mp4")
+
+    duplicates: list[_DuplicateGroup] = download_archive.duplicates()
+    assert len(duplicates) == 1
+    assert duplicates[0].size == len(_MEDIA)
+    assert len(duplicates[0].paths) == 2
+
+    assert download_archive.reclaim() == len(_MEDIA)
+
+    assert paths[0].stat().st_ino == paths[1].stat().st_ino
+    assert paths[1].read_bytes() == _MEDIA
+    assert download_archive.duplicates() == []
+
+
+def test_clone_file(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    source: Path = tmp_path / "source.mp4"
+    source.write_bytes(_MEDIA)
+
+    assert _clone_file(source, tmp_path / "hardlink.mp4") == "hardlink"
+
+    def link(*_: object) -> None:
+        raise OSError
+
+    monkeypatch.setattr(os, "link", link)
+
+    assert _clone_file(source, tmp_path / "clone.mp4") in {"reflink", "copy"}
+    assert (tmp_path / "clone.mp4").read_bytes() == _MEDIA
+    assert (tmp_path / "clone.mp4").stat().st_ino != source.stat().st_ino
+
+
+def test_find_interrupted_playlist_dir(tmp_path: Path) -> None:
+    (tmp_path / "playlist").mkdir()
+    (tmp_path / "playlist (1)").mkdir()
+    (tmp_path / "playlist (1)" / "video.mp4.part.json").touch()
+
+    assert _find_interrupted_playlist_dir(tmp_path, "playlist") == (
+        tmp_path / "playlist (1)"
+    )
+    assert _find_interrupted_playlist_dir(tmp_path, "other") is None
+
+
+def test_playlist_manifest(tmp_path: Path) -> None:
+    manifest: PlaylistManifest = PlaylistManifest(tmp_path, "PL1")
+    for video_id in ("dQw4w9WgXcQ", "jNQXAC9IVRw"):
+        (tmp_path / f"{video_id}.mp4").write_bytes(_MEDIA)
+        manifest.add(video_id, f"{video_id}.mp4")
+    (tmp_path / "jNQXAC9IVRw.mp4").unlink()
+    manifest = PlaylistManifest(tmp_path, "PL1")
+
+    assert manifest.missing(["jNQXAC9IVRw", "dQw4w9WgXcQ", "9bZkp7q19f0"]) == [
+        "jNQXAC9IVRw",
+        "9bZkp7q19f0",
+    ]
+    assert manifest.removed(["jNQXAC9IVRw"]) == ["dQw4w9WgXcQ"]
+    assert manifest.remove("dQw4w9WgXcQ") == tmp_path / "dQw4w9WgXcQ.mp4"
+    assert not (tmp_path / "dQw4w9WgXcQ.mp4").exists()
+    assert PlaylistManifest(tmp_path, "PL1").videos == {
+        "jNQXAC9IVRw": "jNQXAC9IVRw.mp4",
+    }
+    assert PlaylistManifest(tmp_path, "PL2").videos == {}
+
+
+def test_find_synced_playlist_dir(tmp_path: Path) -> None:
+    PlaylistManifest(tmp_path / "playlist", "PL2").save()
+    (tmp_path / "playlist (1)").mkdir()
+    PlaylistManifest(tmp_path / "playlist (2)", "PL1").save()
+
+    assert _find_synced_playlist_dir(tmp_path, "playlist", "PL1") == (
+        tmp_path / "playlist (2)"
+    )
+    assert _find_synced_playlist_dir(tmp_path, "playlist", "PL3") == (
+        tmp_path / "playlist (3)"
     )
 
 
 @pytest.mark.parametrize(
-    "download_options",
+    ("filesize", "segments", "min_segment_size", "expected_segments"),
     [
-        pytest.param(HD, id="HD"),
-        pytest.param(LD, id="LD"),
-        pytest.param(AUDIO, id="AUDIO"),
+        (100, 4, 10, [(0, 24), (25, 49), (50, 74), (75, 99)]),
+        (100, 3, 10, [(0, 33), (34, 67), (68, 99)]),
+        (100, 4, 40, [(0, 49), (50, 99)]),
+        (100, 4, 200, [(0, 99)]),
+        (100, 1, 10, [(0, 99)]),
     ],
 )
-def test_stream_selection_playlist_downloader(
-    playlist_downloader: PlaylistDownloader,
-    download_options: DownloadOptions,
+def test_split_into_segments(
+    filesize: int,
+    segments: int,
+    min_segment_size: int,
+    expected_segments: list[tuple[int, int]],
 ) -> None:
-    stream_selection: list[Stream] = playlist_downloader._stream_selection[  # type: ignore[assignment]
-        download_options
-    ]
+    result = _split_into_segments(filesize, segments, min_segment_size)
+    assert result == expected_segments
 
-    if stream_selection is None:  # pragma: no cover # pylint: disable=R1705
-        return
-    else:  # pragma: no cover  # noqa: RET505
-        for stream in stream_selection:  # pragma: no cover
-            assert stream.resolution == download_options.resolution
-            assert stream.type == download_options.type
-            assert stream.is_progressive is download_options.progressive
-
-            if (
-                download_options.type == "audio"
-            ):  # specific ABR is only relevant for audio
-                assert stream.abr == download_options.abr
-                assert stream.abr == download_options.abr
+
+def test_download_segmented(tmp_path: Path, media_server: _MediaServer) -> None:
+    file_path: Path = tmp_path / "video.mp4"
+    progress: list[tuple[int, int]] = []
+
+    _download_segmented(
+        media_server.url,
+        file_path,
+        len(_MEDIA),
+        lambda bytes_done, filesize: progress.append((bytes_done, filesize)),
+        segments=4,
+        min_segment_size=64 * 1024,
+    )
+
+    assert sorted(media_server.requested_ranges) == _split_into_segments(
+        len(_MEDIA),
+        4,
+        64 * 1024,
+    )
+    assert file_path.read_bytes() == _MEDIA
+    assert progress[-1] == (len(_MEDIA), len(_MEDIA))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["video.mp4"]
+
+
+def test_download_segmented_resumes_interrupted_download(
+    tmp_path: Path,
+    media_server: _MediaServer,
+) -> None:
+    file_path: Path = tmp_path / "video.mp4"
+    media_server.break_after = 100_000
+
+    with pytest.raises(HTTPException):
+        _download_segmented(
+            media_server.url,
+            file_path,
+            len(_MEDIA),
+            segments=2,
+            min_segment_size=64 * 1024,
+            max_retries=0,
+        )
+
+    assert not file_path.exists()
+    sidecar: dict[str, list[list[int]]] = json.loads(
+        (tmp_path / "video.mp4.part.json").read_text(encoding="utf-8"),
+    )
+    offsets: list[int] = [offset for _, _, offset in sidecar["segments"]]
+    assert sorted(offset - start for start, _, offset in sidecar["segments"]) == [
+        100_000,
+        len(_MEDIA) // 2,
+    ]
+    media_server.requested_ranges.clear()
+
+    _download_segmented(
+        media_server.url,
+        file_path,
+        len(_MEDIA),
+        segments=2,
+        min_segment_size=64 * 1024,
+    )
+
+    interrupted: int = next(
+        index
+        for index, (start, _, offset) in enumerate(sidecar["segments"])
+        if offset - start == 100_000
+    )
+    assert media_server.requested_ranges == [
+        (offsets[interrupted], sidecar["segments"][interrupted][1]),
+    ]
+    assert file_path.read_bytes() == _MEDIA
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["video.mp4"]
+
+
+def test_download_segmented_gives_up_on_empty_answers(
+    tmp_path: Path,
+    media_server: _MediaServer,
+) -> None:
+    media_server.empty_bodies = True
+
+    with pytest.raises(HTTPException):
+        _download_segmented(
+            media_server.url,
+            tmp_path / "video.mp4",
+            len(_MEDIA),
+            segments=2,
+            min_segment_size=64 * 1024,
+            max_retries=1,
+        )
+
+    # every segment is requested once and retried once
+    assert len(media_server.requested_ranges) == 4
+
+
+def test_download_range_rejects_ignored_range_of_first_segment(
+    tmp_path: Path,
+    media_server: _MediaServer,
+) -> None:
+    media_server.ignore_ranges = True
+
+    with (tmp_path / "video.mp4.part").open("wb") as part_file, pytest.raises(
+        pytube.exceptions.PytubeError,
+    ):
+        _download_range(
+            media_server.url,
+            part_file,
+            0,
+            64 * 1024 - 1,
+            lambda _: None,
+            allow_restart=False,
+        )
+
+    assert (tmp_path / "video.mp4.part").stat().st_size == 0
+
+
+def test_download_segmented_small_file_uses_single_connection(
+    tmp_path: Path,
+    media_server: _MediaServer,
+) -> None:
+    file_path: Path = tmp_path / "video.mp4"
+
+    _download_segmented(media_server.url, file_path, len(_MEDIA), segments=4)
+
+    assert media_server.requested_ranges == [(0, len(_MEDIA) - 1)]
+    assert file_path.read_bytes() == _MEDIA
+
+
+@pytest.fixture()
+def connection_pool() -> Iterator[ConnectionPool]:
+    pool: ConnectionPool = ConnectionPool()
+    pool.install()
+    yield pool
+    pool.close()
+
+
+def test_connection_pool_reuses_connections(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    connection_pool: ConnectionPool,
+) -> None:
+    for index in range(4):
+        _download_resumable(media_server.url, tmp_path / f"{index}.mp4", len(_MEDIA))
+
+    assert all((tmp_path / f"{index}.mp4").read_bytes() == _MEDIA for index in range(4))
+    assert connection_pool.opened == 1
+    assert connection_pool.reused == 3
+    assert connection_pool.reuse_ratio == 0.75
+
+
+def test_connection_pool_is_used_by_pytube(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    connection_pool: ConnectionPool,
+) -> None:
+    for _ in range(2):
+        headers: dict[str, str] = pytube.request.head(media_server.url)
+        assert int(headers["content-length"]) == len(_MEDIA)
+    _download_resumable(media_server.url, tmp_path / "video.mp4", len(_MEDIA))
+
+    assert connection_pool.opened == 1
+    assert connection_pool.reused == 2
+
+
+def test_connection_pool_limits_connections_per_host(
+    tmp_path: Path,
+    media_server: _MediaServer,
+) -> None:
+    pool: ConnectionPool = ConnectionPool(max_connections_per_host=2)
+    pool.install()
+    try:
+        _download_segmented(
+            media_server.url,
+            tmp_path / "video.mp4",
+            len(_MEDIA),
+            segments=8,
+            min_segment_size=64 * 1024,
+        )
+    finally:
+        pool.close()
+
+    assert (tmp_path / "video.mp4").read_bytes() == _MEDIA
+    assert len(media_server.requested_ranges) == 8
+    assert pool.opened <= 2
+    assert pool.opened + pool.reused == 8
+
+
+def test_connection_pool_replaces_connection_closed_by_server(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    connection_pool: ConnectionPool,
+) -> None:
+    media_server.close_connections = True
+
+    _download_resumable(media_server.url, tmp_path / "first.mp4", len(_MEDIA))
+    _download_resumable(media_server.url, tmp_path / "second.mp4", len(_MEDIA))
+
+    assert (tmp_path / "second.mp4").read_bytes() == _MEDIA
+    assert connection_pool.opened == 2
+    assert connection_pool.reused == 1
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now: float = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_progress_bus_aggregates_transfers() -> None:
+    clock: _FakeClock = _FakeClock()
+    progress_bus: ProgressBus = ProgressBus(1000, 2, interval=1, clock=clock)
+
+    progress_bus.update("first", 100, 500)
+    progress_bus.update("second", 200, 500)
+    progress_bus.update("first", 300, 500)
+    clock.now = 2
+    progress_bus.complete_item()
+
+    assert progress_bus.publish() == ProgressSnapshot(
+        bytes_done=500,
+        total_bytes=1000,
+        items_done=1,
+        total_items=2,
+        bytes_per_second=250.0,
+        eta=2.0,
+    )
+
+
+def test_progress_bus_publishes_at_most_once_per_interval() -> None:
+    clock: _FakeClock = _FakeClock()
+    progress_bus: ProgressBus = ProgressBus(10_000, interval=0.1, clock=clock)
+    snapshots: list[ProgressSnapshot] = []
+    progress_bus.subscribe(snapshots.append)
+
+    for bytes_done in range(1, 10_001):
+        clock.now = bytes_done / 10_000
+        progress_bus.update("video", bytes_done)
+    progress_bus.publish()
+
+    assert 10 <= len(snapshots) <= 11
+    assert snapshots[-1].percent == 100
+    assert snapshots[-1].eta == 0
+    assert [snapshot.bytes_done for snapshot in snapshots] == sorted(
+        snapshot.bytes_done for snapshot in snapshots
+    )
+
+
+def test_progress_bus_counts_restarted_transfer_once() -> None:
+    progress_bus: ProgressBus = ProgressBus(1000)
+
+    progress_bus.update("video", 600)
+    progress_bus.update("video", 100)
+
+    assert progress_bus.publish().bytes_done == 100
+
+
+@pytest.mark.parametrize(
+    ("snapshot", "expected_text"),
+    [
+        (
+            ProgressSnapshot(524288, 1048576, 0, 1, 1048576.0, 0.5),
+            "50% completed, 1.0 MB/s, 0:00 left",
+        ),
+        (
+            ProgressSnapshot(0, 1048576, 0, 1, 0.0, None),
+            "0% completed, 0.0 MB/s",
+        ),
+        (
+            ProgressSnapshot(943719, 1048576, 3, 4, 1024.0, 102.4),
+            "90% completed, 0.0 MB/s, 1:42 left, 3 of 4",
+        ),
+    ],
+)
+def test_format_progress(snapshot: ProgressSnapshot, expected_text: str) -> None:
+    assert _format_progress(snapshot) == expected_text
+
+
+class _FakeSleep:
+    def __init__(self, clock: _FakeClock) -> None:
+        self.clock: _FakeClock = clock
+        self.slept: float = 0.0
+
+    def __call__(self, seconds: float) -> None:
+        self.slept += seconds
+        self.clock.now += seconds
+
+
+def test_bandwidth_limiter_limits_all_transfers_together() -> None:
+    clock: _FakeClock = _FakeClock()
+    sleep: _FakeSleep = _FakeSleep(clock)
+    limiter: BandwidthLimiter = BandwidthLimiter(1000, clock=clock, sleep=sleep)
+    transfers: list[Callable[[int], None]] = [limiter.transfer() for _ in range(4)]
+
+    for _ in range(10):
+        for transfer in transfers:
+            transfer(50)
+
+    # the burst of a tenth of a second is allowed right away
+    assert sleep.slept == pytest.approx(1.9)
+
+
+def test_bandwidth_limiter_limits_every_transfer() -> None:
+    clock: _FakeClock = _FakeClock()
+    sleep: _FakeSleep = _FakeSleep(clock)
+    limiter: BandwidthLimiter = BandwidthLimiter(
+        transfer_rate=100,
+        clock=clock,
+        sleep=sleep,
+    )
+    first: Callable[[int], None] = limiter.transfer()
+    second: Callable[[int], None] = limiter.transfer()
+
+    first(110)
+    assert sleep.slept == pytest.approx(1)
+    second(10)
+    assert sleep.slept == pytest.approx(1)
+
+
+def test_bandwidth_limiter_changes_rate_of_waiting_transfer() -> None:
+    clock: _FakeClock = _FakeClock()
+
+    def sleep(seconds: float) -> None:
+        clock.now += seconds
+        limiter.set_transfer_rate(1000)
+
+    limiter: BandwidthLimiter = BandwidthLimiter(
+        transfer_rate=10,
+        clock=clock,
+        sleep=sleep,
+    )
+    transfer: Callable[[int], None] = limiter.transfer()
+
+    # at 10 bytes per second the transfer would be held back for almost two minutes
+    transfer(1000)
+
+    assert clock.now == pytest.approx(0.1 + 998 / 1000)
+    assert limiter.transfer_rate == 1000
+
+
+def test_bandwidth_limiter_unlimited() -> None:
+    clock: _FakeClock = _FakeClock()
+    sleep: _FakeSleep = _FakeSleep(clock)
+    limiter: BandwidthLimiter = BandwidthLimiter(100, 100, clock=clock, sleep=sleep)
+    transfer: Callable[[int], None] = limiter.transfer()
+
+    limiter.set_rate(None)
+    limiter.set_transfer_rate(None)
+    transfer(1_000_000)
+
+    assert sleep.slept == 0
+    assert limiter.rate is None
+    assert limiter.transfer_rate is None
+
+
+def test_bandwidth_limiter_cancels_transfers() -> None:
+    limiter: BandwidthLimiter = BandwidthLimiter()
+    transfer: Callable[[int], None] = limiter.transfer()
+    transfer(1000)
+
+    limiter.cancel()
+
+    with pytest.raises(DownloadCancelledError):
+        transfer(1000)
+    with pytest.raises(DownloadCancelledError):
+        limiter.transfer()(1000)
+
+
+def test_bandwidth_limiter_is_accurate_for_concurrent_transfers(
+    tmp_path: Path,
+    media_server: _MediaServer,
+) -> None:
+    limiter: BandwidthLimiter = BandwidthLimiter(2 * 1024 * 1024)
+
+    start: float = time.monotonic()
+    _download_segmented(
+        media_server.url,
+        tmp_path / "video.mp4",
+        len(_MEDIA),
+        segments=4,
+        min_segment_size=64 * 1024,
+        throttle=limiter.transfer(),
+    )
+    elapsed: float = time.monotonic() - start
+
+    assert (tmp_path / "video.mp4").read_bytes() == _MEDIA
+    # 1 MiB at 2 MiB/s after a burst of a tenth of a second
+    assert 0.35 <= elapsed < 1.0
+
+
+@pytest.mark.parametrize(
+    ("text", "expected_rate"),
+    [
+        ("", None),
+        ("0", None),
+        ("1500", 1500),
+        ("500K", 512000),
+        ("2m", 2 * 1024 * 1024),
+        ("1.5 MiB/s", 1.5 * 1024 * 1024),
+        ("1G", 1024**3),
+    ],
+)
+def test_parse_rate(text: str, expected_rate: float | None) -> None:
+    assert _parse_rate(text) == expected_rate
+
+
+@pytest.mark.parametrize("text", ["fast", "-1K", "2X", "1.2.3"])
+def test_parse_rate_invalid(text: str) -> None:
+    with pytest.raises(ValueError, match="invalid rate"):
+        _parse_rate(text)
+
+
+@pytest.mark.parametrize(
+    ("rate", "expected_text"),
+    [(None, ""), (1500, "1500"), (512000, "500K"), (2 * 1024 * 1024, "2M")],
+)
+def test_format_rate(rate: float | None, expected_text: str) -> None:
+    assert _format_rate(rate) == expected_text
+    assert _parse_rate(expected_text) == rate
+
+
+def test_apply_limits() -> None:
+    limiter: BandwidthLimiter = BandwidthLimiter()
+
+    assert _apply_limits(limiter, {"-LIMIT-": "2M", "-TRANSFERLIMIT-": "500K"})
+    assert not _apply_limits(limiter, {"-LIMIT-": "1K", "-TRANSFERLIMIT-": "5x"})
+    assert limiter.rate == 2 * 1024 * 1024
+    assert limiter.transfer_rate == 500 * 1024
+
+    assert _apply_limits(limiter, {"-LIMIT-": ""})
+    assert limiter.rate is None
+    assert limiter.transfer_rate == 500 * 1024
+
+
+def test_watch_limit_file(tmp_path: Path) -> None:
+    limit_file: Path = tmp_path / "limit"
+    limit_file.write_text("2M 500K\n", encoding="utf-8")
+    limiter: BandwidthLimiter = BandwidthLimiter()
+    output: io.StringIO = io.StringIO()
+    stop: threading.Event = threading.Event()
+    watcher: threading.Thread = threading.Thread(
+        target=_watch_limit_file,
+        args=(limit_file, limiter, _ProgressPrinter(output), stop),
+    )
+
+    watcher.start()
+    deadline: float = time.monotonic() + 5
+    while limiter.rate is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stop.set()
+    watcher.join()
+
+    assert limiter.rate == 2 * 1024 * 1024
+    assert limiter.transfer_rate == 500 * 1024
+    assert _read_events(output) == [
+        {"event": "limit", "rate": 2 * 1024 * 1024, "transfer_rate": 500 * 1024},
+    ]
+
+
+def _make_stream_info(
+    itag: int,
+    type: str,  # noqa: A002 # pylint: disable=W0622
+    resolution: str | None = None,
+    abr: str | None = None,
+    *,
+    is_progressive: bool = False,
+) -> StreamInfo:
+    return StreamInfo(
+        video_id="dQw4w9WgXcQ",
+        title="video",
+        itag=itag,
+        url=f"https://example.com/{itag}",
+        mime_type=f"{type}/mp4",
+        type=type,
+        resolution=resolution,
+        abr=abr,
+        is_progressive=is_progressive,
+        filesize=itag * 1024,
+    )
+
+
+def _make_video_info(video_id: str = "dQw4w9WgXcQ") -> VideoInfo:
+    return VideoInfo(
+        video_id=video_id,
+        title="video",
+        length=212,
+        views=1,
+        author="author",
+        channel_url="https://www.youtube.com/channel/author",
+        thumbnail_url="https://i.ytimg.com/vi/dQw4w9WgXcQ/hqdefault.jpg",
+        description="description",
+        streams=tuple(
+            stream._replace(video_id=video_id)
+            for stream in (
+                _make_stream_info(137, "video", "1080p"),
+                _make_stream_info(
+                    22,
+                    "video",
+                    "720p",
+                    is_progressive=True,
+                ),
+                _make_stream_info(
+                    18,
+                    "video",
+                    "360p",
+                    is_progressive=True,
+                ),
+                _make_stream_info(139, "audio", abr="48kbps"),
+                _make_stream_info(140, "audio", abr="128kbps"),
+            )
+        ),
+    )
+
+
+def test_get_streams_from_video() -> None:
+    streams = _get_streams_from_video(_make_video_info())
+
+    assert {options: stream.itag for options, stream in streams.items()} == {  # type: ignore[union-attr]
+        HD: 22,
+        LD: 18,
+        AUDIO: 140,
+    }
+
+
+def test_get_streams_from_video_unavailable() -> None:
+    video_info: VideoInfo = _make_video_info()
+    video_info = video_info._replace(streams=video_info.streams[2:4])
+
+    assert _get_streams_from_video(video_info) == {
+        HD: None,
+        LD: video_info.streams[0],
+        AUDIO: None,
+    }
+
+
+def test_get_adaptive_stream_from_video() -> None:
+    stream: StreamInfo | None = _get_stream_from_video(_make_video_info(), BEST)
+
+    assert stream is not None
+    assert stream.itag == 137
+    assert cast(StreamInfo, stream.audio).itag == 140
+    assert stream.filesize == (137 + 140) * 1024
+    # the progressive 720p stream is not adaptive
+    assert (
+        _get_stream_from_video(_make_video_info(), BEST._replace(resolution="720p"))
+        is None
+    )
+
+
+def _concatenate_streams(video_path: Path, audio_path: Path, file_path: Path) -> None:
+    file_path.write_bytes(video_path.read_bytes() + audio_path.read_bytes())
+
+
+def test_download_adaptive_stream(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    concurrency: _Concurrency = _Concurrency()
+    download_segmented: Callable[..., None] = _download_segmented
+
+    def slow_download_segmented(*args: Any, **kwargs: Any) -> None:
+        with concurrency:
+            time.sleep(0.05)
+            download_segmented(*args, **kwargs)
+
+    monkeypatch.setattr(YTDownloader, "_download_segmented", slow_download_segmented)
+    stream: StreamInfo = cast(
+        StreamInfo,
+        _get_stream_from_video(_media_video_info(media_server, "dQw4w9WgXcQ"), BEST),
+    )
+    progress: list[tuple[int, int]] = []
+
+    def on_progress(bytes_done: int, filesize: int) -> None:
+        progress.append((bytes_done, filesize))
+
+    stream.download(
+        str(tmp_path),
+        "video.mp4",
+        on_progress=on_progress,
+        muxer=_concatenate_streams,
+    )
+
+    assert concurrency.peak == 2
+    assert (tmp_path / "video.mp4").read_bytes() == _MEDIA * 2
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["video.mp4"]
+    assert progress[-1] == (2 * len(_MEDIA), 2 * len(_MEDIA))
+
+
+class _FakePytubeStream:
+    def __init__(self, stream_info: StreamInfo) -> None:
+        self.title: str = stream_info.title
+        self.itag: int = stream_info.itag
+        self.url: str = stream_info.url
+        self.mime_type: str = stream_info.mime_type
+        self.type: str = stream_info.type
+        self.resolution: str | None = stream_info.resolution
+        self.abr: str | None = stream_info.abr
+        self.is_progressive: bool = stream_info.is_progressive
+        self._filesize: int = stream_info.filesize
+        self.bitrate: int = stream_info.estimated_filesize * 8 // 212
+
+
+class _FakeYouTube:
+    def __init__(self, video_info: VideoInfo) -> None:
+        self.video_info: VideoInfo = video_info
+        self.streams_fetched: int = 0
+
+    def __getattr__(self, name: str) -> object:
+        return getattr(self.video_info, name)
+
+    @property
+    def streams(self) -> list[_FakePytubeStream]:
+        self.streams_fetched += 1
+        return [_FakePytubeStream(stream) for stream in self.video_info.streams]
+
+
+def test_create_video_info_fetches_streams_once() -> None:
+    video: _FakeYouTube = _FakeYouTube(_make_video_info())
+
+    video_info: VideoInfo = _create_video_info(video)  # type: ignore[arg-type]
+
+    assert video.streams_fetched == 1
+    assert video_info == _make_video_info()
+
+
+@pytest.fixture()
+def metadata_cache(tmp_path: Path) -> Iterator[MetadataCache]:
+    cache: MetadataCache = MetadataCache(tmp_path / "metadata.sqlite3")
+    yield cache
+    cache.close()
+
+
+def test_metadata_cache_video_round_trip(metadata_cache: MetadataCache) -> None:
+    assert metadata_cache.get_video("dQw4w9WgXcQ") is None
+
+    metadata_cache.put_video(_make_video_info())
+
+    assert metadata_cache.get_video("dQw4w9WgXcQ") == _make_video_info()
+    assert metadata_cache.hits == 1
+    assert metadata_cache.misses == 1
+
+
+def test_metadata_cache_playlist_round_trip(metadata_cache: MetadataCache) -> None:
+    playlist_info: PlaylistInfo = PlaylistInfo(
+        playlist_id="PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        title="playlist",
+        length=2,
+        views=1,
+        owner="owner",
+        owner_url="https://www.youtube.com/channel/owner",
+        last_updated="2023-01-01",
+        video_ids=("dQw4w9WgXcQ", "jNQXAC9IVRw"),
+    )
+
+    metadata_cache.put_playlist(playlist_info)
+
+    assert metadata_cache.get_playlist(playlist_info.playlist_id) == playlist_info
+
+
+def test_metadata_cache_persists(tmp_path: Path) -> None:
+    cache: MetadataCache = MetadataCache(tmp_path / "metadata.sqlite3")
+    cache.put_video(_make_video_info())
+    cache.close()
+
+    reopened_cache: MetadataCache = MetadataCache(tmp_path / "metadata.sqlite3")
+    assert reopened_cache.get_video("dQw4w9WgXcQ") == _make_video_info()
+    reopened_cache.close()
+
+
+def test_metadata_cache_ttl(metadata_cache: MetadataCache) -> None:
+    metadata_cache.ttl = -1
+    metadata_cache.put_video(_make_video_info())
+
+    assert metadata_cache.get_video("dQw4w9WgXcQ") is None
+    assert metadata_cache.misses == 1
+
+
+def test_metadata_cache_evicts_least_recently_used(
+    metadata_cache: MetadataCache,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    clock: Iterator[int] = itertools.count()
+    monkeypatch.setattr(YTDownloader, "time", SimpleNamespace(time=lambda: next(clock)))
+    entry: dict[str, object] = _make_video_info()._asdict()
+    entry["streams"] = [stream._asdict() for stream in _make_video_info().streams]
+    entry_size: int = len(json.dumps(entry))
+    metadata_cache.max_size = 2 * entry_size + entry_size // 2
+
+    metadata_cache.put_video(_make_video_info("aaaaaaaaaaa"))
+    metadata_cache.put_video(_make_video_info("bbbbbbbbbbb"))
+    assert metadata_cache.get_video("aaaaaaaaaaa") is not None
+    metadata_cache.put_video(_make_video_info("ccccccccccc"))
+
+    assert metadata_cache.get_video("bbbbbbbbbbb") is None
+    assert metadata_cache.get_video("aaaaaaaaaaa") is not None
+    assert metadata_cache.get_video("ccccccccccc") is not None
+
+
+def test_resolve_video_from_cache(metadata_cache: MetadataCache) -> None:
+    metadata_cache.put_video(_make_video_info())
+    video: _FakeYouTube = _FakeYouTube(_make_video_info())
+
+    assert _resolve_video(video, metadata_cache) == _make_video_info()  # type: ignore[arg-type]
+    assert video.streams_fetched == 0
+
+
+def test_resolve_video_stores_in_cache(metadata_cache: MetadataCache) -> None:
+    video: _FakeYouTube = _FakeYouTube(_make_video_info())
+
+    assert _resolve_video(video, metadata_cache) == _make_video_info()  # type: ignore[arg-type]
+    assert video.streams_fetched == 1
+    assert metadata_cache.get_video("dQw4w9WgXcQ") == _make_video_info()
+
+
+def _make_unknown_size_video_info() -> VideoInfo:
+    video_info: VideoInfo = _make_video_info()
+    return video_info._replace(
+        streams=tuple(
+            stream._replace(
+                filesize=0,
+                estimated_filesize=stream.itag * 8 * video_info.length // 8,
+            )
+            for stream in video_info.streams
+        ),
+    )
+
+
+def test_probe_filesize_falls_back_to_sequential_segments(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    def filesize(url: str) -> int:
+        raise urllib.error.HTTPError(url, 404, "Not Found", Message(), None)
+
+    monkeypatch.setattr(pytube.request, "filesize", filesize)
+    monkeypatch.setattr(pytube.request, "seq_filesize", lambda _: 42)
+
+    assert _probe_filesize(_make_unknown_size_video_info().streams[0]) == 42
+
+
+def test_probe_filesize_remembers_bounded_number_of_sizes(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    probed: list[str] = []
+
+    def filesize(url: str) -> int:
+        probed.append(url)
+        return 42
+
+    monkeypatch.setattr(pytube.request, "filesize", filesize)
+    monkeypatch.setattr(YTDownloader, "_MAX_PROBED_FILESIZES", 2)
+    streams: tuple[StreamInfo, ...] = _make_unknown_size_video_info().streams[:3]
+
+    for stream in (*streams, streams[2], streams[0]):
+        _probe_filesize(stream)
+
+    assert probed == [stream.url for stream in (*streams, streams[0])]
+    assert len(YTDownloader._probed_filesizes) == 2
+
+
+def test_resolve_video_estimates_sizes_without_probing(
+    metadata_cache: MetadataCache,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    def filesize(url: str) -> int:
+        raise AssertionError(url)
+
+    monkeypatch.setattr(pytube.request, "filesize", filesize)
+    video: _FakeYouTube = _FakeYouTube(_make_unknown_size_video_info())
+
+    video_info: VideoInfo = _resolve_video(
+        video,  # type: ignore[arg-type]
+        metadata_cache,
+        estimate_sizes=True,
+    )
+
+    assert video_info == _make_unknown_size_video_info()
+    # the bitrate of the fake streams is their itag in bytes per second
+    assert (
+        _format_size(
+            (cast(StreamInfo, _get_stream_from_video(video_info, HD)),),
+        )
+        == f"~{round(22 * 212 / 1048576, 1)} MB"
+    )
+
+
+def test_resolve_video_probes_sizes_left_unknown_in_cache(
+    metadata_cache: MetadataCache,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    probed: list[str] = []
+
+    def filesize(url: str) -> int:
+        probed.append(url)
+        return int(url.rpartition("/")[2])
+
+    monkeypatch.setattr(pytube.request, "filesize", filesize)
+    metadata_cache.put_video(_make_unknown_size_video_info())
+    video: _FakeYouTube = _FakeYouTube(_make_video_info())
+
+    video_info: VideoInfo = _resolve_video(video, metadata_cache)  # type: ignore[arg-type]
+
+    assert video.streams_fetched == 0
+    assert sorted(probed) == [
+        "https://example.com/140",
+        "https://example.com/18",
+        "https://example.com/22",
+    ]
+    assert metadata_cache.get_video("dQw4w9WgXcQ") == video_info
+    assert (
+        _format_size(
+            (cast(StreamInfo, _get_stream_from_video(video_info, HD)),),
+        )
+        == f"{round(22 / 1048576, 1)} MB"
+    )
+
+
+def test_get_playlist_from_cache(
+    metadata_cache: MetadataCache,
+    download_engine: DownloadEngine,
+    job_queue: JobQueue,
+) -> None:
+    video_ids: tuple[str, ...] = ("aaaaaaaaaaa", "bbbbbbbbbbb", "ccccccccccc")
+    for video_id in video_ids:
+        metadata_cache.put_video(_make_video_info(video_id))
+    downloader: PlaylistDownloader = PlaylistDownloader(
+        "https://www.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        metadata_cache=metadata_cache,
+        engine=download_engine,
+        job_queue=job_queue,
+    )
+    downloader._resolved_playlist_info = PlaylistInfo(
+        playlist_id="PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        title="playlist",
+        length=3,
+        views=1,
+        owner="owner",
+        owner_url="https://www.youtube.com/channel/owner",
+        last_updated="2023-01-01",
+        video_ids=video_ids,
+    )
+
+    stream_lists = downloader._get_playlist()
+
+    assert metadata_cache.hits == 3
+    assert {
+        options: [stream.video_id for stream in streams]  # type: ignore[union-attr]
+        for options, streams in stream_lists.items()
+    } == {options: list(video_ids) for options in DOWNLOAD_OPTIONS}
+    assert downloader._get_playlist_size(AUDIO) == "0.4 MB"
+
+
+class _FakeStream:
+    def __init__(self, title: str, *, fail: bool = False) -> None:
+        self.video_id: str = title
+        self.title: str = title
+        self.filesize: int = len(title)
+        self.fail: bool = fail
+
+    def download(  # noqa: PLR0913
+        self,
+        output_path: str,
+        filename: str,
+        on_progress: Callable[[int, int], None] | None = None,
+        archive: DownloadArchive | None = None,
+        limiter: BandwidthLimiter | None = None,
+        muxer: Callable[[Path, Path, Path], object] | None = None,
+    ) -> str:
+        file_path: Path = Path(output_path) / filename
+        if self.fail:
+            # like a stream, which gives up the empty file reserving its name
+            file_path.unlink(missing_ok=True)
+            raise pytube.exceptions.VideoUnavailable(self.title)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(self.title)
+        if on_progress is not None:
+            on_progress(len(self.title), len(self.title))
+        return str(file_path)
+
+
+class _Concurrency:
+    """Context manager counting how often and how many times at once it is entered."""
+
+    def __init__(self) -> None:
+        self.calls: int = 0
+        self.peak: int = 0
+        self._current: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def __enter__(self) -> None:
+        with self._lock:
+            self.calls += 1
+            self._current += 1
+            self.peak = max(self.peak, self._current)
+
+    def __exit__(self, *_: object) -> None:
+        with self._lock:
+            self._current -= 1
+
+
+class _SlowStream(_FakeStream):
+    def __init__(self, title: str, concurrency: _Concurrency) -> None:
+        super().__init__(title)
+        self.concurrency: _Concurrency = concurrency
+
+    def download(self, *args: Any, **kwargs: Any) -> str:
+        with self.concurrency:
+            time.sleep(0.02)
+            return super().download(*args, **kwargs)
+
+
+def _download_fake_streams(
+    download_engine: DownloadEngine,
+    streams: list[_FakeStream],
+    download_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    **kwargs: Any,
+) -> Iterator[_DownloadResult]:
+    """Download the fake streams in the pipeline, which resolves them by their ids."""
+    # pytube only accepts video ids of eleven characters
+    streams_by_id: dict[str, _FakeStream] = {
+        f"fakevideo{index:02d}": stream for index, stream in enumerate(streams)
+    }
+    monkeypatch.setattr(
+        YTDownloader,
+        "_read_video_info",
+        lambda video: _make_video_info(video.video_id),
+    )
+    monkeypatch.setattr(
+        YTDownloader,
+        "_get_streams_from_video",
+        lambda video_info, download_options=(HD,): dict.fromkeys(
+            download_options,
+            streams_by_id[video_info.video_id],
+        ),
+    )
+    allocator: FileNameAllocator = FileNameAllocator(download_path, ".mp4")
+    return download_engine.download_playlist(
+        list(streams_by_id),
+        HD,
+        download_path,
+        lambda _, stream: _assign_file_name(
+            cast("StreamInfo", stream).title,
+            allocator,
+        ),
+        **kwargs,
+    )
+
+
+@pytest.fixture()
+def download_engine() -> Iterator[DownloadEngine]:
+    engine: DownloadEngine = DownloadEngine(
+        max_resolutions=4,
+        max_probes=2,
+        max_downloads=3,
+    )
+    yield engine
+    engine.close()
+
+
+def test_download_engine_resolves_large_playlist_with_bounded_threads(
+    download_engine: DownloadEngine,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    concurrency: _Concurrency = _Concurrency()
+
+    def read_video_info(video: YouTube) -> VideoInfo:
+        with concurrency:
+            time.sleep(0.001)
+        return _make_video_info(video.video_id)
+
+    monkeypatch.setattr(YTDownloader, "_read_video_info", read_video_info)
+    video_ids: tuple[str, ...] = tuple(f"{index:011}" for index in range(2000))
+    playlist_info: PlaylistInfo = PlaylistInfo(
+        playlist_id="PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        title="playlist",
+        length=len(video_ids),
+        views=1,
+        owner="owner",
+        owner_url="https://www.youtube.com/channel/owner",
+        last_updated="2023-01-01",
+        video_ids=video_ids,
+    )
+    threads: int = threading.active_count()
+
+    stream_lists = download_engine.get_playlist_streams(playlist_info)
+
+    assert [stream.video_id for stream in stream_lists[HD]] == list(video_ids)  # type: ignore[union-attr]
+    assert concurrency.calls == len(video_ids)
+    assert concurrency.peak <= 4
+    # the threads of the engine, 4 + 2 + 3, are all there is to the 2000 videos
+    assert threading.active_count() - threads <= 9
+
+
+def test_download_engine_probes_unknown_sizes(
+    download_engine: DownloadEngine,
+    metadata_cache: MetadataCache,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    video_info: VideoInfo = _make_video_info()
+    monkeypatch.setattr(
+        YTDownloader,
+        "_read_video_info",
+        lambda _: video_info._replace(
+            streams=tuple(stream._replace(filesize=0) for stream in video_info.streams),
+        ),
+    )
+    concurrency: _Concurrency = _Concurrency()
+
+    def filesize(url: str) -> int:
+        with concurrency:
+            time.sleep(0.01)
+        return int(url.rpartition("/")[2])
+
+    monkeypatch.setattr(pytube.request, "filesize", filesize)
+
+    resolved: VideoInfo = download_engine.resolve_video("dQw4w9WgXcQ", metadata_cache)
+
+    assert {stream.itag: stream.filesize for stream in resolved.streams} == {
+        137: 0,
+        22: 22,
+        18: 18,
+        139: 0,
+        140: 140,
+    }
+    assert concurrency.calls == 3
+    assert concurrency.peak <= 2
+    assert metadata_cache.get_video("dQw4w9WgXcQ") == resolved
+
+    # every size is only probed once per video and itag, even with a new url
+    download_engine.resolve_video("dQw4w9WgXcQ")
+
+    assert concurrency.calls == 3
+
+
+def test_download_engine_estimates_sizes_without_probing(
+    download_engine: DownloadEngine,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(
+        YTDownloader,
+        "_read_video_info",
+        lambda _: _make_unknown_size_video_info(),
+    )
+
+    def filesize(url: str) -> int:
+        raise AssertionError(url)
+
+    monkeypatch.setattr(pytube.request, "filesize", filesize)
+
+    assert (
+        download_engine.resolve_video("dQw4w9WgXcQ", estimate_sizes=True)
+        == _make_unknown_size_video_info()
+    )
+
+
+def test_download_engine_resolves_video_from_cache(
+    download_engine: DownloadEngine,
+    metadata_cache: MetadataCache,
+) -> None:
+    metadata_cache.put_video(_make_video_info())
+
+    assert download_engine.resolve_video("dQw4w9WgXcQ", metadata_cache) == (
+        _make_video_info()
+    )
+    assert metadata_cache.hits == 1
+
+
+def test_download_engine_skips_work_once_cancelled(
+    download_engine: DownloadEngine,
+    metadata_cache: MetadataCache,
+) -> None:
+    metadata_cache.put_video(_make_video_info())
+
+    download_engine.cancel()
+
+    with pytest.raises(DownloadCancelledError):
+        download_engine.resolve_video("dQw4w9WgXcQ", metadata_cache)
+    assert metadata_cache.hits == 0
+
+
+def test_download_engine_downloads_streams(
+    download_engine: DownloadEngine,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    streams: list[_FakeStream] = [
+        _FakeStream("video"),
+        _FakeStream("video"),
+        _FakeStream("failing", fail=True),
+    ]
+    progress: list[tuple[object, int, int]] = []
+
+    results: list[_DownloadResult] = list(
+        _download_fake_streams(
+            download_engine,
+            streams,
+            tmp_path,
+            monkeypatch,
+            on_progress=lambda *args: progress.append(args),
+        ),
+    )
+
+    assert len(results) == 3
+    failed: list[_DownloadResult] = [
+        result for result in results if result.error is not None
+    ]
+    assert len(failed) == 1
+    assert failed[0].stream is streams[2]  # type: ignore[comparison-overlap]
+    assert {path.name for path in tmp_path.iterdir()} == {"video.mp4", "video (1).mp4"}
+    assert len(progress) == 2
+
+
+@pytest.mark.parametrize(("max_workers", "peak"), [(2, 2), (8, 3)])
+def test_download_engine_bounds_concurrent_downloads(
+    download_engine: DownloadEngine,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    max_workers: int,
+    peak: int,
+) -> None:
+    concurrency: _Concurrency = _Concurrency()
+    streams: list[_FakeStream] = [
+        _SlowStream(f"video{index}", concurrency) for index in range(12)
+    ]
+
+    list(
+        _download_fake_streams(
+            download_engine,
+            streams,
+            tmp_path,
+            monkeypatch,
+            max_workers=max_workers,
+        ),
+    )
+
+    assert concurrency.calls == 12
+    assert concurrency.peak <= peak
+
+
+def test_download_engine_cancels_downloads_not_consumed(
+    download_engine: DownloadEngine,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    concurrency: _Concurrency = _Concurrency()
+    streams: list[_FakeStream] = [
+        _SlowStream(f"video{index}", concurrency) for index in range(10)
+    ]
+    results: Iterator[_DownloadResult] = _download_fake_streams(
+        download_engine,
+        streams,
+        tmp_path,
+        monkeypatch,
+        max_workers=1,
+    )
+
+    next(results)
+    results.close()  # type: ignore[attr-defined]
+    time.sleep(0.1)
+
+    assert concurrency.calls < len(streams)
+
+
+def test_download_engine_pipeline_downloads_before_all_pages_loaded(
+    download_engine: DownloadEngine,
+    tmp_path: Path,
+    media_server: _MediaServer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(
+        YTDownloader,
+        "_read_video_info",
+        lambda video: _media_video_info(media_server, video.video_id),
+    )
+    first_downloaded: threading.Event = threading.Event()
+
+    def load_pages() -> Iterator[str]:
+        yield "dQw4w9WgXcQ"
+        # the next page only loads once the video of the first one was downloaded
+        assert first_downloaded.wait(5)
+        yield "jNQXAC9IVRw"
+
+    completed_video_ids: list[str] = []
+    for result in download_engine.download_playlist(
+        load_pages(),
+        HD,
+        tmp_path,
+        lambda video_id, _: video_id,
+    ):
+        assert result.error is None
+        completed_video_ids.append(result.stream.video_id)
+        first_downloaded.set()
+
+    assert completed_video_ids == ["dQw4w9WgXcQ", "jNQXAC9IVRw"]
+    assert (tmp_path / "jNQXAC9IVRw.mp4").read_bytes() == _MEDIA
+
+
+def test_download_engine_pipeline_takes_videos_only_when_there_is_room(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(
+        YTDownloader,
+        "_read_video_info",
+        lambda video: _media_video_info(media_server, video.video_id),
+    )
+    taken_video_ids: list[str] = []
+
+    def load_pages() -> Iterator[str]:
+        for index in range(1000):
+            taken_video_ids.append(f"{index:011}")
+            yield taken_video_ids[-1]
+
+    async def take_first_result() -> None:
+        engine: AsyncDownloadEngine = AsyncDownloadEngine(4, 2, 3)
+        results: AsyncIterator[_DownloadResult] = engine.download_playlist(
+            load_pages(),
+            HD,
+            tmp_path,
+            lambda video_id, _: video_id,
+            max_workers=2,
+        )
+        try:
+            await results.__anext__()
+            await asyncio.sleep(0.2)
+        finally:
+            await results.aclose()  # type: ignore[attr-defined]
+            engine.close()
+
+    asyncio.run(take_first_result())
+
+    # the downloads, the resolutions and the videos waiting for room in them
+    assert len(taken_video_ids) <= 2 + 4 + 2
+
+
+def test_iter_playlist_video_ids_caches_loaded_playlist(
+    metadata_cache: MetadataCache,
+) -> None:
+    playlist_info: PlaylistInfo = PlaylistInfo(
+        playlist_id="PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        title="playlist",
+        length=2,
+        views=1,
+        owner="owner",
+        owner_url="https://www.youtube.com/channel/owner",
+        last_updated="2023-01-01",
+        video_ids=(),
+    )
+    playlist: SimpleNamespace = SimpleNamespace(
+        url_generator=lambda: iter(
+            [
+                "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+                "https://www.youtube.com/watch?v=jNQXAC9IVRw",
+            ],
+        ),
+    )
+
+    video_ids: Iterator[str] = _iter_playlist_video_ids(
+        playlist,  # type: ignore[arg-type]
+        playlist_info,
+        metadata_cache,
+    )
+
+    assert next(video_ids) == "dQw4w9WgXcQ"
+    assert metadata_cache.get_playlist(playlist_info.playlist_id) is None
+    assert list(video_ids) == ["jNQXAC9IVRw"]
+    cached_playlist_info: PlaylistInfo | None = metadata_cache.get_playlist(
+        playlist_info.playlist_id,
+    )
+    assert cached_playlist_info is not None
+    assert cached_playlist_info.video_ids == ("dQw4w9WgXcQ", "jNQXAC9IVRw")
+
+
+# pylint: enable=E1101
+
+
+@pytest.fixture()
+def job_queue(tmp_path: Path) -> Iterator[JobQueue]:
+    job_queue: JobQueue = JobQueue(tmp_path / "jobs.sqlite3")
+    yield job_queue
+    job_queue.close()
+
+
+def test_job_queue_claims_in_priority_order(
+    tmp_path: Path,
+    job_queue: JobQueue,
+) -> None:
+    first_id: int = job_queue.add("https://youtu.be/dQw4w9WgXcQ", "HD", tmp_path)
+    urgent_id: int = job_queue.add(
+        "https://youtu.be/jNQXAC9IVRw",
+        "HD",
+        tmp_path,
+        priority=1,
+    )
+    second_id: int = job_queue.add("https://youtu.be/9bZkp7q19f0", "HD", tmp_path)
+
+    claimed_ids: list[int] = []
+    while (job := job_queue.claim()) is not None:
+        assert job.state == "running"
+        assert job.attempts == 1
+        claimed_ids.append(job.job_id)
+
+    assert claimed_ids == [urgent_id, first_id, second_id]
+
+
+def test_job_queue_recovers_jobs_of_crashed_process(
+    tmp_path: Path,
+    job_queue: JobQueue,
+) -> None:
+    job_id: int = job_queue.add("https://youtu.be/dQw4w9WgXcQ", "HD", tmp_path)
+    assert job_queue.claim() is not None
+    alive_queue: JobQueue = JobQueue(tmp_path / "jobs.sqlite3")
+    recovering_queue: JobQueue = JobQueue(tmp_path / "jobs.sqlite3", stale_after=0)
+    time.sleep(0.01)
+
+    assert alive_queue.running_elsewhere()
+    assert alive_queue.claim() is None
+    recovered_job: Job | None = recovering_queue.claim()
+    alive_queue.close()
+    recovering_queue.close()
+
+    assert recovered_job is not None
+    assert recovered_job.job_id == job_id
+    assert recovered_job.attempts == 2
+
+
+def test_job_queue_retries_failed_jobs_up_to_max_attempts(
+    tmp_path: Path,
+    job_queue: JobQueue,
+) -> None:
+    job_queue.add("https://youtu.be/dQw4w9WgXcQ", "HD", tmp_path)
+    attempts: int = 0
+
+    def run_job(_: Job) -> str:
+        nonlocal attempts
+        attempts += 1
+        return "failed"
+
+    for _ in range(5):
+        finished_jobs: list[Job] = _run_jobs(job_queue, run_job)
+
+    assert attempts == 3
+    assert not finished_jobs
+    assert [job.error for job in job_queue.jobs("failed")] == ["failed"]
+
+
+def test_job_queue_records_items_and_progress(
+    tmp_path: Path,
+    job_queue: JobQueue,
+) -> None:
+    job: Job = job_queue.start("https://youtu.be/dQw4w9WgXcQ", "HD", tmp_path)
+    job_queue.add_items(
+        job.job_id,
+        [
+            ("dQw4w9WgXcQ", tmp_path / "a.mp4", 10),
+            ("jNQXAC9IVRw", tmp_path / "b.mp4", 20),
+        ],
+    )
+    job_queue.add_items(job.job_id, [("dQw4w9WgXcQ", tmp_path / "c.mp4", 10)])
+
+    job_queue.record_progress(job.job_id, "jNQXAC9IVRw", 5)
+    assert job_queue.items(job.job_id)[1].bytes_done == 0
+    job_queue.heartbeat()
+    job_queue.finish_item(job.job_id, "dQw4w9WgXcQ")
+
+    assert [
+        (item.path.name, item.state, item.bytes_done)
+        for item in job_queue.items(job.job_id)
+    ] == [("a.mp4", "completed", 10), ("b.mp4", "pending", 5)]
+
+
+def test_cli_resumes_unfinished_job(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("YTDOWNLOADER_CACHE_DIR", str(tmp_path / "cache"))
+    playlist_info: PlaylistInfo = PlaylistInfo(
+        playlist_id="PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        title="playlist",
+        length=2,
+        views=1,
+        owner="owner",
+        owner_url="https://www.youtube.com/channel/owner",
+        last_updated="2023-01-01",
+        video_ids=("dQw4w9WgXcQ", "jNQXAC9IVRw"),
+    )
+    monkeypatch.setattr(
+        YTDownloader,
+        "_resolve_playlist_header",
+        lambda *_: playlist_info,
+    )
+    monkeypatch.setattr(
+        YTDownloader,
+        "_read_video_info",
+        lambda video: _media_video_info(media_server, video.video_id),
+    )
+    # the interrupted run downloaded the first video into a renamed file
+    download_path: Path = tmp_path / "playlist (1)"
+    download_path.mkdir()
+    (download_path / "first.mp4").write_bytes(b"first")
+    job_queue: JobQueue = JobQueue()
+    job_id: int = job_queue.add(
+        "https://www.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        "HD",
+        tmp_path,
+    )
+    job_queue.set_target(job_id, download_path)
+    job_queue.add_items(job_id, [("dQw4w9WgXcQ", download_path / "first.mp4", 5)])
+    job_queue.finish_item(job_id, "dQw4w9WgXcQ")
+    job_queue.close()
+    output: io.StringIO = io.StringIO()
+
+    exit_code: int = cli(["--no-cache", "--no-archive"], output)
+
+    assert exit_code == 0
+    assert sorted(path.name for path in download_path.iterdir()) == [
+        ".ytdownloader.json",
+        "first.mp4",
+        "video jNQXAC9IVRw.mp4",
+    ]
+    assert (download_path / "first.mp4").read_bytes() == b"first"
+    events: list[dict[str, object]] = _read_events(output)
+    completed_ids: list[object] = [
+        event["video_id"] for event in events if event["event"] == "completed"
+    ]
+    assert completed_ids == ["jNQXAC9IVRw"]
+    assert events[-1]["urls"] == 1
+    job_queue = JobQueue()
+    assert [job.state for job in job_queue.jobs()] == ["completed"]
+    job_queue.close()
+
+
+def test_cli_enqueues_without_downloading(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("YTDOWNLOADER_CACHE_DIR", str(tmp_path / "cache"))
+    output: io.StringIO = io.StringIO()
+
+    exit_code: int = cli(
+        [
+            "youtu.be/dQw4w9WgXcQ",
+            "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+            "--enqueue",
+            "--priority",
+            "2",
+            "--no-cache",
+        ],
+        output,
+    )
+
+    assert exit_code == 0
+    assert _read_events(output)[:2] == [
+        {
+            "event": "duplicate",
+            "url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+            "of": "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        },
+        {
+            "event": "queued",
+            "url": "https://youtu.be/dQw4w9WgXcQ",
+            "job": 1,
+            "priority": 2,
+        },
+    ]
+    job_queue: JobQueue = JobQueue()
+    assert [(job.state, job.priority) for job in job_queue.jobs()] == [("pending", 2)]
+    job_queue.close()
+
+
+class _BlockingJobRunner:
+    """Runs jobs by writing the events of a download, until it is released."""
+
+    def __init__(self, printer: _ProgressPrinter) -> None:
+        self.printer: _ProgressPrinter = printer
+        self.concurrency: _Concurrency = _Concurrency()
+        self.released: threading.Event = threading.Event()
+
+    def __call__(self, job: Job) -> str | None:
+        with self.concurrency:
+            self.printer.write(
+                "resolved",
+                url=job.url,
+                job=job.job_id,
+                title=job.url[-11:],
+                videos=1,
+            )
+            self.printer.progress(
+                job.url,
+                job.job_id,
+                ProgressSnapshot(512, 1024, 0, 1, 2048.0, 0.25),
+            )
+            self.released.wait(5)
+        return "unavailable" if job.url.endswith("jNQXAC9IVRw") else None
+
+
+def _wait_for_progress(manager: DownloadManager, count: int) -> list[DownloadStatus]:
+    deadline: float = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        statuses: list[DownloadStatus] = manager.statuses()
+        if sum(status.eta is not None for status in statuses) == count:
+            return statuses
+        time.sleep(0.01)
+    raise AssertionError(f"{count} jobs have not made progress")
+
+
+def test_download_manager_runs_queued_jobs_concurrently(
+    tmp_path: Path,
+    job_queue: JobQueue,
+) -> None:
+    printer: _ProgressPrinter = _ProgressPrinter(io.StringIO())
+    runner: _BlockingJobRunner = _BlockingJobRunner(printer)
+    manager: DownloadManager = DownloadManager(job_queue, runner, printer, max_jobs=2)
+
+    classification: UrlClassification = manager.add(
+        [
+            "youtu.be/dQw4w9WgXcQ",
+            "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+            "https://www.youtube.com/watch",
+            "youtu.be/jNQXAC9IVRw",
+            "youtu.be/9bZkp7q19f0",
+        ],
+        "AUDIO",
+        tmp_path,
+    )
+    statuses: list[DownloadStatus] = _wait_for_progress(manager, 2)
+
+    assert [youtube_url.video_id for youtube_url in classification.unique] == [
+        "dQw4w9WgXcQ",
+        "jNQXAC9IVRw",
+        "9bZkp7q19f0",
+    ]
+    assert len(classification.duplicates) == 1
+    assert classification.invalid == ["https://www.youtube.com/watch"]
+    assert statuses[:2] == [
+        DownloadStatus(
+            job_id,
+            f"https://www.youtube.com/watch?v={video_id}",
+            video_id,
+            "running",
+            50,
+            2048.0,
+            0.25,
+            None,
+        )
+        for job_id, video_id in ((1, "dQw4w9WgXcQ"), (2, "jNQXAC9IVRw"))
+    ]
+    assert statuses[2].state == "pending"
+    # a video is not queued again while its job is unfinished
+    assert manager.add(["youtu.be/9bZkp7q19f0?t=5"]).duplicates
+
+    runner.released.set()
+    manager.join()
+
+    assert [
+        (status.state, status.percent, status.error) for status in manager.statuses()
+    ] == [
+        ("completed", 100, None),
+        ("failed", 50, "unavailable"),
+        ("completed", 100, None),
+    ]
+    assert runner.concurrency.peak == 2
+    assert [(job.profile, job.state) for job in job_queue.jobs()] == [
+        ("AUDIO", "completed"),
+        ("AUDIO", "failed"),
+        ("AUDIO", "completed"),
+    ]
+    # a finished video can be downloaded again
+    assert manager.add(["youtu.be/dQw4w9WgXcQ"]).unique
+    manager.join()
+    manager.close()
+
+
+def test_download_manager_resumes_unfinished_jobs(
+    tmp_path: Path,
+    job_queue: JobQueue,
+) -> None:
+    job_queue.add("https://youtu.be/dQw4w9WgXcQ", "HD", tmp_path)
+    printer: _ProgressPrinter = _ProgressPrinter(io.StringIO())
+    runner: _BlockingJobRunner = _BlockingJobRunner(printer)
+    runner.released.set()
+    manager: DownloadManager = DownloadManager(job_queue, runner, printer)
+
+    assert manager.resume() == 1
+    manager.join()
+
+    assert manager.statuses() == [
+        DownloadStatus(
+            1,
+            "https://youtu.be/dQw4w9WgXcQ",
+            "dQw4w9WgXcQ",
+            "completed",
+            100,
+            0.0,
+            None,
+            None,
+        ),
+    ]
+    manager.close()
+
+
+def test_download_manager_runs_jobs_of_the_same_url(
+    tmp_path: Path,
+    job_queue: JobQueue,
+) -> None:
+    # e.g. left by two earlier runs, which both queued the video
+    job_queue.add("https://youtu.be/dQw4w9WgXcQ", "HD", tmp_path)
+    job_queue.add("https://youtu.be/dQw4w9WgXcQ", "AUDIO", tmp_path)
+    printer: _ProgressPrinter = _ProgressPrinter(io.StringIO())
+    runner: _BlockingJobRunner = _BlockingJobRunner(printer)
+    manager: DownloadManager = DownloadManager(job_queue, runner, printer, max_jobs=2)
+
+    assert manager.resume() == 2
+    statuses: list[DownloadStatus] = _wait_for_progress(manager, 2)
+    runner.released.set()
+    manager.join()
+    manager.close()
+
+    assert [(status.job_id, status.percent) for status in statuses] == [
+        (1, 50),
+        (2, 50),
+    ]
+    assert [(status.state, status.percent) for status in manager.statuses()] == [
+        ("completed", 100),
+        ("completed", 100),
+    ]
+    assert [job.state for job in job_queue.jobs()] == ["completed", "completed"]
+
+
+def test_download_manager_close_waits_for_interrupted_jobs(
+    tmp_path: Path,
+    job_queue: JobQueue,
+) -> None:
+    printer: _ProgressPrinter = _ProgressPrinter(io.StringIO())
+    limiter: BandwidthLimiter = BandwidthLimiter()
+    started: threading.Event = threading.Event()
+
+    def run_job(job: Job) -> str | None:
+        transfer: Callable[[int], None] = limiter.transfer()
+        started.set()
+        try:
+            while True:
+                transfer(1)
+                time.sleep(0.01)
+        except DownloadCancelledError as err:
+            printer.write("failed", url=job.url, error=str(err))
+            return str(err)
+
+    manager: DownloadManager = DownloadManager(job_queue, run_job, printer, max_jobs=1)
+    manager.add(["youtu.be/dQw4w9WgXcQ", "youtu.be/jNQXAC9IVRw"], output_dir=tmp_path)
+    assert started.wait(5)
+
+    limiter.cancel()
+    manager.close()
+
+    # the interrupted job is resumed by the next run, like the waiting one
+    assert [(job.state, job.attempts) for job in job_queue.jobs()] == [
+        ("pending", 0),
+        ("pending", 0),
+    ]
+    assert [status.state for status in manager.statuses()] == ["pending", "pending"]
+
+
+def test_download_manager_of_start_window_passes_settings(
+    tmp_path: Path,
+    job_queue: JobQueue,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    runs: list[dict[str, Any]] = []
+
+    def run_job(job: Job, **kwargs: Any) -> None:
+        runs.append({"url": job.url, **kwargs})
+
+    monkeypatch.setattr(YTDownloader, "_run_job", run_job)
+    engine: DownloadEngine = DownloadEngine(muxer=_concatenate_streams)
+    manager: DownloadManager = _create_download_manager(
+        job_queue,
+        engine,
+        None,
+        None,
+        BandwidthLimiter(),
+        _ProgressPrinter(io.StringIO()),
+        workers=6,
+        connections=4,
+    )
+
+    manager.add(["youtu.be/dQw4w9WgXcQ"], output_dir=tmp_path)
+    manager.join()
+    manager.close()
+    engine.close()
+
+    assert [
+        (run["url"], run["workers"], run["connections"], run["muxer"]) for run in runs
+    ] == [
+        ("https://www.youtube.com/watch?v=dQw4w9WgXcQ", 6, 4, _concatenate_streams),
+    ]
+
+
+@pytest.mark.parametrize(
+    ("status", "expected_row"),
+    [
+        pytest.param(
+            DownloadStatus(
+                1,
+                "https://youtu.be/x",
+                None,
+                "pending",
+                0,
+                0.0,
+                None,
+                None,
+            ),
+            ["https://youtu.be/x", "pending", "0%", "", ""],
+            id="pending",
+        ),
+        pytest.param(
+            DownloadStatus(
+                1,
+                "https://youtu.be/x",
+                "t",
+                "running",
+                40,
+                3 << 20,
+                75,
+                None,
+            ),
+            ["t", "running", "40%", "3.0 MB/s", "1:15"],
+            id="running",
+        ),
+        pytest.param(
+            DownloadStatus(
+                1,
+                "https://youtu.be/x",
+                "t",
+                "completed",
+                100,
+                0.0,
+                None,
+                None,
+            ),
+            ["t", "completed", "100%", "", ""],
+            id="completed",
+        ),
+    ],
+)
+def test_format_status(status: DownloadStatus, expected_row: list[str]) -> None:
+    assert _format_status(status) == expected_row
+
+
+def test_read_urls(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "stdin", io.StringIO("youtu.be/dQw4w9WgXcQ\n\n"))
+    input_file: io.StringIO = io.StringIO(
+        "# comment\n https://youtu.be/jNQXAC9IVRw \n",
+    )
+
+    assert _read_urls(["youtu.be/9bZkp7q19f0", "-"], input_file) == [
+        "youtu.be/9bZkp7q19f0",
+        "youtu.be/dQw4w9WgXcQ",
+        "https://youtu.be/jNQXAC9IVRw",
+    ]
+
+
+def _media_video_info(media_server: _MediaServer, video_id: str) -> VideoInfo:
+    video_info: VideoInfo = _make_video_info(video_id)
+    return video_info._replace(
+        title=f"video {video_id}",
+        streams=tuple(
+            stream._replace(
+                title=f"video {video_id}",
+                url=media_server.url,
+                filesize=len(_MEDIA),
+            )
+            for stream in video_info.streams
+        ),
+    )
+
+
+def _read_events(output: io.StringIO) -> list[dict[str, object]]:
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def test_cli_downloads_video(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(
+        YTDownloader,
+        "_resolve_video",
+        lambda video, _: _media_video_info(media_server, video.video_id),
+    )
+    output: io.StringIO = io.StringIO()
+
+    exit_code: int = cli(
+        [
+            "youtu.be/dQw4w9WgXcQ",
+            "-p",
+            "ld",
+            "-o",
+            str(tmp_path),
+            "--no-cache",
+            "--no-archive",
+            "--no-queue",
+        ],
+        output,
+    )
+
+    assert exit_code == 0
+    assert (tmp_path / "video dQw4w9WgXcQ.mp4").read_bytes() == _MEDIA
+    events: list[dict[str, object]] = _read_events(output)
+    assert [event["event"] for event in events if event["event"] != "progress"] == [
+        "resolved",
+        "completed",
+        "finished",
+    ]
+    assert events[-2]["path"] == str(tmp_path / "video dQw4w9WgXcQ.mp4")
+    assert events[-3]["percent"] == 100
+    assert events[-1] == {
+        "event": "finished",
+        "urls": 1,
+        "failed": 0,
+        "connections_opened": 1,
+        "connections_reused": 0,
+    }
+
+
+def test_cli_downloads_adaptive_video(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(
+        YTDownloader,
+        "_resolve_video",
+        lambda video, _: _media_video_info(media_server, video.video_id),
+    )
+
+    exit_code: int = cli(
+        [
+            "youtu.be/dQw4w9WgXcQ",
+            "-p",
+            "best",
+            "--muxer",
+            f"{__name__}:_concatenate_streams",
+            "-o",
+            str(tmp_path),
+            "--no-cache",
+            "--no-archive",
+            "--no-queue",
+        ],
+        io.StringIO(),
+    )
+
+    assert exit_code == 0
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "video dQw4w9WgXcQ.mp4",
+    ]
+    assert (tmp_path / "video dQw4w9WgXcQ.mp4").read_bytes() == _MEDIA * 2
+
+
+def test_cli_exports_metrics(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # the page is not fetched
+    monkeypatch.setattr(
+        YTDownloader,
+        "_read_video_info",
+        lambda video: _media_video_info(media_server, video.video_id),
+    )
+
+    exit_code: int = cli(
+        [
+            "youtu.be/dQw4w9WgXcQ",
+            "-o",
+            str(tmp_path),
+            "--metrics",
+            str(tmp_path / "metrics.jsonl"),
+            "--metrics-prometheus",
+            str(tmp_path / "ytdownloader.prom"),
+            "--no-cache",
+            "--no-archive",
+            "--no-queue",
+        ],
+        io.StringIO(),
+    )
+
+    assert exit_code == 0
+    lines: list[dict[str, Any]] = [
+        json.loads(line)
+        for line in (tmp_path / "metrics.jsonl")
+        .read_text(encoding="utf-8")
+        .splitlines()
+    ]
+    assert [
+        (line["phase"], line["item"]) for line in lines if line["event"] == "item"
+    ] == [
+        ("classify", "youtu.be/dQw4w9WgXcQ"),
+        ("classify", "https://youtu.be/dQw4w9WgXcQ"),
+        ("resolve", "dQw4w9WgXcQ"),
+        ("download", "dQw4w9WgXcQ"),
+    ]
+    totals: dict[str, dict[str, Any]] = {
+        line["phase"]: line for line in lines if line["event"] == "phase"
+    }
+    assert totals["download"]["bytes"] == len(_MEDIA)
+    assert totals["download"]["requests"] == 1
+    assert totals["download"]["throughput"] > 0
+    assert totals["probe"]["items"] == 0
+    prometheus: list[str] = (
+        (tmp_path / "ytdownloader.prom").read_text(encoding="utf-8").splitlines()
+    )
+    assert "# TYPE ytdownloader_phase_bytes_total counter" in prometheus
+    assert f'ytdownloader_phase_bytes_total{{phase="download"}} {len(_MEDIA)}' in (
+        prometheus
+    )
+    assert 'ytdownloader_phase_items_total{phase="classify"} 2' in prometheus
+    assert not (tmp_path / "ytdownloader.prom.tmp").exists()
+
+
+def test_cli_downloads_playlist(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    playlist_info: PlaylistInfo = PlaylistInfo(
+        playlist_id="PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        title="playlist",
+        length=2,
+        views=1,
+        owner="owner",
+        owner_url="https://www.youtube.com/channel/owner",
+        last_updated="2023-01-01",
+        video_ids=("dQw4w9WgXcQ", "jNQXAC9IVRw"),
+    )
+    monkeypatch.setattr(
+        YTDownloader,
+        "_resolve_playlist_header",
+        lambda *_: playlist_info,
+    )
+    monkeypatch.setattr(
+        YTDownloader,
+        "_read_video_info",
+        lambda video: _media_video_info(media_server, video.video_id),
+    )
+    output: io.StringIO = io.StringIO()
+
+    exit_code: int = cli(
+        [
+            "https://www.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+            "--output-dir",
+            str(tmp_path),
+            "--no-cache",
+            "--no-archive",
+            "--no-queue",
+        ],
+        output,
+    )
+
+    assert exit_code == 0
+    assert sorted(path.name for path in (tmp_path / "playlist").iterdir()) == [
+        ".ytdownloader.json",
+        "video dQw4w9WgXcQ.mp4",
+        "video jNQXAC9IVRw.mp4",
+    ]
+    events: list[dict[str, object]] = _read_events(output)
+    assert sorted(
+        str(event["video_id"]) for event in events if event["event"] == "completed"
+    ) == ["dQw4w9WgXcQ", "jNQXAC9IVRw"]
+    requests: int = sum(
+        cast(int, events[-1][key])
+        for key in ("connections_opened", "connections_reused")
+    )
+    assert requests == len(playlist_info.video_ids)
+
+
+def test_cli_resumes_interrupted_playlist_into_its_files(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    playlist_info: PlaylistInfo = PlaylistInfo(
+        playlist_id="PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        title="playlist",
+        length=3,
+        views=1,
+        owner="owner",
+        owner_url="https://www.youtube.com/channel/owner",
+        last_updated="2023-01-01",
+        video_ids=("dQw4w9WgXcQ", "jNQXAC9IVRw", "9bZkp7q19f0"),
+    )
+    monkeypatch.setattr(
+        YTDownloader,
+        "_resolve_playlist_header",
+        lambda *_: playlist_info,
+    )
+    monkeypatch.setattr(
+        YTDownloader,
+        "_read_video_info",
+        lambda video: _media_video_info(media_server, video.video_id),
+    )
+    # the interrupted run completed the first video, the second one partially
+    # and the third one without recording it in the manifest
+    download_path: Path = tmp_path / "playlist"
+    download_path.mkdir()
+    (download_path / "video dQw4w9WgXcQ.mp4").write_bytes(_MEDIA)
+    PlaylistManifest(download_path, playlist_info.playlist_id).add(
+        "dQw4w9WgXcQ",
+        "video dQw4w9WgXcQ.mp4",
+    )
+    (download_path / "video jNQXAC9IVRw.mp4.part").write_bytes(_MEDIA[:300_000])
+    (download_path / "video jNQXAC9IVRw.mp4.part.json").write_text(
+        json.dumps(
+            {"url": media_server.url, "filesize": len(_MEDIA), "bytes_done": 300_000},
+        ),
+        encoding="utf-8",
+    )
+    (download_path / "video 9bZkp7q19f0.mp4").write_bytes(_MEDIA)
+    output: io.StringIO = io.StringIO()
+
+    exit_code: int = cli(
+        [
+            "https://www.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+            "--output-dir",
+            str(tmp_path),
+            "--no-cache",
+            "--no-archive",
+            "--no-queue",
+        ],
+        output,
+    )
+
+    assert exit_code == 0
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["playlist"]
+    assert sorted(path.name for path in download_path.iterdir()) == [
+        ".ytdownloader.json",
+        "video 9bZkp7q19f0.mp4",
+        "video dQw4w9WgXcQ.mp4",
+        "video jNQXAC9IVRw.mp4",
+    ]
+    assert (download_path / "video jNQXAC9IVRw.mp4").read_bytes() == _MEDIA
+    assert media_server.requested_ranges == [(300_000, len(_MEDIA) - 1)]
+    assert PlaylistManifest(download_path, playlist_info.playlist_id).videos == {
+        "dQw4w9WgXcQ": "video dQw4w9WgXcQ.mp4",
+        "jNQXAC9IVRw": "video jNQXAC9IVRw.mp4",
+        "9bZkp7q19f0": "video 9bZkp7q19f0.mp4",
+    }
+
+
+def test_cli_syncs_playlist(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    playlist_info: PlaylistInfo = PlaylistInfo(
+        playlist_id="PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        title="playlist",
+        length=2,
+        views=1,
+        owner="owner",
+        owner_url="https://www.youtube.com/channel/owner",
+        last_updated="2023-01-01",
+        video_ids=("dQw4w9WgXcQ", "jNQXAC9IVRw"),
+    )
+    monkeypatch.setattr(
+        YTDownloader,
+        "_resolve_playlist_header",
+        lambda *_: playlist_info,
+    )
+    resolved_video_ids: list[str] = []
+
+    def read_video_info(video: YouTube) -> VideoInfo:
+        resolved_video_ids.append(video.video_id)
+        return _media_video_info(media_server, video.video_id)
+
+    monkeypatch.setattr(YTDownloader, "_read_video_info", read_video_info)
+    argv: list[str] = [
+        "https://www.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        "-o",
+        str(tmp_path),
+        "--no-cache",
+        "--no-archive",
+        "--no-queue",
+    ]
+
+    assert cli([*argv, "--sync"], io.StringIO()) == 0
+    resolved_video_ids.clear()
+    assert cli([*argv, "--sync"], io.StringIO()) == 0
+    assert not resolved_video_ids
+
+    playlist_info = playlist_info._replace(video_ids=("jNQXAC9IVRw", "9bZkp7q19f0"))
+    output: io.StringIO = io.StringIO()
+    assert cli([*argv, "--prune"], output) == 0
+
+    assert resolved_video_ids == ["9bZkp7q19f0"]
+    assert sorted(path.name for path in (tmp_path / "playlist").iterdir()) == [
+        ".ytdownloader.json",
+        "video 9bZkp7q19f0.mp4",
+        "video jNQXAC9IVRw.mp4",
+    ]
+    events: list[dict[str, object]] = [
+        event for event in _read_events(output) if event["event"] != "progress"
+    ]
+    assert [event["event"] for event in events] == [
+        "resolved",
+        "completed",
+        "removed",
+        "finished",
+    ]
+    assert events[2]["video_id"] == "dQw4w9WgXcQ"
+
+
+def test_cli_reports_invalid_url(tmp_path: Path) -> None:
+    output: io.StringIO = io.StringIO()
+
+    exit_code: int = cli(
+        ["invalid", "-o", str(tmp_path), "--no-cache", "--no-archive", "--no-queue"],
+        output,
+    )
+
+    assert exit_code == 1
+    assert _read_events(output) == [
+        {"event": "failed", "url": "invalid", "error": "Invalid link."},
+        {
+            "event": "finished",
+            "urls": 1,
+            "failed": 1,
+            "connections_opened": 0,
+            "connections_reused": 0,
+        },
+    ]
+
+
+def test_cli_reclaims_duplicates(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("YTDOWNLOADER_CACHE_DIR", str(tmp_path / "cache"))
+    archive: DownloadArchive = DownloadArchive()
+    for name in ("video.mp4", "video (1).mp4"):
+        (tmp_path / name).write_bytes(_MEDIA)
+        archive.add("dQw4w9WgXcQ", 18, tmp_path / name)
+    archive.close()
+    job_queue: JobQueue = JobQueue()
+    job_queue.add("https://youtu.be/jNQXAC9IVRw", "HD", tmp_path)
+    output: io.StringIO = io.StringIO()
+
+    exit_code: int = cli(["--reclaim-duplicates", "--no-cache"], output)
+
+    # the job left by an earlier run is not resumed without urls
+    assert [job.state for job in job_queue.jobs()] == ["pending"]
+    job_queue.close()
+
+    assert exit_code == 0
+    assert [event["event"] for event in _read_events(output)] == [
+        "duplicate",
+        "duplicates",
+        "reclaimed",
+        "finished",
+    ]
+    assert _read_events(output)[1]["reclaimable"] == len(_MEDIA)
+    assert _read_events(output)[2]["bytes"] == len(_MEDIA)
+
+
+def _mark_processed(path: Path) -> None:
+    with path.open("a", encoding="utf-8") as file:
+        file.write(f"processed by {os.getpid()}\n")
+
+
+def test_post_processor_runs_processors_in_processes(tmp_path: Path) -> None:
+    paths: list[Path] = [tmp_path / f"video {index}.mp4" for index in range(3)]
+    for path in paths:
+        path.write_text("", encoding="utf-8")
+    results: list[_ProcessingResult] = []
+    post_processor: PostProcessor = PostProcessor(
+        [_mark_processed, _mark_processed],
+        max_workers=1,
+    )
+
+    for path in paths:
+        post_processor.submit(path, results.append)
+    post_processor.join()
+    post_processor.close()
+
+    assert sorted(result.path for result in results) == paths
+    assert all(result.error is None and result.seconds >= 0 for result in results)
+    lines: set[str] = set()
+    for path in paths:
+        lines.update(path.read_text(encoding="utf-8").splitlines())
+        assert len(path.read_text(encoding="utf-8").splitlines()) == 2
+    # every file was processed by the only process of the pool
+    assert lines == {next(iter(lines))}
+    assert lines != {f"processed by {os.getpid()}"}
+
+
+def test_post_processor_reports_failing_processor(tmp_path: Path) -> None:
+    path: Path = tmp_path / "video.mp4"
+    path.write_text("", encoding="utf-8")
+    results: list[_ProcessingResult] = []
+    post_processor: PostProcessor = PostProcessor(
+        [
+            CommandProcessor((sys.executable, "-c", "raise SystemExit(1)")),
+            _mark_processed,
+        ],
+    )
+
+    post_processor.submit(path, results.append)
+    post_processor.join()
+    post_processor.close()
+
+    assert len(results) == 1
+    assert cast(str, results[0].error).startswith("CalledProcessError: ")
+    assert not path.read_text(encoding="utf-8")
+
+
+def test_command_processor(tmp_path: Path) -> None:
+    path: Path = tmp_path / "video.mp4"
+    path.write_text("", encoding="utf-8")
+    script: str = "import sys; open(sys.argv[-1], 'a').write(sys.argv[1])"
+
+    CommandProcessor((sys.executable, "-c", script, "{}"))(path)
+    CommandProcessor((sys.executable, "-c", script, "appended"))(path)
+
+    assert path.read_text(encoding="utf-8") == f"{path}appended"
+
+
+def test_parse_function_processor() -> None:
+    assert _parse_function_processor(f"{__name__}:_mark_processed") is _mark_processed
+    assert _parse_function_processor("pathlib:Path.touch") is Path.touch
+    with pytest.raises(ValueError, match="invalid function"):
+        _parse_function_processor("_mark_processed")
+
+
+def test_cli_post_processes_downloaded_video(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(
+        YTDownloader,
+        "_resolve_video",
+        lambda video, _: _media_video_info(media_server, video.video_id),
+    )
+    output: io.StringIO = io.StringIO()
+
+    exit_code: int = cli(
+        [
+            "youtu.be/dQw4w9WgXcQ",
+            "-o",
+            str(tmp_path),
+            "--post-process-function",
+            f"{__name__}:_mark_processed",
+            "--no-cache",
+            "--no-archive",
+            "--no-queue",
+        ],
+        output,
+    )
+
+    assert exit_code == 0
+    video_path: Path = tmp_path / "video dQw4w9WgXcQ.mp4"
+    assert video_path.read_bytes().startswith(_MEDIA + b"processed by ")
+    events: list[dict[str, object]] = [
+        event for event in _read_events(output) if event["event"] != "progress"
+    ]
+    assert [event["event"] for event in events] == [
+        "resolved",
+        "completed",
+        "processed",
+        "finished",
+    ]
+    assert events[2]["path"] == str(video_path)
+
+
+class _RecordingPostProcessor:
+    """Post-processor recording its calls, which fails the files once joined."""
+
+    calls: ClassVar[list[str]] = []
+
+    def __init__(self, *_: object) -> None:
+        self._submitted: list[tuple[Path, Callable[[_ProcessingResult], None]]] = []
+
+    def submit(
+        self,
+        path: Path,
+        on_processed: Callable[[_ProcessingResult], None],
+    ) -> None:
+        self.calls.append(f"submit {path.name}")
+        self._submitted.append((path, on_processed))
+
+    def join(self) -> None:
+        self.calls.append("join")
+        for path, on_processed in self._submitted:
+            on_processed(_ProcessingResult(path, 0.0, "failed"))
+        self._submitted.clear()
+
+    def close(self) -> None:
+        self.calls.append("close")
+
+
+def test_cli_processes_videos_while_next_jobs_run(
+    tmp_path: Path,
+    media_server: _MediaServer,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(
+        YTDownloader,
+        "_resolve_video",
+        lambda video, _: _media_video_info(media_server, video.video_id),
+    )
+    monkeypatch.setattr(YTDownloader, "PostProcessor", _RecordingPostProcessor)
+    monkeypatch.setattr(_RecordingPostProcessor, "calls", [])
+    output: io.StringIO = io.StringIO()
+
+    exit_code: int = cli(
+        [
+            "youtu.be/dQw4w9WgXcQ",
+            "youtu.be/jNQXAC9IVRw",
+            "-o",
+            str(tmp_path),
+            "--post-process-function",
+            f"{__name__}:_mark_processed",
+            "--no-cache",
+            "--no-archive",
+            "--no-queue",
+        ],
+        output,
+    )
+
+    # the failed processing of a video fails the run, not its finished job
+    assert exit_code == 1
+    assert _RecordingPostProcessor.calls == [
+        "submit video dQw4w9WgXcQ.mp4",
+        "submit video jNQXAC9IVRw.mp4",
+        "join",
+        "close",
+    ]
+    assert _read_events(output)[-1]["failed"] == 2
+
+
+def test_import_does_not_load_heavy_dependencies() -> None:
+    script: str = (
+        "import sys, YTDownloader;"
+        "print(*(module for module in ('tkinter', 'pytube.__main__', 'email.parser',"
+        " 'shlex') if module in sys.modules))"
+    )
+    result: subprocess.CompletedProcess[str] = subprocess.run(
+        [sys.executable, "-c", script],  # noqa: S603
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(YTDownloader.__file__).parent,
+    )
+
+    assert not result.stdout.strip()
+
+
+def test_cli_does_not_import_gui_toolkit(tmp_path: Path) -> None:
+    script: str = (
+        "import sys, YTDownloader;"
+        f"YTDownloader.cli(['invalid', '-o', {str(tmp_path)!r}, '--no-cache',"
+        " '--no-archive', '--no-queue']);"
+        "print('tkinter' in sys.modules)"
+    )
+    result: subprocess.CompletedProcess[str] = subprocess.run(
+        [sys.executable, "-c", script],  # noqa: S603
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(YTDownloader.__file__).parent,
+    )
+
+    assert result.stdout.splitlines()[-1] == "False"
+
+
+def test_get_downloader_for_video() -> None:
+    downloader: YouTubeDownloader = get_downloader(
+        "www.youtube.com/watch?v=dQw4w9WgXcQ&t=85s&feature=related",
+    )
+    assert isinstance(downloader, VideoDownloader)
+    assert (
+        downloader._url
+        == "https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=85s&feature=related"
+    )
+
+
+def test_get_downloader_for_playlist() -> None:
+    downloader: YouTubeDownloader = get_downloader(
+        "www.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+    )
+    assert isinstance(downloader, PlaylistDownloader)
+    assert (
+        downloader._url
+        == "https://www.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu"
+    )
+
+    # the engine and the job queue it created are closed with it
+    downloader.close()
+
+    assert downloader._engine._loop.is_closed()
+    with pytest.raises(sqlite3.ProgrammingError):
+        downloader._job_queue.jobs()
+
+
+def test_playlist_downloader_keeps_given_engine_and_job_queue_open(
+    download_engine: DownloadEngine,
+    job_queue: JobQueue,
+) -> None:
+    downloader: PlaylistDownloader = PlaylistDownloader(
+        "https://www.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        engine=download_engine,
+        job_queue=job_queue,
+    )
+
+    downloader.close()
+
+    assert not download_engine._loop.is_closed()
+    assert job_queue.jobs() == []
+
+
+def test_playlist_downloader_resolves_stream_selection_lazily_once(
+    download_engine: DownloadEngine,
+    job_queue: JobQueue,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    calls: list[None] = []
+
+    def fake_get_playlist(
+        self: PlaylistDownloader,  # noqa: ARG001
+    ) -> dict[DownloadOptions, list[StreamInfo | None]]:
+        calls.append(None)
+        stream: StreamInfo = _make_stream_info(22, "video", "720p", is_progressive=True)
+        return {HD: [stream, stream], LD: [stream, None], AUDIO: []}
+
+    monkeypatch.setattr(PlaylistDownloader, "_get_playlist", fake_get_playlist)
+    downloader: PlaylistDownloader = PlaylistDownloader(
+        "https://www.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        engine=download_engine,
+        job_queue=job_queue,
+    )
+    assert not calls
+
+    assert downloader._stream_selection[LD] is None
+    assert len(downloader._stream_selection[HD]) == 2  # type: ignore[arg-type]
+    assert downloader._stream_selection[AUDIO] == []
+    assert len(calls) == 1
+
+
+def test_create_playlist_item() -> None:
+    stream: StreamInfo = _make_stream_info(22, "video", "720p", is_progressive=True)
+
+    assert _create_playlist_item(stream) == PlaylistItem(
+        video_id="dQw4w9WgXcQ",
+        title="video",
+        itag=22,
+        url="https://example.com/22",
+        filesize=22 * 1024,
+        estimated_filesize=0,
+        expires=0,
+    )
+    assert (
+        _create_playlist_item(
+            stream._replace(url="https://example.com/22?expire=1700000000&itag=22"),
+        ).expires
+        == 1700000000
+    )
+
+
+def test_playlist_downloader_downloads_while_streams_are_resolved(
+    tmp_path: Path,
+    download_engine: DownloadEngine,
+    job_queue: JobQueue,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    resolving: threading.Event = threading.Event()
+    resolved: threading.Event = threading.Event()
+
+    def blocking_get_playlist(
+        self: PlaylistDownloader,  # noqa: ARG001
+    ) -> dict[DownloadOptions, list[StreamInfo | None]]:
+        resolving.set()
+        resolved.wait(5)
+        return {HD: [], LD: [], AUDIO: []}
+
+    started: list[tuple[Any, ...]] = []
+    monkeypatch.setattr(PlaylistDownloader, "_get_playlist", blocking_get_playlist)
+    monkeypatch.setattr(
+        YTDownloader,
+        "_start_download",
+        lambda *args: started.append(args),
+    )
+    downloader: PlaylistDownloader = PlaylistDownloader(
+        "https://www.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        engine=download_engine,
+        job_queue=job_queue,
+    )
+    downloader._resolved_playlist_header = PlaylistInfo(
+        playlist_id="PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        title="playlist",
+        length=2,
+        views=1,
+        owner="owner",
+        owner_url="https://www.youtube.com/channel/owner",
+        last_updated="2023-01-01",
+        video_ids=(),
+    )
+    resolution: threading.Thread = threading.Thread(
+        target=lambda: downloader._stream_selection,
+    )
+    resolution.start()
+    assert resolving.wait(5)
+
+    # the download is started from the gui thread, which must not wait
+    download: threading.Thread = threading.Thread(
+        target=downloader._download,
+        args=(HD, tmp_path, 2),
+        kwargs={"sync": False, "prune": False},
+    )
+    download.start()
+    download.join(5)
+    try:
+        assert not download.is_alive()
+        assert len(started) == 1
+        assert (tmp_path / "playlist").is_dir()
+    finally:
+        resolved.set()
+        resolution.join()
+
+
+def _make_signed_video_info(video_id: str) -> VideoInfo:
+    # like on YouTube, every stream has its own signed url of about a kilobyte
+    video_info: VideoInfo = _make_video_info(video_id)
+    return video_info._replace(
+        description="description " * 400,
+        streams=tuple(
+            stream._replace(
+                url=f"https://example.com/videoplayback?expire=1700000000"
+                f"&id={video_id}&itag={stream.itag}&sig={'0' * 1000}",
+            )
+            for stream in video_info.streams
+        ),
+    )
+
+
+@pytest.mark.parametrize(
+    "video_count",
+    [pytest.param(1000, id="1k"), pytest.param(10_000, id="10k")],
+)
+def test_playlist_downloader_keeps_compact_records_of_huge_playlist(
+    download_engine: DownloadEngine,
+    job_queue: JobQueue,
+    monkeypatch: pytest.MonkeyPatch,
+    video_count: int,
+) -> None:
+    monkeypatch.setattr(
+        YTDownloader,
+        "_read_video_info",
+        lambda video: _make_signed_video_info(video.video_id),
+    )
+    downloader: PlaylistDownloader = PlaylistDownloader(
+        "https://www.youtube.com/playlist?list=PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        engine=download_engine,
+        job_queue=job_queue,
+        estimate_sizes=True,
+    )
+    video_ids: tuple[str, ...] = tuple(f"{index:011}" for index in range(video_count))
+    downloader._resolved_playlist_info = PlaylistInfo(
+        playlist_id="PL5--8gKSku15-C4mBKRpQVcaat4zwe4Gu",
+        title="playlist",
+        length=video_count,
+        views=1,
+        owner="owner",
+        owner_url="https://www.youtube.com/channel/owner",
+        last_updated="2023-01-01",
+        video_ids=video_ids,
+    )
+
+    tracemalloc.start()
+    try:
+        stream_selection: dict[DownloadOptions, list[PlaylistItem] | None] = (
+            downloader._stream_selection
+        )
+        kept_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert [item.video_id for item in stream_selection[HD]] == list(video_ids)  # type: ignore[union-attr]
+    assert downloader._get_playlist_size(AUDIO) == f"{140 * video_count / 1024:.1f} MB"
+    # a video has 5 streams with urls of about 1 KB and a description of about 5 KB,
+    # only the 3 selected streams are kept and only a few videos are held at once
+    assert kept_bytes / video_count < 5 * 1024
+    assert peak_bytes / video_count < 8 * 1024
+
+
+@pytest.mark.parametrize(
+    "invalid_url",
+    [
+        *INVALID_VIDEO_URLS,
+        *INVALID_PLAYLIST_URLS,
+    ],
+)
+def test_get_downloader_invalid_url_regex_error(invalid_url: str) -> None:
+    with pytest.raises(pytube.exceptions.RegexMatchError):
+        get_downloader(invalid_url)
+
+
+def test_video_property_video_downloader(
+    youtube_video: YouTube,
+    video_downloader: VideoDownloader,
+) -> None:
+    assert video_downloader._video == youtube_video
+
+
+@pytest.mark.parametrize(
+    ("download_options", "expected_size"),
+    [
+        pytest.param(HD, "19.3 MB", id="HD"),
+        pytest.param(LD, "8.7 MB", id="LD"),
+        pytest.param(AUDIO, "3.3 MB", id="AUDIO"),
+    ],
+)
+def test_get_video_size_video_downloader(
+    video_downloader: VideoDownloader,
+    download_options: DownloadOptions,
+    expected_size: str,
+) -> None:
+    assert video_downloader._get_video_size(download_options) in {
+        expected_size,
+        "Unavailable",
+    }
+
+
+@pytest.mark.parametrize(
+    ("download_options", "expected_size"),
+    [
+        pytest.param(HD, "Unavailable", id="HD"),
+        pytest.param(LD, "0.8 MB", id="LD"),
+        pytest.param(AUDIO, "0.3 MB", id="AUDIO"),
+    ],
+)
+def test_get_video_size_video_downloader_unavailable(
+    download_options: DownloadOptions,
+    expected_size: str,
+) -> None:
+    assert (
+        VideoDownloader("https://www.youtube.com/watch?v=jNQXAC9IVRw")._get_video_size(
+            download_options,
+        )
+        == expected_size
+    )
+
+
+@pytest.mark.parametrize(
+    "download_options",
+    [
+        pytest.param(HD, id="HD"),
+        pytest.param(LD, id="LD"),
+        pytest.param(AUDIO, id="AUDIO"),
+    ],
+)
+def test_stream_selection_video_downloader(
+    video_downloader: VideoDownloader,
+    download_options: DownloadOptions,
+) -> None:
+    stream_selection: Stream | None = video_downloader._stream_selection[
+        download_options
+    ]
+    if stream_selection is None:  # pragma: no cover # pylint: disable=R1705
+        return
+    else:  # pragma: no cover  # noqa: RET505
+        assert stream_selection.resolution == download_options.resolution
+        assert stream_selection.type == download_options.type
+        assert stream_selection.is_progressive is download_options.progressive
+
+        if download_options.type == "audio":  # specific ABR is only relevant for audio
+            assert stream_selection.abr == download_options.abr
+
+
+def test_playlist_property_playlist_downloader(
+    youtube_playlist: Playlist,
+    playlist_downloader: PlaylistDownloader,
+) -> None:
+    assert playlist_downloader._playlist_info.video_ids == tuple(
+        video.video_id for video in youtube_playlist.videos
+    )
+
+
+@pytest.mark.parametrize(
+    ("download_options", "expected_size"),
+    [
+        pytest.param(HD, "162.9 MB", id="HD"),
+        pytest.param(LD, "104.2 MB", id="LD"),
+        pytest.param(AUDIO, "71.2 MB", id="AUDIO"),
+    ],
+)
+def test_get_playlist_size_playlist_downloader(
+    playlist_downloader: PlaylistDownloader,
+    download_options: DownloadOptions,
+    expected_size: str,
+) -> None:
+    assert playlist_downloader._get_playlist_size(download_options) in {
+        expected_size,
+        "Unavailable",
+    }
+
+
+@pytest.mark.parametrize(
+    "download_options",
+    [
+        pytest.param(HD, id="HD"),
+        pytest.param(LD, id="LD"),
+        pytest.param(AUDIO, id="AUDIO"),
+    ],
+)
+def test_stream_selection_len_playlist_downloader(
+    playlist_downloader: PlaylistDownloader,
+    download_options: DownloadOptions,
+) -> None:
+    stream_selection: list[PlaylistItem] | None = playlist_downloader._stream_selection[
+        download_options
+    ]
+    assert (
+        stream_selection is None
+        or len(stream_selection) == playlist_downloader._playlist_info.length
+    )
+
+
+@pytest.mark.parametrize(
+    "download_options",
+    [
+        pytest.param(HD, id="HD"),
+        pytest.param(LD, id="LD"),
+        pytest.param(AUDIO, id="AUDIO"),
+    ],
+)
+def test_stream_selection_playlist_downloader(
+    playlist_downloader: PlaylistDownloader,
+    download_options: DownloadOptions,
+) -> None:
+    stream_selection: list[PlaylistItem] | None = playlist_downloader._stream_selection[
+        download_options
+    ]
+
+    if stream_selection is None:  # pragma: no cover
+        return
+    for item in stream_selection:  # pragma: no cover
+        # only the compact records of the selected streams are kept
+        assert item.video_id in playlist_downloader._playlist_info.video_ids
+        assert f"itag={item.itag}" in item.url
+        assert item.expires > 0